@@ -6,12 +6,17 @@ setup(
     version="0.0.1",
     packages=find_packages(),
     zip_safe=False,
+    python_requires=">=3.9",
     include_package_data=True,
+    package_data={"vbox": ["fixtures/*.txt"]},
     install_requires=[
         "setuptools",
         "fastapi",
         "click",
+        "httpx",
+        "uvicorn>=0.19",
     ],
+    extras_require={"test": ["pytest", "pytest-benchmark"]},
     entry_points="""
       [console_scripts]
       vbox=vbox.vboxclient:main
@@ -0,0 +1,27 @@
+import asyncio
+import pytest
+from vbox import vboxbench
+from vbox.vboxfake import loadRecordings
+
+
+@pytest.fixture(scope="session")
+def recordings():
+    return loadRecordings()
+
+
+@pytest.fixture(scope="session")
+def run():
+    # one loop for the whole session, the module level locks of vboxapi bind
+    # to the first loop they wait on
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture
+def replayed(recordings):
+    """
+    Answers VBoxManage from the recorded fixtures, with an empty cache
+    """
+    with vboxbench.replay(recordings) as backend:
+        yield backend
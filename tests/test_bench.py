@@ -0,0 +1,39 @@
+"""
+The vboxbench parser benchmarks, timed with pytest-benchmark:
+
+    pytest tests/test_bench.py --benchmark-only
+"""
+import pytest
+from vbox import vboxapi, vboxbench
+
+pytest.importorskip("pytest_benchmark")
+
+PARSERS = sorted(vboxbench._replayed(vboxbench.loadRecordings())[1])
+
+
+@pytest.mark.parametrize("name", PARSERS)
+def test_fixture(benchmark, replayed, recordings, run, name):
+    factory = vboxbench._replayed(recordings)[1][name]
+    # warm up once so cached lookups (the medium index) are hits
+    run(factory())
+    benchmark(lambda: run(factory()))
+
+
+def test_machinereadable(benchmark):
+    lines, media = vboxbench.machineReadableOutput()
+    benchmark(vboxapi._parseMachineReadable, lines)
+
+
+def test_storage(benchmark, run):
+    lines, media = vboxbench.machineReadableOutput()
+    disks = vboxapi._parseMachineReadable(lines)[2]
+    vboxapi._cache.set("media", vboxapi.MediumIndex(media), 3600)
+    try:
+        benchmark(lambda: run(vboxapi._getStorageInfo(disks)))
+    finally:
+        vboxapi._cache.invalidate("media")
+
+
+def test_nics(benchmark, recordings):
+    lines = recordings[("showvminfo", "manynics")][1].decode("ascii").splitlines()
+    benchmark(vboxapi._parseNicInfo, lines)
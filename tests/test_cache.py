@@ -0,0 +1,65 @@
+import asyncio
+from vbox.vboxcache import SingleFlight, TTLCache
+
+
+def test_collapses_concurrent_calls(run):
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", call) for _ in range(5)))
+
+    assert run(main()) == ["done"] * 5
+    assert len(calls) == 1
+    assert flights.stats()["recent"] == [{"key": "key", "callers": 5}]
+
+
+def test_caller_after_last_waiter_left(run):
+    # the last waiter going away cancels the flight; a caller arriving before
+    # the cancellation has landed must get a fresh flight, not CancelledError
+    flights = SingleFlight()
+    started = []
+
+    async def call():
+        started.append(1)
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            # a call taking a while to clean up after being cancelled
+            await asyncio.sleep(0.05)
+            raise
+        return "late"
+
+    async def quick():
+        return "fresh"
+
+    async def main():
+        first = asyncio.create_task(flights.do("key", call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert first.cancelled()
+        result = await flights.do("key", quick)
+        # let the cancelled flight finish cleaning up
+        await asyncio.sleep(0.1)
+        return result
+
+    assert run(main()) == "fresh"
+    assert started == [1]
+
+
+def test_resize_evicts_least_recently_used():
+    cache = TTLCache(maxsize=4)
+    for num in range(4):
+        cache.set(num, num, 60)
+    cache.get(0)
+    cache.resize(2)
+    assert cache.get(0) == (True, 0)
+    assert cache.get(3) == (True, 3)
+    assert cache.get(1) == (False, None)
+    assert cache.stats()["maxsize"] == 2
@@ -0,0 +1,81 @@
+import json
+import pytest
+from vbox import vboxapi
+
+CHAIN = "c0ffee03-0000-4000-8000-000000000003"
+
+
+async def _body(response):
+    # runs a streaming response, returning its NDJSON records
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}}
+    await response(scope, receive, send)
+    data = b"".join(message.get("body", b"") for message in messages)
+    return [json.loads(line) for line in data.splitlines()]
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(vboxapi, "ExecPerVM", 1)
+    monkeypatch.setattr(vboxapi, "ExecConcurrency", 8)
+    yield
+    assert not vboxapi._exec_running
+
+
+def test_per_vm_limit_by_uuid(replayed, run, limits):
+    body = vboxapi.execInput(exe="/bin/true", username="user", password="secret")
+
+    async def main():
+        response = await vboxapi.execInGuest("chain", body)
+        # reserved by the handler already, whichever way the VM is named
+        with pytest.raises(vboxapi.HTTPException) as raised:
+            await vboxapi.execInGuest(CHAIN, body)
+        assert raised.value.status_code == 429
+        return await _body(response)
+
+    records = run(main())
+    # there is no recording of guestcontrol, VBoxManage "fails"
+    assert records[-1]["exit"] == 1
+
+
+def test_final_record_on_unexpected_error(replayed, run, limits, monkeypatch):
+    body = vboxapi.execInput(exe="/bin/true", username="user", password="secret")
+
+    async def failing(command):
+        if "guestcontrol" in command:
+            raise RuntimeError("backend broke")
+        return await replayed(command)
+
+    monkeypatch.setattr(vboxapi, "VBoxManageBackend", failing)
+
+    async def main():
+        return await _body(await vboxapi.execInGuest("chain", body))
+
+    records = run(main())
+    assert records == [
+        {
+            "exit": None,
+            "seconds": records[-1]["seconds"],
+            "bytes": {"stdout": 0, "stderr": 0},
+            "errors": ["backend broke"],
+            "truncated": False,
+            "timed_out": False,
+        }
+    ]
+
+
+def test_slot_released_once():
+    release = vboxapi._execReserve(CHAIN)
+    other = vboxapi._execReserve(CHAIN)
+    release()
+    release()
+    assert vboxapi._exec_running[CHAIN] == 1
+    other()
+    assert not CHAIN in vboxapi._exec_running
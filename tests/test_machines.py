@@ -0,0 +1,101 @@
+import asyncio
+import time
+import pytest
+from vbox import vboxapi
+
+
+@pytest.fixture
+def stale_table(monkeypatch):
+    # a state table that hasn't seen any VM registered yet
+    monkeypatch.setattr(vboxapi._state_watcher, "last_poll", time.monotonic())
+    monkeypatch.setattr(vboxapi._state_watcher, "machines", {})
+    monkeypatch.setattr(vboxapi._state_watcher, "names", {})
+    monkeypatch.setattr(vboxapi._state_watcher, "wake", lambda: None)
+
+
+def test_resolve_machines_missing_from_table(replayed, run, stale_table):
+    resolved = run(
+        vboxapi._resolveMachines(["manynics", "c0ffee02-0000-4000-8000-000000000002", "ghost"])
+    )
+    assert resolved == {
+        "manynics": "c0ffee01-0000-4000-8000-000000000001",
+        "c0ffee02-0000-4000-8000-000000000002": "c0ffee02-0000-4000-8000-000000000002",
+    }
+
+
+def test_bulk_info_missing_from_table(replayed, run, stale_table):
+    body = vboxapi.bulkInput(machines=["chain", "ghost"], fields="name")
+    result = run(vboxapi.getMachinesBulkInfo(body, vboxapi.Response()))
+    assert result["machines"] == {"chain": {"name": "chain"}}
+    assert result["errors"]["ghost"]["status"] == 404
+
+
+def test_control_unknown_machine(replayed, run, stale_table):
+    body = vboxapi.controlInput(op="start")
+    with pytest.raises(vboxapi.HTTPException) as raised:
+        run(vboxapi.controlMachineState("ghost", body))
+    assert raised.value.status_code == 405
+
+
+def test_readonly_commands():
+    assert vboxapi._isReadonly(["list", "vms"])
+    assert vboxapi._isReadonly(["metrics", "query", "*", "CPU/Load/User"])
+    assert vboxapi._isReadonly(["guestproperty", "enumerate", "vm"])
+    assert not vboxapi._isReadonly(["metrics", "setup", "--period", "10"])
+    assert not vboxapi._isReadonly(["guestproperty", "set", "vm", "name", "value"])
+    assert not vboxapi._isReadonly(["startvm", "vm"])
+
+
+def test_read_after_mutation_starts_new_flight(run, monkeypatch):
+    # a poll started before startvm must not answer a read issued after it
+    state = {"vm1": "poweroff"}
+
+    async def backend(command):
+        opts = command[len(vboxapi.VBoxManagePath) :]
+        if opts[0] == "startvm":
+            state["vm1"] = "running"
+            return 0, b"", b""
+        observed = state["vm1"]
+        await asyncio.sleep(0.05)
+        return 0, f'VMState="{observed}"\n'.encode("ascii"), b""
+
+    monkeypatch.setattr(vboxapi, "VBoxManageBackend", backend)
+
+    async def main():
+        poll = asyncio.ensure_future(vboxapi._getMachineState("vm1"))
+        await asyncio.sleep(0.01)
+        await vboxapi._runVBoxManage(["startvm", "vm1"])
+        after = await vboxapi._getMachineState("vm1")
+        return await poll, after
+
+    assert run(main()) == ("poweroff", "running")
+
+
+def test_event_stream_keepalive_and_timeout(run, monkeypatch):
+    monkeypatch.setattr(vboxapi, "_keepalive", 0.02)
+
+    def render(event):
+        if event is None:
+            return [("snapshot", [])], False
+        return [("state", event)], event == "last"
+
+    async def collect(events, timeout=None):
+        return [frame async for frame in vboxapi._eventStream(events, render, timeout)]
+
+    async def main():
+        events = asyncio.Queue()
+        for event in ("first", "last"):
+            events.put_nowait(event)
+        ended = await collect(events)
+        idle = await collect(asyncio.Queue(), timeout=0.05)
+        return ended, idle
+
+    ended, idle = run(main())
+    assert ended == [
+        "event: snapshot\ndata: []\n\n",
+        'event: state\ndata: "first"\n\n',
+        'event: state\ndata: "last"\n\n',
+    ]
+    assert idle[0] == "event: snapshot\ndata: []\n\n"
+    assert ": keepalive\n\n" in idle
+    assert idle[-1] == "event: timeout\ndata: 0.05\n\n"
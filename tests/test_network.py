@@ -0,0 +1,32 @@
+import time
+import pytest
+from vbox import vboxapi
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = vboxapi.NetworkIndex()
+    monkeypatch.setattr(vboxapi, "_network_index", index)
+    return index
+
+
+def test_unstattable_settings_trusted_for_a_while(replayed, run, index, monkeypatch):
+    # the recorded settings files don't exist here, like with a remote VBoxManage
+    assert run(vboxapi._refreshNetworkIndex()) == 3
+    assert index.attached("hostonly", "vboxnet0") == {"manynics": ["2"]}
+    calls = replayed.calls
+    assert run(vboxapi._refreshNetworkIndex()) == 0
+    monkeypatch.setattr(vboxapi, "NetworkIndexTTL", 0)
+    assert run(vboxapi._refreshNetworkIndex()) == 3
+    assert replayed.calls > calls
+
+
+def test_signature_of_settings_saved_during_read(tmp_path):
+    path = tmp_path / "vm.vbox"
+    before = time.time_ns()
+    path.write_text("<VirtualBox/>")
+    # saved after the read began: no signature, read again next time
+    assert vboxapi._settingsSignature(str(path), before) is None
+    assert vboxapi._settingsSignature(str(path), time.time_ns() + 3_000_000_000)
+    assert vboxapi._settingsSignature(str(path))
+    assert vboxapi._settingsSignature(str(tmp_path / "gone.vbox")) is None
@@ -0,0 +1,188 @@
+"""
+Runs the VBoxManage output parsers against the recordings in vbox/fixtures
+"""
+import pytest
+from vbox import vboxapi
+
+UUIDS = {
+    "manynics": "c0ffee01-0000-4000-8000-000000000001",
+    "manyctl": "c0ffee02-0000-4000-8000-000000000002",
+    "chain": "c0ffee03-0000-4000-8000-000000000003",
+}
+
+
+def test_host_info(replayed, run):
+    info = run(vboxapi._listHostInfo())
+    assert info["version"] == "7.0.10r158379"
+    assert info["CPUs"]
+    for cpu in info["CPUs"].values():
+        assert set(cpu) == {"speed", "description"}
+
+
+def test_host_extpacks(replayed, run):
+    extpacks = run(vboxapi._listHostExtpacks())
+    assert "0" in extpacks
+    for extpack in extpacks.values():
+        assert {"Name", "Version", "Revision", "Usable"} <= set(extpack)
+
+
+def test_host_ostypes(replayed, run):
+    ostypes = run(vboxapi._listHostOstypes())
+    assert "Other" in ostypes
+    for ostype in ostypes.values():
+        assert {"Description", "Family ID", "Family Desc", "64 bit"} <= set(ostype)
+
+
+def test_host_properties(replayed, run):
+    properties = run(vboxapi._listHostProperties())
+    assert properties["API version"] == "7_0"
+    assert all(type(value) is str for value in properties.values())
+
+
+def test_machines(replayed, run):
+    machines, running = run(vboxapi._listMachines())
+    assert machines == UUIDS
+    assert running == {UUIDS["chain"]}
+
+
+def test_media(replayed, run):
+    media = run(vboxapi._listMedia())
+    assert media
+    for uuid, medium in media.items():
+        assert {"Device", "State", "Type", "Location", "Format", "Capacity"} <= set(medium)
+        if "Parent UUID" in medium:
+            assert medium["Parent UUID"] in media
+
+
+def test_networks(replayed, run):
+    dhcpservers = run(vboxapi.getDhcpserversList())
+    server = dhcpservers["HostInterfaceNetworking-vboxnet0"]
+    assert {"IP", "NetworkMask", "lowerIPAddress", "upperIPAddress", "Enabled"} <= set(server)
+    assert type(server["Global opts"]) is dict
+    hostonlynets = run(vboxapi.getHostonlynetsList())
+    assert {"GUID", "IPAddress"} <= set(hostonlynets["vboxnet0"])
+    intnets = run(vboxapi.getInternalnetsList())
+    assert intnets[:2] == ["intnet0", "intnet1"]
+    natnetworks = run(vboxapi.getNatnetworksList())
+    forwarding = natnetworks["NatNetwork0"]["Port forwarding"]
+    assert set(forwarding) == {"ipv4", "ipv6"}
+
+
+def test_nic_info(replayed, run):
+    nics = run(vboxapi.getNicInfo("manynics"))
+    assert nics["1"]["Attachment"] == "nat"
+    assert nics["1"]["Socket"] == {"send": "128", "receive": "128"}
+    assert nics["2"]["Attachment"] == "hostonly"
+    assert nics["2"]["network"] == "vboxnet0"
+    assert nics["8"] == "disabled"
+    for nic in nics.values():
+        if nic == "disabled":
+            continue
+        assert {"MAC", "Attachment", "Type", "Boot priority", "Promisc Policy"} <= set(nic)
+
+
+def test_shared_folders(replayed, run):
+    shares = run(vboxapi._buildSharedFolders("manynics"))
+    assert set(shares["src"]) == {"Path", "Readonly", "Mountpoint", "Automount"}
+
+
+def test_storage(replayed, run, recordings):
+    lines = recordings[("showvminfo", "manyctl", "--machinereadable")][1]
+    disks = vboxapi._parseMachineReadable(lines.decode("ascii").splitlines())[2]
+    storage = run(vboxapi._getStorageInfo(disks))
+    controller = storage["0"]
+    assert {"name", "bus", "controller", "portcount", "bootable"} <= set(controller)
+    for port in controller["ports"].values():
+        if port:
+            assert {"medium", "devtype", "UUID"} <= set(port)
+
+
+@pytest.mark.parametrize("vm", sorted(UUIDS))
+def test_node_info(replayed, run, vm):
+    nodeinfo = run(vboxapi.getMachinesNodeInfo(vm))
+    assert nodeinfo["name"] == vm
+    assert nodeinfo["UUID"] == UUIDS[vm]
+    assert {"ostype", "CfgFile", "VMState", "memory", "cpus"} <= set(nodeinfo)
+    assert nodeinfo["nics"]
+    for nic in nodeinfo["nics"].values():
+        if nic == "disabled":
+            continue
+        assert {"MAC", "Attachment", "Type"} <= set(nic)
+    for controller in nodeinfo["storage"].values():
+        assert {"name", "bus", "ports"} <= set(controller)
+
+
+def test_node_info_fields(replayed, run):
+    nodeinfo = run(vboxapi.getMachinesNodeInfo("chain", fields="name,nics"))
+    assert set(nodeinfo) == {"name", "nics"}
+
+
+def test_missing_machine(replayed, run):
+    with pytest.raises(vboxapi.HTTPException) as raised:
+        run(vboxapi.getMachinesNodeInfo("ghost"))
+    assert raised.value.status_code in (404, 405)
+
+
+# NICs as the baseline reported them: getNicInfo, pruned like the rest of
+# the details
+BASELINE_NICS = {
+    "manyctl": {
+        "1": {
+            "MAC": "080027000011",
+            "Attachment": "nat",
+            "Cable connected": "on",
+            "Type": "82540EM",
+            "Reported speed": "0 Mbps",
+            "Boot priority": "0",
+            "Promisc Policy": "deny",
+            "MTU": "0",
+            "Socket": {"send": "64", "receive": "64"},
+            "TCP Window": {"send": "64", "receive": "64"},
+        }
+    },
+    "chain": {
+        "1": {
+            "MAC": "080027000021",
+            "interface": "eno1",
+            "Attachment": "bridged",
+            "Cable connected": "on",
+            "Type": "virtio",
+            "Reported speed": "0 Mbps",
+            "Boot priority": "1",
+            "Promisc Policy": "allow-all",
+            "Bandwidth group": "limited",
+        }
+    },
+}
+
+
+@pytest.mark.parametrize("vm", sorted(UUIDS))
+def test_node_info_nics_match_baseline(replayed, run, vm):
+    # whatever the NICs are attached to, every VM reports them in full
+    nics = run(vboxapi.getMachinesNodeInfo(vm))["nics"]
+    assert nics == vboxapi._prune_data(run(vboxapi.getNicInfo(vm)))
+    if vm in BASELINE_NICS:
+        assert nics == BASELINE_NICS[vm]
+    for nic in nics.values():
+        assert {"Boot priority", "Promisc Policy"} <= set(nic)
+
+
+def test_storage_rebuilds_stale_media(replayed, run, recordings):
+    lines = recordings[("showvminfo", "manyctl", "--machinereadable")][1]
+    disks = vboxapi._parseMachineReadable(lines.decode("ascii").splitlines())[2]
+    vboxapi._cache.set("media", vboxapi.MediumIndex({}), 3600)
+    storage = run(vboxapi._getStorageInfo(disks))
+    assert any(port for port in storage["0"]["ports"].values())
+    hit, medium_index = vboxapi._cache.get("media")
+    assert hit and medium_index.media
+
+
+def test_storage_unknown_medium(replayed, run):
+    disks = {
+        "storagecontrollername0": "SATA",
+        "storagecontrollertype0": "IntelAhci",
+        "SATA-0-0": "/tmp/gone.vdi",
+        "SATA-ImageUUID-0-0": "deadbeef-0000-4000-8000-000000000000",
+    }
+    storage = run(vboxapi._getStorageInfo(disks))
+    assert storage["0"]["ports"] == {"0-0": {}}
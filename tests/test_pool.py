@@ -0,0 +1,40 @@
+import asyncio
+from vbox.vboxpool import WarmPool
+
+
+def test_adopts_vms_left_behind(run):
+    registered = {"base-pool-0000000a", "base-pool-0000000b", "base-pool-0000000c", "other"}
+    calls = []
+
+    async def build(template, name):
+        calls.append(("build", name))
+        registered.add(name)
+
+    async def recycle(template, name):
+        calls.append(("recycle", name))
+        if name == "base-pool-0000000c":
+            # interrupted before its snapshot was taken
+            raise RuntimeError("no pool snapshot")
+
+    async def destroy(name):
+        calls.append(("destroy", name))
+        registered.discard(name)
+
+    async def existing():
+        return sorted(registered)
+
+    async def main():
+        pool = WarmPool(build, recycle, destroy, existing, retry_interval=0.01)
+        pool.configure({"base": 1})
+        pool.start()
+        await asyncio.sleep(0.1)
+        await pool.stop()
+        return pool
+
+    pool = run(main())
+    # nothing built, one of the two good VMs kept, the other and the broken
+    # one destroyed, the VM that isn't the pool's left alone
+    assert not [call for call in calls if call[0] == "build"]
+    assert len(pool.ready["base"]) == 1
+    assert registered == {*pool.ready["base"], "other"}
+    assert ("destroy", "base-pool-0000000c") in calls
@@ -0,0 +1,47 @@
+import asyncio, contextvars
+from vbox.vboxtasks import cancelTasks, detachTask, publish
+
+
+def test_publish_drops_oldest_of_slow_consumers(run):
+    async def main():
+        slow, fast = asyncio.Queue(maxsize=2), asyncio.Queue(maxsize=10)
+        for event in range(4):
+            publish([slow, fast], event)
+        return [slow.get_nowait() for _ in range(slow.qsize())], fast.qsize()
+
+    assert run(main()) == ([2, 3], 4)
+
+
+def test_cancel_tasks_cancels_again(run):
+    cancelled = []
+
+    async def stubborn():
+        # swallows the first cancellation, like a lost wait_for one
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+        await asyncio.sleep(60)
+
+    async def main():
+        tasks = [asyncio.create_task(stubborn()), None]
+        await asyncio.sleep(0)
+        await cancelTasks(tasks)
+        return tasks[0]
+
+    task = run(main())
+    assert task.cancelled()
+    assert cancelled == [1]
+
+
+def test_detach_task_fresh_context(run):
+    var = contextvars.ContextVar("var", default=None)
+
+    async def read():
+        return var.get()
+
+    async def detached():
+        var.set("request")
+        return await detachTask(read())
+
+    assert run(detached()) is None
@@ -0,0 +1,118 @@
+from xml.etree import ElementTree
+from vbox import vboxapi, vboxxml
+
+MACHINE = """
+<Machine name="xml" uuid="{c0ffee04-0000-4000-8000-000000000004}">
+  <Hardware>
+    <Network>
+      <Adapter slot="0" enabled="true" MACAddress="080027000041" type="virtio" bootPriority="2">
+        <NAT mtu="1500" sockrcv="128" socksnd="128"/>
+      </Adapter>
+      <Adapter slot="1" enabled="true" MACAddress="080027000042" cable="false"
+          promiscuousModePolicy="AllowNetwork" bandwidthGroup="slow" trace="true"
+          traceFile="/srv/trace/xml.pcap">
+        <HostOnlyInterface name="vboxnet0"/>
+      </Adapter>
+      <Adapter slot="2" enabled="true" MACAddress="080027000043">
+        <GenericInterface driver="UDPTunnel">
+          <Property name="dest" value="10.0.0.2"/>
+          <Property name="dport" value="10001"/>
+        </GenericInterface>
+      </Adapter>
+    </Network>
+  </Hardware>
+</Machine>
+"""
+
+
+def test_nic_info():
+    # the settings file NICs go through the same parser as VBoxManage output
+    lines = vboxxml._parseNicInfo(ElementTree.fromstring(MACHINE))
+    nics = vboxapi._parseNicInfo(lines)
+    assert nics["1"] == {
+        "MAC": "080027000041",
+        "Attachment": "nat",
+        "Cable connected": "on",
+        "Trace": "off",
+        "Trace file": "none",
+        "Type": "virtio",
+        "Reported speed": "0 Mbps",
+        "Boot priority": "2",
+        "Promisc Policy": "deny",
+        "Bandwidth group": "none",
+        "MTU": "1500",
+        "Socket": {"send": "128", "receive": "128"},
+        "TCP Window": {"send": "64", "receive": "64"},
+    }
+    assert nics["2"] == {
+        "MAC": "080027000042",
+        "network": "vboxnet0",
+        "Attachment": "hostonly",
+        "Cable connected": "off",
+        "Trace": "on",
+        "Trace file": "/srv/trace/xml.pcap",
+        "Type": "Am79C973",
+        "Reported speed": "0 Mbps",
+        "Boot priority": "0",
+        "Promisc Policy": "allow-vms",
+        "Bandwidth group": "slow",
+    }
+    assert nics["3"]["generic driver"] == "UDPTunnel"
+    assert nics["3"]["generic properties"] == {"dest": "10.0.0.2", "dport": "10001"}
+    assert [nics[str(num)] for num in range(4, 9)] == ["disabled"] * 5
+
+
+REGISTRY = """<?xml version="1.0"?>
+<VirtualBox xmlns="http://www.virtualbox.org/" version="1.19-linux">
+  <Global>
+    <MachineRegistry>
+{entries}
+    </MachineRegistry>
+  </Global>
+</VirtualBox>
+"""
+
+SETTINGS = """<?xml version="1.0"?>
+<VirtualBox xmlns="http://www.virtualbox.org/" version="1.19-linux">
+  <Machine uuid="{{{uuid}}}" name="{name}" OSType="Debian_64">
+    <Hardware/>
+  </Machine>
+</VirtualBox>
+"""
+
+
+def _home(tmp_path, names):
+    entries = []
+    for num, name in enumerate(names):
+        uuid = f"c0ffee10-0000-4000-8000-{num:012x}"
+        path = tmp_path / f"{name}.vbox"
+        path.write_text(SETTINGS.format(uuid=uuid, name=name))
+        entries.append(f'      <MachineEntry uuid="{{{uuid}}}" src="{path}"/>')
+    (tmp_path / "VirtualBox.xml").write_text(REGISTRY.format(entries="\n".join(entries)))
+
+
+def test_machine_stats_only_its_settings(tmp_path, monkeypatch):
+    _home(tmp_path, [f"vm{num}" for num in range(20)])
+    config = vboxxml.XMLConfig(str(tmp_path))
+    assert config.machine("vm3")["name"] == "vm3"
+    stats = []
+    stat = vboxxml.os.stat
+    monkeypatch.setattr(vboxxml.os, "stat", lambda path: stats.append(path) or stat(path))
+    assert config.machine("vm7")["uuid"] == "c0ffee10-0000-4000-8000-000000000007"
+    assert config.machine("c0ffee10-0000-4000-8000-000000000008")["name"] == "vm8"
+    # VirtualBox.xml and the VM's own settings file, each time
+    assert len(stats) == 4
+    assert stats[1] == str(tmp_path / "vm7.vbox")
+
+
+def test_machine_renamed_or_registered(tmp_path):
+    _home(tmp_path, ["one", "two"])
+    config = vboxxml.XMLConfig(str(tmp_path))
+    assert config.machine("three") is None
+    # renamed without VirtualBox.xml changing
+    path = tmp_path / "two.vbox"
+    path.write_text(path.read_text().replace('name="two"', 'name="deux"'))
+    assert config.machine("two") is None
+    assert config.machine("deux")["name"] == "deux"
+    _home(tmp_path, ["one", "two", "three"])
+    assert config.machine("three")["name"] == "three"
@@ -1,44 +1,922 @@
-import re, subprocess
-from fastapi import FastAPI, HTTPException
+import asyncio, bisect, codecs, collections, contextlib, contextvars, fnmatch, hashlib, json
+import logging, os, random, re, signal, tempfile, time
+from datetime import datetime, timezone
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from .vboxcache import SingleFlight, TTLCache
+from .vboxguest import GuestPropertyWatcher, matchName, matchProperties
+from .vboxjobs import JobQueue, KeyedLock
+from .vboxmetrics import Registry
+from .vboxpool import WarmPool
+from .vboxsamples import MetricsSampler
+from .vboxserver import findVBoxManage
+from .vboxstate import StateWatcher
+from .vboxxml import XMLConfig, XMLConfigError
 
-app = FastAPI()
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# TODO: need to add multi-OS "which" to find this
-VBoxManagePath = ["/usr/bin/VBoxManage"]
+# $VBOX_MANAGE, else found on the PATH or where VirtualBox installs it
+VBoxManagePath = [findVBoxManage()]
+# maximum number of VBoxManage processes allowed to run at the same time
+VBoxManageConcurrency = 16
+# seconds a single VBoxManage invocation may run before it is killed
+VBoxManageTimeout = 60
+# times a VBoxManage command failing with a transient error (session locked,
+# machine busy) is run again, and the backoff before the first retry in
+# seconds, doubled for every further one
+VBoxManageRetries = 4
+VBoxManageBackoff = 0.25
+# coroutine function used instead of spawning VBoxManage, called with the full
+# command and returning (returncode, stdout, stderr), see vboxbench.ReplayBackend
+VBoxManageBackend = None
+# seconds a cached result may be served before VBoxManage is asked again
+CacheTTL = {
+    "host": 300,
+    "extpacks": 300,
+    "ostypes": 3600,
+    "properties": 300,
+    "media": 5,
+    "groups": 30,
+    "guestproperties": 5,
+}
+# seconds the network index trusts the NICs of a VM whose settings file
+# can't be stat'ed (VBoxManage on another host), before reading them again
+NetworkIndexTTL = 60
+# maximum number of VMs queried at the same time by the bulk endpoints
+BulkConcurrency = 8
+# parts of the VM details that take their own parsing or VBoxManage runs,
+# built only when asked for with include= or fields=
+MachineSections = ("vrde", "shares", "nics", "storage")
+# keep the VM state table fresh in the background
+StateWatcherEnabled = True
+# seconds between state polls: fastest while VMs are changing, slowest when idle
+StateWatcherInterval = (1, 15)
+# number of workers running queued bulk operations
+JobWorkers = 8
+# maximum queued operations started per second, 0 for no limit
+JobRate = 0
+# medium operations (create, clone, resize, compact) run at the same time,
+# they compete for the same disks
+MediumWorkers = 2
+# seconds a single medium operation may run before it is killed
+MediumTimeout = 6 * 3600
+# fill the host detail caches and the VM state table before the first
+# request is served, giving up on whatever isn't done after WarmUpTimeout seconds
+WarmUp = True
+WarmUpTimeout = 30
+# maximum number of cached results kept, least recently used are evicted first
+CacheSize = 256
+# serialized inventory responses kept by ETag, see _respond
+BodyCacheSize = 32
+# add the Server-Timing breakdown to every response, not only to those of
+# requests sending an X-VBox-Trace header
+TraceRequests = False
+# answer VM list, medium and powered off VM detail queries from VirtualBox.xml
+# and the .vbox files instead of running VBoxManage, see vboxxml
+XMLBackend = False
+# VirtualBox settings directory read by the XML backend, None to find it
+# the way VirtualBox does
+VBoxUserHome = None
+# sample the performance metrics of the running VMs in the background
+MetricsEnabled = True
+# seconds between metric samples
+MetricsInterval = 10
+# samples kept per VM and metric: raw ones, then 1 minute and 1 hour averages
+MetricsRetention = {"raw": 360, "1m": 1440, "1h": 168}
+# template VM -> {"snapshot": snapshot the linked clones are made from,
+# "size": clones kept ready, "start": boot them before they are leased}
+PoolTemplates = {}
+# pool VMs built or recycled at the same time, across every template
+PoolConcurrency = 2
+# seconds each guestproperty wait of the shared guest property watchers runs
+# before the properties are enumerated again
+GuestPropertyInterval = 30
+# longest a client may wait for a guest property, in seconds
+GuestPropertyMaxWait = 600
+# guest account commands run as when an exec request names none, and the
+# host file holding its password
+GuestUsername = None
+GuestPasswordFile = None
+# guest commands running at the same time on the whole host and per VM,
+# requests over either are turned away with a 429
+ExecConcurrency = 8
+ExecPerVM = 2
+# longest a guest command may run in seconds, and the most output it may
+# print before it is killed
+ExecTimeout = 3600
+ExecOutputLimit = 16 * 1024 * 1024
+# VirtualBox metrics sampled, the Guest/ ones need the guest additions
+MetricsNames = (
+    "CPU/Load/User",
+    "CPU/Load/Kernel",
+    "RAM/Usage/Used",
+    "Disk/Usage/Used",
+    "Net/Rate/Rx",
+    "Net/Rate/Tx",
+    "Guest/CPU/Load/User",
+    "Guest/CPU/Load/Kernel",
+    "Guest/RAM/Usage/Free",
+    "Guest/RAM/Usage/Total",
+)
 
+# every VBoxManage invocation is logged at DEBUG, failures at INFO
+logger = logging.getLogger(__name__)
 
-def _runVBoxManage(opts):
+# subcommands that never change VM or host state, so their output can be shared
+_readonly_subcommands = ("-v", "list", "showvminfo", "showmediuminfo")
+# verbs that never change anything of subcommands that have others too
+_readonly_verbs = {
+    "guestproperty": ("enumerate", "get", "wait"),
+    "metrics": ("query", "list"),
+}
+# VBoxManage error fragments and the status they are reported with, first match wins
+_error_statuses = (
+    ("VBOX_E_OBJECT_NOT_FOUND", 404),
+    ("E_ACCESSDENIED", 403),
+    ("VBOX_E_INVALID_VM_STATE", 409),
+    ("VBOX_E_INVALID_OBJECT_STATE", 409),
+    ("VBOX_E_INVALID_SESSION_STATE", 409),
+)
+# percentages printed by long running subcommands: 0%...10%...20%
+_progress = re.compile(rb"(\d+)%")
+# error fragments of failures that clear up by themselves, retried with backoff
+_transient_errors = ("is already locked", "being locked or unlocked", "is busy")
+
+_vboxmanage_limit = None
+_vboxmanage_capture = contextvars.ContextVar("vboxmanage_capture", default=None)
+_cache = TTLCache(maxsize=CacheSize)
+# hashes of the VBoxManage output the current response is built from, see _respond
+_sources = contextvars.ContextVar("sources", default=None)
+# name -> (cached value, hash of the output it was built from)
+_cache_sources = {}
+_bodies = TTLCache(maxsize=BodyCacheSize)
+# seconds a serialized body is kept, it never goes stale under its ETag
+_body_ttl = 300
+# sets apart what only this process knows, like the state table version
+_instance = os.urandom(8).hex()
+_flights = SingleFlight()
+# bumped around every mutating VBoxManage call, reads only share a flight
+# started in the same generation so they never see state from before a change
+_generation = 0
+_jobs = JobQueue()
+_medium_jobs = JobQueue()
+# serializes the control operations of each VM
+_vm_locks = KeyedLock()
+_request_trace = contextvars.ContextVar("request_trace", default=None)
+_xml_config = None
+# what the startup probe found out about VBoxManage
+_vboxmanage_info = {"path": None, "version": None, "subcommands": None}
+# overrides XMLBackend for the current task, used by the consistency check
+_xml_enabled = contextvars.ContextVar("xml_enabled", default=None)
+
+_metrics = Registry()
+_vboxmanage_seconds = _metrics.histogram(
+    "vbox_vboxmanage_seconds",
+    "VBoxManage invocation time, waiting for a concurrency slot included.",
+    ("subcommand",),
+)
+_vboxmanage_queue_seconds = _metrics.histogram(
+    "vbox_vboxmanage_queue_seconds",
+    "Time spent waiting for one of the VBoxManageConcurrency slots.",
+)
+_vboxmanage_exits = _metrics.counter(
+    "vbox_vboxmanage_exits_total",
+    "VBoxManage invocations by exit code, timeout or cancelled.",
+    ("subcommand", "code"),
+)
+_vboxmanage_retries = _metrics.counter(
+    "vbox_vboxmanage_retries_total",
+    "VBoxManage invocations run again after a transient error.",
+    ("subcommand",),
+)
+_vboxmanage_stdout_bytes = _metrics.counter(
+    "vbox_vboxmanage_stdout_bytes_total",
+    "Bytes VBoxManage wrote to stdout.",
+    ("subcommand",),
+)
+_http_requests = _metrics.counter(
+    "vbox_http_requests_total", "HTTP requests by response status.", ("endpoint", "status")
+)
+_http_seconds = _metrics.histogram(
+    "vbox_http_request_seconds", "HTTP request time.", ("endpoint",)
+)
+_http_parse_seconds = _metrics.histogram(
+    "vbox_http_parse_seconds",
+    "HTTP request time not spent waiting for VBoxManage (parsing and encoding).",
+    ("endpoint",),
+)
+_http_spawns = _metrics.histogram(
+    "vbox_http_request_spawns",
+    "VBoxManage invocations started on behalf of an HTTP request.",
+    ("endpoint",),
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+class _CancelOnDisconnect:
+    """
+    ASGI middleware that cancels the running handler when the client goes away,
+    so any VBoxManage process started on its behalf is killed instead of orphaned
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        messages = asyncio.Queue()
+        handler = asyncio.create_task(self.app(scope, messages.get, send))
+
+        async def watch():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    handler.cancel()
+                    return
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            # only swallow the cancellation we caused ourselves
+            if not watcher.done():
+                raise
+        finally:
+            watcher.cancel()
+
+
+class _CaptureVBoxManage:
+    """
+    ASGI middleware that gives every request its own VBoxManage capture, so a
+    read-only invocation needed by several parsers is only spawned once
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _vboxmanage_capture.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _vboxmanage_capture.reset(token)
+
+
+class _Trace:
+    """
+    Where the time of a single HTTP request went
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = 0
+        self.spawns = 0
+        self.vboxmanage = 0
+        self._waiting = 0
+        self._since = None
+
+    @contextlib.contextmanager
+    def waiting(self):
+        # waits running side by side (gather) are only counted once
+        if self._waiting == 0:
+            self._since = time.perf_counter()
+        self._waiting += 1
+        try:
+            yield
+        finally:
+            self._waiting -= 1
+            if self._waiting == 0:
+                self.vboxmanage += time.perf_counter() - self._since
+
+    def timing(self):
+        total = (time.perf_counter() - self.start) * 1000
+        vboxmanage = self.vboxmanage * 1000
+        return (
+            f"vboxmanage;dur={vboxmanage:.1f}, parse;dur={total - vboxmanage:.1f}, "
+            f'total;dur={total:.1f}, calls;desc="{self.calls}", spawns;desc="{self.spawns}"'
+        )
+
+
+class _TraceRequests:
+    """
+    ASGI middleware recording the metrics of every request, and adding a
+    Server-Timing breakdown to the response when asked for with X-VBox-Trace
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = _Trace()
+        token = _request_trace.set(trace)
+        wanted = TraceRequests or any(
+            name == b"x-vbox-trace" for name, value in scope["headers"]
+        )
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if wanted:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.timing().encode("ascii")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _request_trace.reset(token)
+            route = scope.get("route")
+            endpoint = route.path if route is not None else "unmatched"
+            elapsed = time.perf_counter() - trace.start
+            _http_requests.inc(endpoint, status)
+            _http_seconds.observe(elapsed, endpoint)
+            _http_parse_seconds.observe(elapsed - trace.vboxmanage, endpoint)
+            _http_spawns.observe(trace.spawns, endpoint)
+
+
+# 'VBoxManage list ...' lines of the usage VBoxManage prints without arguments
+_usage_command = re.compile(r"^\s*VBoxManage\s+([a-z][a-z-]*)", re.MULTILINE)
+
+
+async def _probeVBoxManage():
+    _vboxmanage_info["path"] = " ".join(VBoxManagePath)
+    try:
+        _vboxmanage_info["version"] = (await _runVBoxManage(["-v"]))[0]
+        returncode, stdout, stderr = await _spawnVBoxManage([], "usage")
+    except (HTTPException, OSError) as e:
+        logger.warning("VBoxManage (%s) can't be run: %s", _vboxmanage_info["path"], e)
+        return
+    usage = (stdout + stderr).decode("ascii", "replace")
+    _vboxmanage_info["subcommands"] = sorted(set(_usage_command.findall(usage)))
+    logger.info(
+        "VBoxManage %s at %s, %s subcommands",
+        _vboxmanage_info["version"],
+        _vboxmanage_info["path"],
+        len(_vboxmanage_info["subcommands"]),
+    )
+
+
+def _supports(subcommand):
+    # anything goes when the probe didn't get that far
+    subcommands = _vboxmanage_info["subcommands"]
+    return not subcommands or subcommand in subcommands
+
+
+async def _warmUp():
+    await _probeVBoxManage()
+    warmers = [
+        _cached("host", _listHostInfo),
+        _cached("extpacks", _listHostExtpacks),
+        _cached("ostypes", _listHostOstypes),
+        _cached("properties", _listHostProperties),
+    ]
+    if StateWatcherEnabled:
+        warmers.append(_state_watcher.poll())
+    results = await asyncio.gather(*warmers, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("warm up failed: %s", result)
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app):
+    # the caches are created on import, before CacheSize and BodyCacheSize
+    # can be configured
+    _cache.resize(CacheSize)
+    _bodies.resize(BodyCacheSize)
+    if WarmUp:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(_warmUp(), WarmUpTimeout)
+        except asyncio.TimeoutError:
+            logger.warning("warm up not done after %s seconds, serving anyway", WarmUpTimeout)
+        logger.info("warmed up in %.2fs", time.perf_counter() - started)
+    if StateWatcherEnabled:
+        _state_watcher.min_interval, _state_watcher.max_interval = StateWatcherInterval
+        _state_watcher.start()
+    _jobs.workers, _jobs.rate = JobWorkers, JobRate
+    _jobs.start()
+    _medium_jobs.workers = MediumWorkers
+    _medium_jobs.start()
+    _guest_watcher.interval = GuestPropertyInterval
+    _pool.concurrency = PoolConcurrency
+    _pool.configure({template: pool["size"] for template, pool in PoolTemplates.items()})
+    _pool.start()
+    if MetricsEnabled and _supports("metrics"):
+        _metrics_sampler.metrics = MetricsNames
+        _metrics_sampler.interval = MetricsInterval
+        _metrics_sampler.retention = MetricsRetention
+        _metrics_sampler.start()
+    try:
+        yield
+    finally:
+        await _pool.stop()
+        await _guest_watcher.stop()
+        await _metrics_sampler.stop()
+        await _medium_jobs.stop()
+        await _jobs.stop()
+        await _state_watcher.stop()
+
+
+app = FastAPI(lifespan=_lifespan)
+app.add_middleware(_CaptureVBoxManage)
+app.add_middleware(_CancelOnDisconnect)
+app.add_middleware(_TraceRequests)
+
+
+def _getVBoxManageLimit():
+    global _vboxmanage_limit
+    if _vboxmanage_limit is None:
+        _vboxmanage_limit = asyncio.Semaphore(VBoxManageConcurrency)
+    return _vboxmanage_limit
+
+
+async def _execVBoxManage(command):
+    queued = time.perf_counter()
+    async with _getVBoxManageLimit():
+        _vboxmanage_queue_seconds.observe(time.perf_counter() - queued)
+        return await _communicate(command, VBoxManageTimeout)
+
+
+async def _execGuestWait(command):
+    # waiting on a guest takes no VBoxManageConcurrency slot, VBoxManage
+    # itself gives up after GuestPropertyInterval
+    return await _communicate(command, GuestPropertyInterval + VBoxManageTimeout)
+
+
+async def _communicate(command, timeout):
+    try:
+        returncode, (stdout, stderr) = await _superviseProcess(
+            command,
+            timeout,
+            lambda process: (process.stdout.read(), process.stderr.read()),
+        )
+    except asyncio.TimeoutError:
+        raise _timeoutError(timeout)
+    return returncode, stdout, stderr
+
+
+async def _superviseProcess(command, timeout, readers):
+    """
+    Runs command with readers(process) consuming its stdout and stderr,
+    killing it when it runs over timeout (raising asyncio.TimeoutError) or
+    the caller is cancelled. Returns the exit code and what the readers
+    returned
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        *outputs, returncode = await asyncio.wait_for(
+            asyncio.gather(*readers(process), process.wait()), timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.warning("killed %s after %s seconds", command, timeout)
+        raise
+    except asyncio.CancelledError:
+        # client went away - don't leave VBoxManage running in the background
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    return returncode, outputs
+
+
+def _timeoutError(timeout):
+    return HTTPException(
+        status_code=504,
+        detail=f"VBoxManage did not finish within {timeout} seconds.",
+    )
+
+
+async def _runVBoxManage(opts):
+    trace = _request_trace.get()
+    if trace is None:
+        return await _sourceVBoxManage(opts)
+    trace.calls += 1
+    with trace.waiting():
+        return await _sourceVBoxManage(opts)
+
+
+async def _sourceVBoxManage(opts):
+    if _sources.get() is None:
+        return await _shareVBoxManage(opts)
+    try:
+        output = await _shareVBoxManage(opts)
+    except HTTPException as e:
+        _addSource(opts, e.status_code, e.detail)
+        raise
+    _addSource(opts, output)
+    return output
+
+
+def _isReadonly(opts):
+    if opts[0] in _readonly_subcommands:
+        return True
+    return len(opts) > 1 and opts[1] in _readonly_verbs.get(opts[0], ())
+
+
+async def _shareVBoxManage(opts):
+    global _generation
+    capture = _vboxmanage_capture.get()
+    if not _isReadonly(opts):
+        # anything we captured or indexed so far may be stale once state has been changed
+        if capture is not None:
+            capture.clear()
+        _generation += 1
+        _invalidateMediumIndex()
+        try:
+            return await _callVBoxManage(opts)
+        finally:
+            _generation += 1
+            _invalidateMediumIndex()
+    key = (_generation, tuple(opts))
+    if capture is None:
+        return await _flights.do(key, lambda: _callVBoxManage(opts))
+    if key not in capture:
+        capture[key] = asyncio.ensure_future(
+            _flights.do(key, lambda: _callVBoxManage(opts))
+        )
+    return await capture[key]
+
+
+async def _spawnVBoxManage(opts, subcommand, execute=None):
     command = VBoxManagePath + opts
-    print(command)  # debug
-    process = subprocess.run(command, capture_output=True)
-    if process.returncode != 0:
-        error_list = process.stderr.splitlines()
-        print(error_list)  # debug
-        # if VBoxManage usage info is included in output, skip it
-        if (len(error_list) > 4) and (error_list[4] == b"Usage:"):
-            error_list = error_list[749:]
-        our_error = []
-        for err in error_list:
-            tmp_error = err.decode("ascii")
-            # strip the following prefix from error lines
-            if tmp_error.startswith("VBoxManage: error: "):
-                our_error.append(tmp_error[19:])
-            else:
-                our_error.append(tmp_error)
-        raise HTTPException(status_code=404, detail=our_error)
+    # runs in the context of the request that started it, not of those sharing it
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.spawns += 1
+    code = "error"
+    start = time.perf_counter()
+    try:
+        returncode, stdout, stderr = await (
+            VBoxManageBackend or execute or _execVBoxManage
+        )(command)
+        code = returncode
+    except asyncio.CancelledError:
+        code = "cancelled"
+        raise
+    except HTTPException:
+        code = "timeout"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _vboxmanage_seconds.observe(elapsed, subcommand)
+        _vboxmanage_exits.inc(subcommand, code)
+        logger.debug("%s exited with %s after %.3fs", command, code, elapsed)
+    _vboxmanage_stdout_bytes.inc(subcommand, amount=len(stdout))
+    if returncode != 0:
+        logger.info("%s failed: %s", command, stderr.splitlines()[:3])
+    return returncode, stdout, stderr
+
+
+async def _readProgress(stream, report):
+    # returns everything read, calling report with each percentage on the way
+    chunks = []
+    pending = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+        pending += chunk
+        for match in _progress.finditer(pending):
+            report(int(match.group(1)))
+        # a percentage may be split across reads
+        pending = pending[pending.rfind(b"%") + 1 :][-8:]
+
+
+async def _execMediumOperation(command, report):
+    # long disk operations neither take a VBoxManageConcurrency slot nor
+    # wait for all their output before reporting progress
+    try:
+        returncode, (stdout, stderr) = await _superviseProcess(
+            command,
+            MediumTimeout,
+            lambda process: (
+                _readProgress(process.stdout, report),
+                _readProgress(process.stderr, report),
+            ),
+        )
+    except asyncio.TimeoutError:
+        raise _timeoutError(MediumTimeout)
+    return returncode, stdout, stderr
+
+
+def _vboxmanageError(stderr):
+    """
+    Returns the error lines of a failed VBoxManage run and the status code
+    they translate to
+    """
+    error_list = stderr.splitlines()
+    # if VBoxManage usage info is included in output, skip it
+    if (len(error_list) > 4) and (error_list[4] == b"Usage:"):
+        error_list = error_list[749:]
+    our_error = []
+    for err in error_list:
+        tmp_error = err.decode("ascii")
+        # strip the following prefix from error lines
+        if tmp_error.startswith("VBoxManage: error: "):
+            our_error.append(tmp_error[19:])
+        else:
+            our_error.append(tmp_error)
+    text = "\n".join(our_error)
+    for fragment, status in _error_statuses:
+        if fragment in text:
+            return our_error, status
+    # anything unrecognised keeps the status the API always returned
+    return our_error, 404
+
+
+def _isTransient(stderr):
+    text = stderr.decode("ascii", "replace")
+    return any(fragment in text for fragment in _transient_errors)
+
+
+async def _callVBoxManage(opts):
+    # list covers a dozen different queries
+    subcommand = " ".join(opts[:2]) if opts[0] == "list" else opts[0]
+    attempt = 0
+    while True:
+        returncode, stdout, stderr = await _spawnVBoxManage(opts, subcommand)
+        if returncode == 0 or attempt >= VBoxManageRetries or not _isTransient(stderr):
+            break
+        # jittered so operations that collided don't collide again
+        delay = VBoxManageBackoff * 2**attempt
+        delay = random.uniform(delay / 2, delay)
+        attempt += 1
+        _vboxmanage_retries.inc(subcommand)
+        logger.info("%s hit a transient error, retry %s in %.2fs", opts, attempt, delay)
+        await asyncio.sleep(delay)
+    if returncode != 0:
+        our_error, status = _vboxmanageError(stderr)
+        headers = None
+        if _isTransient(stderr):
+            # still locked or busy after every retry
+            status = 409
+            headers = {"Retry-After": str(max(1, round(VBoxManageBackoff * 2**attempt)))}
+        raise HTTPException(status_code=status, detail=our_error, headers=headers)
     else:
         our_output = []
-        for line in process.stdout.splitlines():
+        for line in stdout.splitlines():
             our_output.append(line.decode("ascii"))
         return our_output
 
 
-@app.get("/host")
-def getHostInfo():
-    version = _runVBoxManage(["-v"])[0]
-    info = {"version": version, "CPUs": {}}
-    hostinfo = _runVBoxManage(["list", "hostinfo"])[2:]
+def _addSource(*parts):
+    sources = _sources.get()
+    if sources is not None:
+        sources.append(hashlib.blake2b(repr(parts).encode(), digest_size=16).digest())
+
+
+def _sourcesDigest(sources):
+    # concurrent VBoxManage runs finish in any order, the digest must not care
+    return hashlib.blake2b(b"".join(sorted(sources)), digest_size=16).hexdigest()
+
+
+async def _cached(name, build, response=None, key=None):
+    """
+    Returns the value build() returned less than CacheTTL[name] seconds ago,
+    one for every key when given
+    """
+    if key is not None:
+        name = (name, key)
+    found, value = _cache.get(name)
+    if not found:
+        sources = []
+        token = _sources.set(sources)
+        try:
+            value = await build()
+        finally:
+            _sources.reset(token)
+        _cache.set(name, value, CacheTTL[name if key is None else name[0]])
+        if len(_cache_sources) > CacheSize * 2:
+            # mostly long evicted, those still cached fall back to their id
+            _cache_sources.clear()
+        _cache_sources[name] = (value, _sourcesDigest(sources))
+    built, digest = _cache_sources.get(name, (None, None))
+    if built is value:
+        _addSource(name, digest)
+    else:
+        # stored by someone else, it is only known to be equal to itself
+        _addSource(name, _instance, id(value))
+    if response is not None:
+        response.headers["X-Cache"] = "HIT" if found else "MISS"
+    return value
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def _wantsNDJSON(request, format):
+    if format is None:
+        return "application/x-ndjson" in request.headers.get("accept", "")
+    if not format in ("json", "ndjson"):
+        raise HTTPException(
+            status_code=405, detail=f"The specified format ({format}) is not json or ndjson."
+        )
+    return format == "ndjson"
+
+
+def _ndjsonRecord(key, name, value):
+    if type(value) is dict:
+        return _dumps({key: name, **value}) + b"\n"
+    return _dumps({key: name, "value": value}) + b"\n"
+
+
+async def _respond(request, response, format, fetch, key, render=None):
+    """
+    Answers with render(await fetch()) as JSON, or as NDJSON (format=ndjson
+    or Accept: application/x-ndjson) of one {key: name, **value} record per
+    line. The ETag is a hash of the VBoxManage output fetch used, so an
+    If-None-Match still naming it gets a 304 that renders and serializes
+    nothing; the bodies of recent ETags are kept already serialized
+    """
+    ndjson = _wantsNDJSON(request, format)
+    sources = []
+    token = _sources.set(sources)
+    try:
+        source = await fetch()
+        _addSource(request.url.path, str(request.url.query), ndjson)
+    finally:
+        _sources.reset(token)
+    etag = f'"{_sourcesDigest(sources)}"'
+    headers = dict(response.headers)
+    headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+    wanted = request.headers.get("if-none-match")
+    if wanted is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in wanted.split(",")]
+        if etag in tags or "*" in tags:
+            return Response(status_code=304, headers=headers)
+    media_type = "application/x-ndjson" if ndjson else "application/json"
+    found, body = _bodies.get(etag)
+    if found:
+        return Response(body, media_type=media_type, headers=headers)
+    rendered = source if render is None else render(source)
+    if not ndjson:
+        body = _dumps(rendered)
+        _bodies.set(etag, body, _body_ttl)
+        return Response(body, media_type=media_type, headers=headers)
+
+    async def stream():
+        lines = []
+        for name, value in rendered.items():
+            lines.append(_ndjsonRecord(key, name, value))
+            yield lines[-1]
+        _bodies.set(etag, b"".join(lines), _body_ttl)
+
+    return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+
+@app.get("/admin/cache")
+async def getCacheStats():
+    return _cache.stats()
+
+
+@app.delete("/admin/cache")
+async def invalidateCache(name: str = None):
+    if name and not name in CacheTTL:
+        raise HTTPException(
+            status_code=404, detail=f"The specified cache ({name}) does not exist."
+        )
+    return {"invalidated": _cache.invalidate(name)}
+
+
+@app.get("/metrics")
+async def getMetrics():
+    return Response(_metrics.render(), media_type=_metrics.content_type)
+
+
+@app.get("/admin/vboxmanage")
+async def getVBoxManageInfo():
+    return _vboxmanage_info
+
+
+@app.get("/admin/flights")
+async def getFlightStats():
+    stats = _flights.stats()
+    # the recent entries are SingleFlight's own records, don't modify them
+    for section in ("inflight", "recent"):
+        stats[section] = [
+            {**flight, "key": " ".join(flight["key"][1])} for flight in stats[section]
+        ]
+    return stats
+
+
+@app.get("/admin/queues")
+async def getQueueDepths():
+    """
+    Returns the control operations running or waiting per VM, by UUID
+    """
+    queues = {}
+    for uuid, depth in _vm_locks.depths().items():
+        entry = _state_watcher.lookup(uuid)
+        queues[uuid] = {"name": entry["name"] if entry else None, "depth": depth}
+    return queues
+
+
+def _diff(vboxmanage, xml, path=""):
+    """
+    Returns {"path", "vboxmanage", "xml"} for every value the backends
+    disagree on, a side is left out where the other one has a key it lacks
+    """
+    if not (isinstance(vboxmanage, dict) and isinstance(xml, dict)):
+        if vboxmanage == xml:
+            return []
+        return [{"path": path or "/", "vboxmanage": vboxmanage, "xml": xml}]
+    diffs = []
+    for key in dict.fromkeys([*vboxmanage, *xml]):
+        key_path = f"{path}/{key}"
+        if not key in xml:
+            diffs.append({"path": key_path, "vboxmanage": vboxmanage[key]})
+        elif not key in vboxmanage:
+            diffs.append({"path": key_path, "xml": xml[key]})
+        else:
+            diffs += _diff(vboxmanage[key], xml[key], key_path)
+    return diffs
+
+
+async def _bothBackends(call):
+    # VBoxManage first, then the XML backend regardless of XMLBackend
+    results = []
+    for enabled in (False, True):
+        token = _xml_enabled.set(enabled)
+        try:
+            results.append(await call())
+        except HTTPException as e:
+            results.append({"status": e.status_code, "detail": e.detail})
+        finally:
+            _xml_enabled.reset(token)
+    return results
+
+
+@app.get("/admin/xml/check")
+async def checkXMLBackend(vm: str = None):
+    """
+    Compares the XML backend with VBoxManage for the VM list, the media and
+    every VM that isn't running, or only the given one
+    """
+    token = _xml_enabled.set(True)
+    try:
+        available = await _fromXML(lambda config: config.listVms()) is not None
+    finally:
+        _xml_enabled.reset(token)
+    if not available:
+        raise HTTPException(status_code=503, detail="The XML backend is unavailable.")
+    machines = await _bothBackends(_listMachines)
+    all_vms, running_vms = machines[0]
+    report = {"consistent": True, "files": _xml_config.stats()}
+    if vm is None:
+        report["machines"] = _diff(machines[0][0], machines[1][0])
+        report["media"] = _diff(*await _bothBackends(_listMedia))
+        wanted = list(all_vms)
+    else:
+        wanted = [name for name, uuid in all_vms.items() if vm in (name, uuid)]
+        if not wanted:
+            raise HTTPException(
+                status_code=404, detail=f"The specified machine ({vm}) does not exist."
+            )
+    # the XML backend hands running VMs to VBoxManage, nothing to compare
+    report["skipped"] = [name for name in wanted if all_vms[name] in running_vms]
+    report["vms"] = {}
+    limit = asyncio.Semaphore(BulkConcurrency)
+
+    async def check(name):
+        async with limit:
+            details = await _bothBackends(lambda: getMachinesNodeInfo(name))
+            report["vms"][name] = _diff(*details)
+
+    await asyncio.gather(
+        *[check(name) for name in wanted if not name in report["skipped"]]
+    )
+    report["consistent"] = not (
+        report.get("machines") or report.get("media") or any(report["vms"].values())
+    )
+    return report
+
+
+def _parseHostInfo(hostinfo):
+    info = {"CPUs": {}}
     for line in hostinfo:
         if len(line) == 0:
             continue
@@ -57,10 +935,44 @@ def getHostInfo():
     return info
 
 
-@app.get("/host/extpacks")
-def getHostExtpacks():
+async def _listHostInfo():
+    version = (await _runVBoxManage(["-v"]))[0]
+    info = {"version": version}
+    info.update(_parseHostInfo((await _runVBoxManage(["list", "hostinfo"]))[2:]))
+    return info
+
+
+async def _getHostVolatile():
+    # the API runs on the host itself, so the clock and free memory
+    # can usually be read without a VBoxManage round trip
+    now = datetime.now(timezone.utc)
+    volatile = {"Host time": now.strftime("%Y-%m-%dT%H:%M:%S.%f000Z")}
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    free_mb = int(line.split()[1]) // 1024
+                    volatile["Memory available"] = f"{free_mb} MByte"
+                    return volatile
+    except OSError:
+        pass
+    info = _parseHostInfo((await _runVBoxManage(["list", "hostinfo"]))[2:])
+    for key in ("Host time", "Memory available"):
+        if key in info:
+            volatile[key] = info[key]
+    return volatile
+
+
+@app.get("/host")
+async def getHostInfo(response: Response):
+    info = dict(await _cached("host", _listHostInfo, response))
+    info.update(await _getHostVolatile())
+    return info
+
+
+async def _listHostExtpacks():
     extpacks = {}
-    extpacks_list = _runVBoxManage(["list", "extpacks"])[1:]
+    extpacks_list = (await _runVBoxManage(["list", "extpacks"]))[1:]
     if len(extpacks_list) == 0:
         return {}
     for line in extpacks_list:
@@ -77,10 +989,16 @@ def getHostExtpacks():
     return _prune_data(extpacks)
 
 
-@app.get("/host/ostypes")
-def getHostOstypes():
+@app.get("/host/extpacks")
+async def getHostExtpacks(request: Request, response: Response, format: str = None):
+    return await _respond(
+        request, response, format, lambda: _cached("extpacks", _listHostExtpacks, response), "Pack"
+    )
+
+
+async def _listHostOstypes():
     ostypes = {}
-    ostypes_list = _runVBoxManage(["list", "ostypes"])
+    ostypes_list = await _runVBoxManage(["list", "ostypes"])
     for line in ostypes_list:
         if len(line) == 0:
             continue
@@ -93,10 +1011,16 @@ def getHostOstypes():
     return ostypes
 
 
-@app.get("/host/properties")
-def getHostProperties():
+@app.get("/host/ostypes")
+async def getHostOstypes(request: Request, response: Response, format: str = None):
+    return await _respond(
+        request, response, format, lambda: _cached("ostypes", _listHostOstypes, response), "ID"
+    )
+
+
+async def _listHostProperties():
     properties = {}
-    properties_list = _runVBoxManage(["list", "systemproperties"])
+    properties_list = await _runVBoxManage(["list", "systemproperties"])
     for line in properties_list:
         if len(line) == 0:
             continue
@@ -105,25 +1029,308 @@ def getHostProperties():
     return _prune_data(properties)
 
 
-@app.get("/machines")
-def getMachinesList():
-    all_vms = {}
-    running_vms = []
-    all_list = _runVBoxManage(["list", "vms"])
-    running_list = _runVBoxManage(["list", "runningvms"])
+@app.get("/host/properties")
+async def getHostProperties(request: Request, response: Response, format: str = None):
+    return await _respond(
+        request,
+        response,
+        format,
+        lambda: _cached("properties", _listHostProperties, response),
+        "name",
+    )
+
+
+async def _fromXML(call):
+    """
+    Returns call(XMLConfig) run off the event loop, None whenever the XML
+    backend is disabled or can't answer and VBoxManage has to be asked
+    """
+    global _xml_config
+    enabled = _xml_enabled.get()
+    if not (XMLBackend if enabled is None else enabled):
+        return None
+    if _xml_config is None or (VBoxUserHome and VBoxUserHome != _xml_config.home):
+        _xml_config = XMLConfig(VBoxUserHome)
+    try:
+        # the first read parses every settings file, don't stall other requests
+        result = await asyncio.to_thread(call, _xml_config)
+    except XMLConfigError as e:
+        logger.info("XML backend unavailable, asking VBoxManage: %s", e)
+        return None
+    if _sources.get() is not None:
+        _addSource("xml", result)
+    return result
+
+
+async def _listRunningMachines():
+    running_vms = {}
+    running_list = await _runVBoxManage(["list", "runningvms"])
     for line in running_list:
-        uuid_start = line.find("{") + 1
-        running_vms.append(line[uuid_start:-1])
-    for line in all_list:
+        if not line:
+            continue
         tmp_name, tmp_uuid = line.split('" {')
-        name = tmp_name[1:]
-        uuid = tmp_uuid[:-1]
-        all_vms[name] = {"uuid": uuid, "running": "false"}
+        running_vms[tmp_name[1:]] = tmp_uuid[:-1]
+    return running_vms
+
+
+async def _listMachines():
+    all_vms = await _fromXML(lambda config: config.listVms())
+    if all_vms is None:
+        all_vms = {}
+        all_list = await _runVBoxManage(["list", "vms"])
+        for line in all_list:
+            tmp_name, tmp_uuid = line.split('" {')
+            all_vms[tmp_name[1:]] = tmp_uuid[:-1]
+    return all_vms, set((await _listRunningMachines()).values())
+
+
+async def _listGroups():
+    groups = await _fromXML(lambda config: config.listGroups())
+    if groups is not None:
+        return groups
+    groups = {}
+    # the long listing is the regular showvminfo output of every VM, Groups
+    # follows the VM's own Name line and comes before any shared folder names
+    for line in await _runVBoxManage(["list", "--long", "vms"]):
+        if line.startswith("Name:"):
+            name = line[5:].strip()
+        elif line.startswith("Groups:"):
+            groups[name] = line[7:].strip().split(",")
+    return groups
+
+
+async def _resolveMachines(vms):
+    """
+    Returns {vm: uuid} of the VM names or UUIDs VirtualBox knows. The state
+    table answers for the VMs it has, the others may have been registered
+    since its last poll and are looked for with list vms
+    """
+    resolved = {}
+    if _state_watcher.ready:
+        for vm in vms:
+            entry = _state_watcher.lookup(vm)
+            if entry is not None:
+                resolved[vm] = entry["uuid"]
+    missing = set(vms) - resolved.keys()
+    if missing:
+        all_vms = (await _listMachines())[0]
+        for name, uuid in all_vms.items():
+            for vm in missing & {name, uuid}:
+                resolved[vm] = uuid
+        if _state_watcher.ready and missing & resolved.keys():
+            # the table is behind, catch up
+            _state_watcher.wake()
+    return resolved
+
+
+async def _filterMachines(running=None, name=None, regex=None, group=None):
+    """
+    Returns {name: uuid} of the VMs matching every given filter and the
+    set of running UUIDs, running=True only needing list runningvms
+    """
+    if regex:
+        try:
+            pattern = re.compile(regex)
+        except re.error as e:
+            raise HTTPException(
+                status_code=405, detail=f"The specified regex ({regex}) is invalid: {e}"
+            )
+    if _state_watcher.ready:
+        _addSource(_instance, _state_watcher.version)
+        machines = {}
+        running_vms = set()
+        for entry in _state_watcher.machines.values():
+            machines[entry["name"]] = entry["uuid"]
+            if entry["running"]:
+                running_vms.add(entry["uuid"])
+    elif running:
+        machines = await _listRunningMachines()
+        running_vms = set(machines.values())
+    else:
+        machines, running_vms = await _listMachines()
+    if running is not None:
+        machines = {
+            vm: uuid for vm, uuid in machines.items() if (uuid in running_vms) == running
+        }
+    if name:
+        machines = {vm: uuid for vm, uuid in machines.items() if fnmatch.fnmatchcase(vm, name)}
+    if regex:
+        machines = {vm: uuid for vm, uuid in machines.items() if pattern.search(vm)}
+    if group:
+        groups = await _cached("groups", _listGroups)
+        subgroups = group.rstrip("/") + "/"
+        machines = {
+            vm: uuid
+            for vm, uuid in machines.items()
+            if any(
+                found == group or found.startswith(subgroups)
+                for found in groups.get(vm, ())
+            )
+        }
+    return machines, running_vms
+
+
+@app.get("/machines")
+async def getMachinesList(
+    request: Request,
+    response: Response,
+    detail: bool = False,
+    parallel: int = 0,
+    fields: str = None,
+    include: str = None,
+    running: bool = None,
+    name: str = None,
+    regex: str = None,
+    group: str = None,
+    limit: int = 0,
+    cursor: str = None,
+    format: str = None,
+):
+    """
+    running, name (a glob), regex and group filter the VMs; limit returns
+    them a page at a time in name order, the next page starting after the
+    X-Next-Cursor of the previous one given as cursor. format=ndjson
+    returns one VM per line, with detail each as soon as it is built
+    """
+    query = (running, name, regex, group, limit, cursor)
+    if detail and _wantsNDJSON(request, format):
+        all_vms = await _machinesList(response, False, 0, None, None, *query)
+        plan = _planNodeInfo(fields, include)
+        response.headers["X-Included-Sections"] = ",".join(plan[0])
+        return StreamingResponse(
+            _streamNodeInfo(all_vms, parallel, plan),
+            media_type="application/x-ndjson",
+            headers=dict(response.headers),
+        )
+    return await _respond(
+        request,
+        response,
+        format,
+        lambda: _machinesList(response, detail, parallel, fields, include, *query),
+        "name",
+    )
+
+
+async def _machinesList(
+    response=None,
+    detail: bool = False,
+    parallel: int = 0,
+    fields: str = None,
+    include: str = None,
+    running: bool = None,
+    name: str = None,
+    regex: str = None,
+    group: str = None,
+    limit: int = 0,
+    cursor: str = None,
+):
+    machines, running_vms = await _filterMachines(running, name, regex, group)
+    names = list(machines)
+    if limit > 0 or cursor is not None:
+        names.sort()
+        start = bisect.bisect_right(names, cursor) if cursor is not None else 0
+        end = start + limit if limit > 0 else len(names)
+        if end < len(names) and response is not None:
+            response.headers["X-Next-Cursor"] = names[end - 1]
+        names = names[start:end]
+    all_vms = {}
+    for vm in names:
+        uuid = machines[vm]
+        all_vms[vm] = {"uuid": uuid, "running": "false"}
         if uuid in running_vms:
-            all_vms[name]["running"] = "true"
+            all_vms[vm]["running"] = "true"
+    if detail:
+        plan = _planNodeInfo(fields, include)
+        if response is not None:
+            response.headers["X-Included-Sections"] = ",".join(plan[0])
+        details, errors = await _gatherNodeInfo(list(all_vms.keys()), parallel, plan)
+        for name in all_vms:
+            if name in details:
+                all_vms[name]["detail"] = details[name]
+            else:
+                all_vms[name]["error"] = errors[name]
     return all_vms
 
 
+def _bulkLimit(parallel):
+    # parallel only ever lowers BulkConcurrency, 0 leaving it as it is
+    if parallel <= 0 or parallel > BulkConcurrency:
+        parallel = BulkConcurrency
+    return asyncio.Semaphore(parallel)
+
+
+async def _gatherNodeInfo(vms, parallel=0, plan=(MachineSections, None)):
+    # every VM shares the request capture, so list vms, the medium lists etc.
+    # are only run once for the whole batch
+    limit = _bulkLimit(parallel)
+    details = {}
+    errors = {}
+
+    async def fetch(vm):
+        async with limit:
+            try:
+                details[vm] = await _buildNodeInfo(vm, *plan)
+            except HTTPException as e:
+                errors[vm] = {"status": e.status_code, "detail": e.detail}
+
+    await asyncio.gather(*[fetch(vm) for vm in vms])
+    return {vm: details[vm] for vm in vms if vm in details}, errors
+
+
+async def _streamNodeInfo(all_vms, parallel, plan):
+    # NDJSON records of the VMs in the order their details are ready
+    limit = _bulkLimit(parallel)
+
+    async def fetch(vm):
+        async with limit:
+            try:
+                return vm, {"detail": await _buildNodeInfo(vm, *plan)}
+            except HTTPException as e:
+                return vm, {"error": {"status": e.status_code, "detail": e.detail}}
+
+    tasks = [asyncio.ensure_future(fetch(vm)) for vm in all_vms]
+    try:
+        for done in asyncio.as_completed(tasks):
+            vm, result = await done
+            yield _dumps({"name": vm, **all_vms[vm], **result}) + b"\n"
+    finally:
+        # the client went away
+        for task in tasks:
+            task.cancel()
+
+
+class bulkInput(BaseModel):
+    """
+    machines is a list of VM names or UUIDs, parallel optionally lowers BulkConcurrency,
+    fields and include select the details like they do for /machines/{vm}
+    """
+
+    machines: list[str]
+    parallel: int = 0
+    fields: str = None
+    include: str = None
+
+
+@app.post("/machines/_bulk")
+async def getMachinesBulkInfo(body: bulkInput, response: Response):
+    plan = _planNodeInfo(body.fields, body.include)
+    response.headers["X-Included-Sections"] = ",".join(plan[0])
+    known = await _resolveMachines(body.machines)
+    wanted = []
+    errors = {}
+    for vm in dict.fromkeys(body.machines):
+        if vm in known:
+            wanted.append(vm)
+        else:
+            errors[vm] = {
+                "status": 404,
+                "detail": f"The specified machine ({vm}) does not exist.",
+            }
+    details, fetch_errors = await _gatherNodeInfo(wanted, body.parallel, plan)
+    errors.update(fetch_errors)
+    return {"machines": details, "errors": errors}
+
+
 def _buildVRDE(keys):
     vrde = {"properties": {}}
     for tmp_key, val in keys.items():
@@ -144,9 +1351,10 @@ def _buildVRDE(keys):
     return vrde
 
 
-def _buildSharedFolders(vm: str):
+async def _buildSharedFolders(vm: str):
     # --machinereadable output does not include readonly and auto-mount details, so we must get
-    shares_detail = _runVBoxManage(["showvminfo", vm])
+    # them from the regular output (shared with getNicInfo through the request capture)
+    shares_detail = await _runVBoxManage(["showvminfo", vm])
     details = {}
     processing = False
     for line in shares_detail:
@@ -191,44 +1399,90 @@ def _buildSharedFolders(vm: str):
     return details
 
 
-@app.get("/machines/{vm}")
-def getMachinesNodeInfo(vm: str):
-    nickeys = [
-        "bridge",
-        "cable",
-        "generic",
-        "hostonly",
-        "intnet",
-        "mac",
-        "mtu",
-        "nat",
-        "nic",
-        "sock",
-        "tcp",
-        "tracing",
-    ]
-    diskkeys = ["storage"]
+# seconds an event stream may go without sending anything
+_keepalive = 15
+
+
+async def _eventStream(events, render, timeout=None):
+    """
+    Yields the SSE frames render(event) returns, a list of (event, data)
+    and whether the stream is over, first for None and then for every event
+    taken off the queue events. Idle, it sends keepalive comments, and ends
+    with a timeout event after timeout seconds
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    frames, done = render(None)
+    while True:
+        for name, data in frames:
+            yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        if done:
+            return
+        wait = _keepalive
+        if deadline is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                yield f"event: timeout\ndata: {json.dumps(timeout)}\n\n"
+                return
+            wait = min(remaining, wait)
+        try:
+            event = await asyncio.wait_for(events.get(), wait)
+        except asyncio.TimeoutError:
+            # keep proxies from closing an idle stream
+            yield ": keepalive\n\n"
+            frames = []
+            continue
+        frames, done = render(event)
+
+
+@app.get("/machines/events")
+async def getMachinesEvents():
+    if not StateWatcherEnabled:
+        raise HTTPException(
+            status_code=404, detail="The VM state watcher is not enabled."
+        )
+
+    def render(event):
+        if event is None:
+            return [("snapshot", list(_state_watcher.machines.values()))], False
+        return [("state", event)], False
+
+    async def stream():
+        with _state_watcher.subscribe() as events:
+            async for frame in _eventStream(events, render):
+                yield frame
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+# --machinereadable NIC keys, left out of the general details: they lack the
+# boot priority, promiscuous mode policy and bandwidth group of the NICs, so
+# the NICs of every VM come from the regular output instead (_parseNicInfo)
+_nic_key = re.compile("bridge|cable|generic|hostonly|intnet|mac|mtu|nat|nic|sock|tcp|tracing")
+
+
+def _parseMachineReadable(nodeinfo_list):
+    """
+    Sorts showvminfo --machinereadable lines into general, VRDE and storage
+    sections in a single pass, dropping the NIC lines
+    """
     nodeinfo = {}
     vrde_list = {}
     disk_list = {}
+    disk_prefixes = ("storage",)
     found_shares = False
-    found_storage = False
-    nodeinfo_list = _runVBoxManage(["showvminfo", vm, "--machinereadable"])
     for line in nodeinfo_list:
         delim = line.find("=")
         key = line[:delim].strip('"=')
         val = line[delim:].strip('"=')
-        # if line contains a network type key, skip
-        if list(filter(key.startswith, nickeys)) != []:
+        if _nic_key.match(key):
             continue
-        # this key will define what controller-specific lines will start with
-        if key.startswith("storagecontrollername"):
-            found_storage = True
-            diskkeys.append(val)
-        if list(filter(key.startswith, diskkeys)) != []:
-            found_storage = True
+        elif key.startswith(disk_prefixes):
+            # this key will define what controller-specific lines will start with
+            if key.startswith("storagecontrollername"):
+                disk_prefixes += (val,)
             disk_list[key] = val
-        elif key.lower().startswith("vrde"):
+        elif key[:4].lower() == "vrde":
             vrde_list[key] = val
         elif key.startswith("SharedFolder"):
             found_shares = True
@@ -240,25 +1494,106 @@ def getMachinesNodeInfo(vm: str):
                     nodeinfo["captureopts"][opt_key] = opt_val
         else:
             nodeinfo[key] = val
-    nodeinfo["vrde"] = _buildVRDE(vrde_list)
-    if found_shares:
-        nodeinfo["shares"] = _buildSharedFolders(vm)
-    nodeinfo["nics"] = getNicInfo(vm)
-    if found_storage:
-        nodeinfo["storage"] = _getStorageInfo(disk_list)
-    return _prune_data(nodeinfo)
+    return nodeinfo, vrde_list, disk_list, found_shares
 
 
-@app.get("/dhcpservers")
-def getDhcpserversList():
-    dhcpserv = {}
-    dhcpserv_list = _runVBoxManage(["list", "dhcpservers"])
-    for line in dhcpserv_list:
-        if len(line) == 0:
-            continue
-        if line.startswith("NetworkName"):
-            globalopts = False
-            key, val = line.split(": ")
+async def _xmlMachineReadable(vm, sections=MachineSections):
+    """
+    Returns (showvminfo --machinereadable lines, shares, regular NIC lines)
+    of a VM that isn't running read from its settings file, None if
+    VBoxManage has to be asked
+    """
+    machine = await _fromXML(lambda config: config.machine(vm))
+    if machine is None:
+        return None
+    # the files know neither whether a VM runs nor the details of a running one
+    entry = _state_watcher.lookup(machine["uuid"]) if _state_watcher.ready else None
+    if entry is not None:
+        running = entry["running"]
+    else:
+        running = machine["uuid"] in (await _listRunningMachines()).values()
+    if running:
+        return None
+    ostypes = await _cached("ostypes", _listHostOstypes)
+    lines = await _fromXML(lambda config: config.showVmInfo(machine, ostypes, sections))
+    if lines is None:
+        return None
+    return lines, machine["shares"], machine["nicinfo"]
+
+
+def _planNodeInfo(fields=None, include=None):
+    """
+    Returns the sections to build and the general keys to keep (None for all)
+    for comma separated fields and include lists, everything when both are None
+    """
+    if fields is None and include is None:
+        return MachineSections, None
+    wanted = []
+    for section in (include or "").split(","):
+        if section and not section in MachineSections:
+            raise HTTPException(
+                status_code=405, detail=f"The specified section ({section}) does not exist."
+            )
+        wanted.append(section)
+    keys = None
+    if fields is not None:
+        keys = set(fields.split(","))
+        wanted += keys
+    return tuple(section for section in MachineSections if section in wanted), keys
+
+
+async def _buildNodeInfo(vm, sections=MachineSections, keys=None):
+    from_xml = await _xmlMachineReadable(vm, sections)
+    if from_xml is None:
+        nodeinfo_list = await _runVBoxManage(["showvminfo", vm, "--machinereadable"])
+    else:
+        nodeinfo_list, shares, nicinfo_list = from_xml
+    nodeinfo, vrde_list, disk_list, found_shares = _parseMachineReadable(nodeinfo_list)
+    if keys is not None:
+        nodeinfo = {key: val for key, val in nodeinfo.items() if key in keys}
+    # sections left out never run their VBoxManage commands
+    if "vrde" in sections:
+        nodeinfo["vrde"] = _buildVRDE(vrde_list)
+    if "shares" in sections and found_shares:
+        if from_xml is None:
+            nodeinfo["shares"] = await _buildSharedFolders(vm)
+        else:
+            nodeinfo["shares"] = shares
+    if "nics" in sections:
+        if from_xml is None:
+            # shares the regular output with _buildSharedFolders
+            nodeinfo["nics"] = await getNicInfo(vm)
+        else:
+            nodeinfo["nics"] = _parseNicInfo(nicinfo_list)
+    if "storage" in sections and disk_list:
+        nodeinfo["storage"] = await _getStorageInfo(disk_list)
+    return _prune_data(nodeinfo)
+
+
+@app.get("/machines/{vm}")
+async def getMachinesNodeInfo(
+    vm: str, response: Response = None, fields: str = None, include: str = None
+):
+    """
+    include lists the sections to add to the general details, fields the
+    details and sections to return, both comma separated
+    """
+    sections, keys = _planNodeInfo(fields, include)
+    if response is not None:
+        response.headers["X-Included-Sections"] = ",".join(sections)
+    return await _buildNodeInfo(vm, sections, keys)
+
+
+@app.get("/dhcpservers")
+async def getDhcpserversList():
+    dhcpserv = {}
+    dhcpserv_list = await _runVBoxManage(["list", "dhcpservers"])
+    for line in dhcpserv_list:
+        if len(line) == 0:
+            continue
+        if line.startswith("NetworkName"):
+            globalopts = False
+            key, val = line.split(": ")
             current_dhcp = val.strip()
             dhcpserv[current_dhcp] = {}
         elif globalopts:
@@ -274,9 +1609,9 @@ def getDhcpserversList():
 
 
 @app.get("/hostonlynets")
-def getHostonlynetsList():
+async def getHostonlynetsList():
     hostonly = {}
-    hostonly_list = _runVBoxManage(["list", "hostonlyifs"])
+    hostonly_list = await _runVBoxManage(["list", "hostonlyifs"])
     for line in hostonly_list:
         if len(line) == 0:
             continue
@@ -290,9 +1625,9 @@ def getHostonlynetsList():
 
 
 @app.get("/intnets")
-def getInternalnetsList():
+async def getInternalnetsList():
     intnets = []
-    intnets_list = _runVBoxManage(["list", "intnets"])
+    intnets_list = await _runVBoxManage(["list", "intnets"])
     for line in intnets_list:
         key, val = line.split(":")
         intnets.append(val.strip())
@@ -300,9 +1635,9 @@ def getInternalnetsList():
 
 
 @app.get("/natnetworks")
-def getNatnetworksList():
+async def getNatnetworksList():
     natnets = {}
-    natnets_list = _runVBoxManage(["list", "natnets"])
+    natnets_list = await _runVBoxManage(["list", "natnets"])
     for line in natnets_list:
         if len(line) == 0:
             continue
@@ -342,17 +1677,175 @@ def getNatnetworksList():
     return natnets
 
 
-def getNicInfo(vm: str):
+class NetworkIndex:
+    """
+    Networks and the VM NICs attached to them, kept up to date VM by VM: the
+    NICs of a VM are only read again when its settings file changed
+    """
+
+    def __init__(self):
+        # VM uuid -> [name, settings file, signature,
+        # {(attachment, network): [nics]}, time.monotonic() the NICs were read]
+        self.machines = {}
+        # (attachment, network) -> {VM name: [nics]}
+        self.networks = {}
+
+    def update(self, uuid, name, cfgfile, signature, nics, read=None):
+        self.remove(uuid)
+        attached = {}
+        for nic, settings in nics.items():
+            if type(settings) is not dict:
+                continue
+            network = settings.get("network") or settings.get("interface")
+            if network:
+                attached.setdefault((settings["Attachment"], network), []).append(nic)
+        for key, nic_list in attached.items():
+            self.networks.setdefault(key, {})[name] = nic_list
+        if read is None:
+            read = time.monotonic()
+        self.machines[uuid] = [name, cfgfile, signature, attached, read]
+
+    def remove(self, uuid):
+        entry = self.machines.pop(uuid, None)
+        if entry is None:
+            return
+        for key in entry[3]:
+            del self.networks[key][entry[0]]
+            if not self.networks[key]:
+                del self.networks[key]
+
+    def attached(self, attachment, network):
+        return self.networks.get((attachment, network), {})
+
+
+def _settingsSignature(cfgfile, before=None):
+    """
+    Returns what changes whenever VirtualBox saves the settings, None if the
+    file can't be stat'ed or may have been saved after before (time.time_ns())
+    """
+    try:
+        stat = os.stat(cfgfile)
+    except (OSError, TypeError):
+        return None
+    # modification times can be as coarse as 2 seconds
+    if before is not None and stat.st_mtime_ns >= before - 2_000_000_000:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+async def _refreshNetworkIndex():
+    """
+    Brings the network index up to date, returning the number of VMs whose
+    NICs had to be read again
+    """
+    async with _network_index_lock:
+        machines = (await _filterMachines())[0]
+        uuids = set(machines.values())
+        for uuid in list(_network_index.machines):
+            if not uuid in uuids:
+                _network_index.remove(uuid)
+        known = {
+            uuid: entry[1]
+            for uuid, entry in _network_index.machines.items()
+            if entry[0] in machines and machines[entry[0]] == uuid
+        }
+        # taken before the NICs are read, a change while they are is caught next time
+        signatures = await asyncio.to_thread(
+            lambda: {uuid: _settingsSignature(cfgfile) for uuid, cfgfile in known.items()}
+        )
+        now = time.monotonic()
+        stale = []
+        for name, uuid in machines.items():
+            if not uuid in known:
+                stale.append(name)
+            elif signatures[uuid] is None:
+                # no telling whether the settings changed, trusted for a while
+                if now - _network_index.machines[uuid][4] > NetworkIndexTTL:
+                    stale.append(name)
+            elif signatures[uuid] != _network_index.machines[uuid][2]:
+                stale.append(name)
+        started = time.time_ns()
+        details, errors = await _gatherNodeInfo(stale, plan=(("nics",), {"CfgFile"}))
+        for name, nodeinfo in details.items():
+            uuid = machines[name]
+            cfgfile = nodeinfo.get("CfgFile")
+            if known.get(uuid) == cfgfile:
+                signature = signatures[uuid]
+            else:
+                # the settings file of a VM is only known once its NICs have
+                # been read, the signature only holds if it wasn't saved since
+                signature = await asyncio.to_thread(_settingsSignature, cfgfile, started)
+            _network_index.update(
+                uuid, name, cfgfile, signature, nodeinfo.get("nics", {}), now
+            )
+        for name in errors:
+            # gone since it was listed
+            _network_index.remove(machines[name])
+        return len(stale)
+
+
+@app.get("/networks/topology")
+async def getNetworkTopology(response: Response = None):
+    """
+    Returns every network with its settings, DHCP server and the NICs of
+    the VMs attached to it, by attachment type
+    """
+    refreshed, hostonly, natnets, intnets, dhcpservers = await asyncio.gather(
+        _refreshNetworkIndex(),
+        getHostonlynetsList(),
+        getNatnetworksList(),
+        getInternalnetsList(),
+        getDhcpserversList(),
+    )
+    if response is not None:
+        response.headers["X-Refreshed-Machines"] = str(refreshed)
+    topology = {"hostonly": {}, "natnetwork": {}, "intnet": {}, "bridged": {}}
+    for name, config in hostonly.items():
+        topology["hostonly"][name] = {
+            "config": config,
+            "dhcp": dhcpservers.get(config.get("VBoxNetworkName")),
+            "machines": _network_index.attached("hostonly", name),
+        }
+    for name, config in natnets.items():
+        topology["natnetwork"][name] = {
+            "config": config,
+            "dhcp": dhcpservers.get(name),
+            "machines": _network_index.attached("natnetwork", name),
+        }
+    for name in intnets:
+        topology["intnet"][name] = {
+            "dhcp": dhcpservers.get(name),
+            "machines": _network_index.attached("intnet", name),
+        }
+    # networks VMs are attached to that the lists don't know (yet), and
+    # attachments that have no list of their own
+    for (attachment, network), attached in _network_index.networks.items():
+        section = topology.setdefault(attachment, {})
+        if not network in section:
+            section[network] = {"dhcp": dhcpservers.get(network), "machines": attached}
+    return topology
+
+
+# 'NIC <N>:' and 'NIC <N> Settings:' lines of the regular showvminfo output,
+# NAT rules ('NIC <N> Rule(<R>):') are left out
+_nic_line = re.compile(r"NIC (\d+)( Settings)?:")
+
+
+async def getNicInfo(vm: str):
+    return _parseNicInfo(await _runVBoxManage(["showvminfo", vm]))
+
+
+def _parseNicInfo(nicinfo_list):
     nicinfo = {}
-    nicinfo_list = _runVBoxManage(["showvminfo", vm])
     for line in nicinfo_list:
-        if line.startswith("NIC"):
-            delim = line.find(":") + 1
-            nic_num = line[4]
+        line_match = _nic_line.match(line)
+        if line_match:
+            delim = line_match.end()
+            nic_num, settings_line = line_match.groups()
             if "Generic" in line:
                 line = line.replace("', ", "@")
                 line = line.replace(" }", "")
-            if "Settings" in line[5:delim]:
+            if settings_line:
                 line = line.replace(", receive:", "/ receive=")
                 line = line.replace("(send:", ":send=")
             else:
@@ -402,6 +1895,9 @@ def getNicInfo(vm: str):
                                 nicinfo[nic_num]["generic properties"][
                                     prop_key
                                 ] = prop_val.strip("'")
+                    else:
+                        # not attached, or to a cloud network
+                        val = tmp_val.strip()
                 elif key in ["Socket", "TCP Window"]:
                     val = {}
                     tmp_send, tmp_recv = tmp_val.split("/")
@@ -465,53 +1961,126 @@ def _getStoragePair(our_bus, our_chip):
             )
 
 
-def _getStorageInfo(storage_keys):
+_controller_key = re.compile(r"storagecontroller(\D+)(\d+)$")
+_port_key = re.compile(r"(.+?)-(ImageUUID-)?(\d+-\d+)$")
+
+
+async def _getStorageInfo(storage_keys):
     our_storage = {}
+    controllers = {}
+    ports = []
     for key, val in storage_keys.items():
         # keys are formatted as 'storagecontroller<key><ID>'
         # example: storagecontrollername0="MYSATACTL"
-        if "storagecontroller" in key:
-            ctrl_num = str(key[-1])
+        ctrl_match = _controller_key.match(key)
+        if ctrl_match:
+            sub_key, ctrl_num = ctrl_match.groups()
             if not ctrl_num in our_storage:
                 our_storage[ctrl_num] = {}
-            if "storagecontrollertype" in key:
+            if sub_key == "type":
                 # bus is never set, so we have to determine it using the chipset
                 bus, controller = _getStoragePair(None, val)
                 our_storage[ctrl_num]["bus"] = bus
                 our_storage[ctrl_num]["controller"] = controller
-            else:
-                # extract the variable name from 'storagecontroller<key><ID>'
-                sub_key = key[17:-1]
-                if not (sub_key == "maxportcount" or sub_key == "instance"):
-                    our_storage[ctrl_num][sub_key] = val
-    for ctrl_num, attrs in our_storage.items():
-        if not "ports" in our_storage[ctrl_num]:
-            our_storage[ctrl_num]["ports"] = {}
-        for key, val in storage_keys.items():
-            # Storage lines look like:
-            # "MYSATACTL-0-0"="/home/jsmith/testdrive2.vdi"
-            # "MYSATACTL-ImageUUID-0-0"="2a679b54-6d43-48ba-7c82-9b361e4dd813"
-            line_match = re.match(attrs["name"] + "-(ImageUUID-)?(\d-\d)", key)
-            if line_match:
-                our_port = line_match.group(2)
-                if not our_port in our_storage[ctrl_num]["ports"]:
-                    our_storage[ctrl_num]["ports"][our_port] = {}
-                # if we have an ImageUUID
-                if line_match.group(1):
-                    # Find base image UUID
-                    our_medium, our_type, our_uuid = _find_storage_base(val)
-                    our_storage[ctrl_num]["ports"][our_port]["medium"] = our_medium
-                    our_storage[ctrl_num]["ports"][our_port]["devtype"] = our_type
-                    our_storage[ctrl_num]["ports"][our_port]["UUID"] = our_uuid
+            elif not (sub_key == "maxportcount" or sub_key == "instance"):
+                if sub_key == "name":
+                    controllers[val] = ctrl_num
+                our_storage[ctrl_num][sub_key] = val
+            continue
+        # Storage lines look like:
+        # "MYSATACTL-0-0"="/home/jsmith/testdrive2.vdi"
+        # "MYSATACTL-ImageUUID-0-0"="2a679b54-6d43-48ba-7c82-9b361e4dd813"
+        port_match = _port_key.match(key)
+        if port_match:
+            ports.append((port_match.groups(), val))
+    for ctrl_num in our_storage:
+        our_storage[ctrl_num]["ports"] = {}
+    medium_index = None
+    rebuilt = False
+    for (name, image_uuid, our_port), val in ports:
+        if not name in controllers:
+            continue
+        ctrl_ports = our_storage[controllers[name]]["ports"]
+        if not our_port in ctrl_ports:
+            ctrl_ports[our_port] = {}
+        # if we have an ImageUUID
+        if image_uuid:
+            # Find base image UUID
+            if medium_index is None:
+                medium_index = await _getMediumIndex()
+            found = medium_index.findBase(val)
+            if found is None and not rebuilt:
+                # attached outside this API since the index was cached
+                _invalidateMediumIndex()
+                medium_index = await _getMediumIndex()
+                rebuilt = True
+                found = medium_index.findBase(val)
+            if found is None:
+                continue
+            our_medium, our_type, our_uuid = found
+            ctrl_ports[our_port]["medium"] = our_medium
+            ctrl_ports[our_port]["devtype"] = our_type
+            ctrl_ports[our_port]["UUID"] = our_uuid
     return our_storage
 
 
-@app.get("/storage")
-def getStorageList():
+class MediumIndex:
+    """
+    All registered media keyed by UUID, with the differencing tree resolved
+    once so base, depth and children lookups don't walk the chain again
+    """
+
+    def __init__(self, media):
+        self.media = media
+        self.children = {}
+        self.base = {}
+        self.depth = {}
+        for uuid, record in media.items():
+            parent = record.get("Parent UUID")
+            if parent:
+                self.children.setdefault(parent, []).append(uuid)
+        for uuid in media:
+            self._resolve(uuid)
+
+    def _resolve(self, uuid):
+        # walk up until we hit a medium that is already resolved (or the base)
+        chain = []
+        while uuid not in self.base:
+            chain.append(uuid)
+            parent = self.media[uuid].get("Parent UUID")
+            if not parent or parent not in self.media:
+                self.base[uuid] = uuid
+                self.depth[uuid] = 0
+                chain.pop()
+                break
+            uuid = parent
+        for child in reversed(chain):
+            parent = self.media[child]["Parent UUID"]
+            self.base[child] = self.base[parent]
+            self.depth[child] = self.depth[parent] + 1
+
+    def findBase(self, uuid):
+        base = self.base.get(uuid)
+        if base is None:
+            return None
+        return (self.media[base]["Location"], self.media[base]["Device"], base)
+
+    def chainInfo(self, uuid):
+        return {
+            "Base UUID": self.base[uuid],
+            "Depth": self.depth[uuid],
+            "Children": self.children.get(uuid, []),
+        }
+
+
+async def _listMedia():
+    storage = await _fromXML(lambda config: config.listMedia())
+    if storage is not None:
+        return storage
     storage = {}
     storage_types = {"hdds": "hdd", "dvds": "dvddrive", "floppies": "fdd"}
     for cmd, dev in storage_types.items():
-        storage_list = _runVBoxManage(["list", cmd])
+        storage_list = await _runVBoxManage(["list", cmd])
         for line in storage_list:
             if len(line) == 0:
                 continue
@@ -529,17 +2098,133 @@ def getStorageList():
     return storage
 
 
-def _find_storage_base(our_uuid, storage_list=None):
-    if not storage_list:
-        storage_list = getStorageList()
-    parentUUID = storage_list[our_uuid].get("Parent UUID", None)
-    if parentUUID:
-        return _find_storage_base(parentUUID, storage_list=storage_list)
-    return (
-        storage_list[our_uuid]["Location"],
-        storage_list[our_uuid]["Device"],
-        our_uuid,
-    )
+async def _buildMediumIndex():
+    return MediumIndex(await _listMedia())
+
+
+async def _getMediumIndex():
+    return await _cached("media", _buildMediumIndex)
+
+
+def _invalidateMediumIndex():
+    _cache.invalidate("media")
+
+
+@app.get("/storage")
+async def getStorageList(
+    request: Request, response: Response, chains: bool = False, format: str = None
+):
+    def render(medium_index):
+        storage = {}
+        for uuid, record in medium_index.media.items():
+            storage[uuid] = dict(record)
+            if chains:
+                storage[uuid].update(medium_index.chainInfo(uuid))
+        return storage
+
+    return await _respond(request, response, format, _getMediumIndex, "UUID", render)
+
+
+def _submitMediumOperation(kind, medium, opts):
+    """
+    Queues a VBoxManage medium operation as a job of a single item, its
+    progress published to the job's subscribers as it is printed
+    """
+
+    async def operation(medium):
+        progress = job.items[medium]
+
+        def report(percent):
+            if percent > progress.get("percent", -1):
+                progress["percent"] = percent
+                job.publish(medium, percent=percent)
+
+        try:
+            returncode, stdout, stderr = await _spawnVBoxManage(
+                opts, opts[0], lambda command: _execMediumOperation(command, report)
+            )
+        finally:
+            # whatever happened, the media on disk may have changed
+            _invalidateMediumIndex()
+        if returncode != 0:
+            stderr = b"\n".join(
+                line for line in stderr.splitlines() if not _progress.match(line)
+            )
+            our_error, status = _vboxmanageError(stderr)
+            raise HTTPException(status_code=status, detail=our_error)
+        return [line.decode("ascii") for line in stdout.splitlines()]
+
+    job = _medium_jobs.submit(kind, [medium], operation)
+    return {"job": job.id, "state": job.state, "kind": kind}
+
+
+class mediumInput(BaseModel):
+    """
+    filename of the new disk and its size in MB, format one of VDI, VMDK
+    or VHD, variant a comma separated list like Standard or Fixed
+    """
+
+    filename: str
+    size: int
+    format: str = None
+    variant: str = None
+
+
+@app.post("/storage", status_code=202)
+async def createMedium(body: mediumInput):
+    opts = ["createmedium", "disk", "--filename", body.filename, "--size", str(body.size)]
+    if body.format:
+        opts += ["--format", body.format]
+    if body.variant:
+        opts += ["--variant", body.variant]
+    return _submitMediumOperation("medium:create", body.filename, opts)
+
+
+class mediumCloneInput(BaseModel):
+    """
+    target is the filename of the new disk, or the UUID or filename of an
+    existing one when existing is set
+    """
+
+    target: str
+    format: str = None
+    variant: str = None
+    existing: bool = False
+
+
+@app.post("/storage/{medium:path}/clone", status_code=202)
+async def cloneMedium(medium: str, body: mediumCloneInput):
+    opts = ["clonemedium", "disk", medium, body.target]
+    if body.format:
+        opts += ["--format", body.format]
+    if body.variant:
+        opts += ["--variant", body.variant]
+    if body.existing:
+        opts.append("--existing")
+    return _submitMediumOperation("medium:clone", medium, opts)
+
+
+class mediumModifyInput(BaseModel):
+    """
+    compact releases the unused blocks, resize grows the disk to that many MB
+    """
+
+    compact: bool = False
+    resize: int = None
+
+
+@app.put("/storage/{medium:path}", status_code=202)
+async def modifyMedium(medium: str, body: mediumModifyInput):
+    if not body.compact and body.resize is None:
+        raise HTTPException(
+            status_code=405, detail="Nothing to do, give compact or resize."
+        )
+    opts = ["modifymedium", "disk", medium]
+    if body.compact:
+        opts.append("--compact")
+    if body.resize is not None:
+        opts += ["--resize", str(body.resize)]
+    return _submitMediumOperation("medium:modify", medium, opts)
 
 
 def _prune_data(our_data):
@@ -559,8 +2244,8 @@ def _prune_data(our_data):
     return our_data
 
 
-def _getMachineState(vm: str):
-    nodeinfo_list = _runVBoxManage(["showvminfo", vm, "--machinereadable"])
+async def _getMachineState(vm: str):
+    nodeinfo_list = await _runVBoxManage(["showvminfo", vm, "--machinereadable"])
     for line in nodeinfo_list:
         delim = line.find("=")
         key = line[:delim].strip('"=')
@@ -569,6 +2254,12 @@ def _getMachineState(vm: str):
             return val
 
 
+_state_watcher = StateWatcher(_listMachines, _getMachineState)
+_network_index = NetworkIndex()
+# one refresh at a time, the one waiting finds the index already updated
+_network_index_lock = asyncio.Lock()
+
+
 class controlInput(BaseModel):
     """
     op must be one of: acpipoweroff, discardstate, pause, poweroff, reset, resume, savestate, start
@@ -577,19 +2268,25 @@ class controlInput(BaseModel):
     op: str
 
 
+_control_ops = (
+    "acpipoweroff",
+    "discardstate",
+    "pause",
+    "poweroff",
+    "reset",
+    "resume",
+    "savestate",
+    "start",
+)
+
+
 @app.put("/machines/{vm}/control")
-def controlMachineState(vm: str, body: controlInput):
+async def controlMachineState(vm: str, body: controlInput, response: Response = None):
+    """
+    Operations on the same VM run one after the other in arrival order, the
+    X-Queue-Depth header counting those that were ahead of this one
+    """
     our_op = body.op.lower()
-    valid_ops = (
-        "acpipoweroff",
-        "discardstate",
-        "pause",
-        "poweroff",
-        "reset",
-        "resume",
-        "savestate",
-        "start",
-    )
     no_changes = {
         "paused": ["pause"],
         "poweroff": ["acpipoweroff", "discardstate", "poweroff"],
@@ -604,17 +2301,30 @@ def controlMachineState(vm: str, body: controlInput):
         "running": ["acpipoweroff", "pause", "poweroff", "reset", "savestate"],
         "saved": ["discardstate", "start"],
     }
-    if not our_op in valid_ops:
+    if not our_op in _control_ops:
         raise HTTPException(
             status_code=405,
             detail=f"The specified operation ({our_op}) does not exist.",
         )
-    all_vms = list(getMachinesList().keys())
-    if not vm in all_vms:
+    key = (await _resolveMachines([vm])).get(vm)
+    if key is None:
         raise HTTPException(
-            status_code=405, detail=f"The specified machine ({vm}) does not exist."
+            status_code=405,
+            detail=f"The specified machine ({vm}) does not exist.",
         )
-    our_state = _getMachineState(vm)
+    if response is not None:
+        response.headers["X-Queue-Depth"] = str(_vm_locks.depth(key))
+    async with _vm_locks.hold(key):
+        return await _controlMachine(vm, our_op, no_changes, valid_changes)
+
+
+async def _controlMachine(vm, our_op, no_changes, valid_changes):
+    # the state is only looked at once the operations queued before are done
+    entry = _state_watcher.lookup(vm) if _state_watcher.ready else None
+    if entry and entry["state"]:
+        our_state = entry["state"]
+    else:
+        our_state = await _getMachineState(vm)
     if our_state in list(no_changes.keys()):
         if our_op in no_changes[our_state]:
             return f"{vm} is already in the {our_state} state."
@@ -624,11 +2334,709 @@ def controlMachineState(vm: str, body: controlInput):
             detail=f"The specified operation ({our_op}) is invalid for the {our_state} state.",
         )
     if our_op == "start":
-        our_output = _runVBoxManage(["startvm", "--type", "headless", vm])
+        our_output = await _runVBoxManage(["startvm", "--type", "headless", vm])
     elif our_op == "discardstate":
-        our_output = _runVBoxManage(["discardstate", vm])
+        our_output = await _runVBoxManage(["discardstate", vm])
     else:
         if our_op == "acpipoweroff":
             our_op = "acpipowerbutton"
-        our_output = _runVBoxManage(["controlvm", vm, our_op])
+        our_output = await _runVBoxManage(["controlvm", vm, our_op])
+    await _state_watcher.refresh(vm)
     return our_output
+
+
+class bulkControlInput(BaseModel):
+    """
+    machines is a list of VM names or UUIDs, op is one of the controlInput ops
+    """
+
+    machines: list[str]
+    op: str
+
+
+@app.post("/machines/_bulk/control", status_code=202)
+async def controlMachinesBulk(body: bulkControlInput):
+    our_op = body.op.lower()
+    if not our_op in _control_ops:
+        raise HTTPException(
+            status_code=405,
+            detail=f"The specified operation ({our_op}) does not exist.",
+        )
+
+    async def control(vm):
+        # run with a capture of its own, not the one of the request that queued it
+        _vboxmanage_capture.set({})
+        return await controlMachineState(vm, controlInput(op=our_op))
+
+    job = _jobs.submit(f"control:{our_op}", dict.fromkeys(body.machines), control)
+    return {"job": job.id, "state": job.state, "machines": len(job.items)}
+
+
+class cloneInput(BaseModel):
+    """
+    name of the new VM, snapshot to clone from (the current state if not
+    given), linked clones need a snapshot; start boots the clone headless
+    """
+
+    name: str
+    snapshot: str = None
+    linked: bool = False
+    start: bool = False
+
+
+async def _cloneMachine(vm, name, snapshot=None, linked=False):
+    opts = ["clonevm", vm, "--name", name, "--register"]
+    if snapshot:
+        opts += ["--snapshot", snapshot]
+    if linked:
+        opts += ["--options", "link"]
+    our_output = await _runVBoxManage(opts)
+    _cache.invalidate("groups")
+    _state_watcher.wake()
+    return our_output
+
+
+@app.post("/machines/{vm}/clone")
+async def cloneMachine(vm: str, body: cloneInput):
+    if body.linked and not body.snapshot:
+        raise HTTPException(
+            status_code=405, detail="A linked clone needs the snapshot to clone from."
+        )
+    our_output = await _cloneMachine(vm, body.name, body.snapshot, body.linked)
+    if body.start:
+        our_output += await _runVBoxManage(["startvm", "--type", "headless", body.name])
+    return our_output
+
+
+# snapshot every pool VM takes of itself once built, restored to recycle it
+_pool_snapshot = "pool"
+# states a pool VM has to be powered off from before it is restored or deleted
+_pool_running_states = ("running", "paused", "stuck", "gurumeditation")
+
+
+async def _buildPoolMachine(template, name):
+    pool = PoolTemplates[template]
+    await _cloneMachine(template, name, pool["snapshot"], linked=True)
+    await _runVBoxManage(["snapshot", name, "take", _pool_snapshot])
+    if pool.get("start"):
+        await _runVBoxManage(["startvm", "--type", "headless", name])
+
+
+async def _recyclePoolMachine(template, name):
+    if await _getMachineState(name) in _pool_running_states:
+        await _runVBoxManage(["controlvm", name, "poweroff"])
+    await _runVBoxManage(["snapshot", name, "restore", _pool_snapshot])
+    if PoolTemplates.get(template, {}).get("start"):
+        await _runVBoxManage(["startvm", "--type", "headless", name])
+    await _state_watcher.refresh(name)
+
+
+async def _destroyPoolMachine(name):
+    try:
+        state = await _getMachineState(name)
+    except HTTPException:
+        # never got registered
+        return
+    if state in _pool_running_states:
+        await _runVBoxManage(["controlvm", name, "poweroff"])
+    await _runVBoxManage(["unregistervm", name, "--delete"])
+    _cache.invalidate("groups")
+    _state_watcher.wake()
+
+
+async def _listPoolCandidates():
+    # every registered VM, the pool picks those named like its own
+    return list((await _listMachines())[0])
+
+
+_pool = WarmPool(
+    _buildPoolMachine, _recyclePoolMachine, _destroyPoolMachine, _listPoolCandidates
+)
+
+
+class leaseInput(BaseModel):
+    """
+    holder is a free-form note on who holds the lease
+    """
+
+    holder: str = None
+
+
+@app.get("/pool")
+async def getPoolInfo():
+    return {
+        "templates": _pool.status(),
+        "leases": list(_pool.leases.values()),
+        "last_error": _pool.last_error,
+    }
+
+
+@app.post("/pool/{template}/lease")
+async def leasePoolMachine(template: str, body: leaseInput = None):
+    """
+    Hands out a ready VM of the template's pool, replaced in the background
+    """
+    if not template in _pool.sizes:
+        raise HTTPException(
+            status_code=404, detail=f"The specified template ({template}) has no pool."
+        )
+    lease = _pool.lease(template, body.holder if body else None)
+    if lease is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"No VM of the {template} pool is ready yet.",
+            headers={"Retry-After": "10"},
+        )
+    return lease
+
+
+@app.delete("/pool/leases/{vm}", status_code=202)
+async def releasePoolMachine(vm: str):
+    """
+    Returns a leased VM to its pool, restored to its snapshot in the background
+    """
+    lease = _pool.release(vm)
+    if lease is None:
+        raise HTTPException(
+            status_code=404, detail=f"The specified machine ({vm}) is not leased."
+        )
+    return lease
+
+
+@app.get("/jobs")
+async def getJobsList():
+    jobs = {}
+    for queue in (_jobs, _medium_jobs):
+        for job in queue.jobs.values():
+            status = job.status()
+            del status["items"]
+            jobs[job.id] = status
+    return jobs
+
+
+def _getJob(job_id):
+    job = _jobs.get(job_id) or _medium_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404, detail=f"The specified job ({job_id}) does not exist."
+        )
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def getJobInfo(job_id: str):
+    return _getJob(job_id).status()
+
+
+@app.get("/jobs/{job_id}/events")
+async def getJobEvents(job_id: str):
+    """
+    Streams the status changes and progress of a job's items, ending with
+    the full status once every item is done
+    """
+    job = _getJob(job_id)
+
+    def render(event):
+        frames = [("snapshot", job.status())] if event is None else [("progress", event)]
+        if job.state == "done":
+            frames.append(("done", job.status()))
+        return frames, job.state == "done"
+
+    async def stream():
+        with job.subscribe() as events:
+            async for frame in _eventStream(events, render):
+                yield frame
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+async def _runningNames():
+    if _state_watcher.ready:
+        return [entry["name"] for entry in _state_watcher.machines.values() if entry["running"]]
+    return list(await _listRunningMachines())
+
+
+_metrics_sampler = MetricsSampler(_runVBoxManage, _runningNames)
+
+
+def _splitMetrics(metric):
+    if not metric:
+        return None
+    metrics = metric.split(",")
+    for name in metrics:
+        if not name in MetricsNames:
+            raise HTTPException(
+                status_code=405, detail=f"The specified metric ({name}) is not sampled."
+            )
+    return metrics
+
+
+@app.get("/machines/{vm}/metrics")
+async def getMachineMetrics(
+    vm: str, metric: str = None, start: float = None, end: float = None, tier: str = None
+):
+    """
+    Returns the sampled metrics of a VM between the start and end Unix
+    times (the last hour by default), from the finest tier still covering
+    start unless a tier is given
+    """
+    metrics = _splitMetrics(metric)
+    if tier and not tier in MetricsRetention:
+        raise HTTPException(
+            status_code=405,
+            detail=f"The specified tier ({tier}) is not one of {', '.join(MetricsRetention)}.",
+        )
+    name = vm
+    if not name in _metrics_sampler.series:
+        entry = _state_watcher.lookup(vm) if _state_watcher.ready else None
+        if entry is None:
+            entry = {"name": None}
+            for found, uuid in (await _listMachines())[0].items():
+                if uuid == vm:
+                    entry["name"] = found
+        name = entry["name"]
+    result = _metrics_sampler.query(name, metrics, start, end, tier)
+    if result is None:
+        raise HTTPException(
+            status_code=404, detail=f"No metrics were sampled for the specified VM ({vm})."
+        )
+    return result
+
+
+@app.get("/metrics/top")
+async def getMetricsTop(metric: str = "CPU/Load/User", n: int = 10, window: float = 300):
+    """
+    Returns the n VMs with the highest average of a metric over the last
+    window seconds
+    """
+    _splitMetrics(metric)
+    return [
+        {"name": name, "value": round(value, 3)}
+        for name, value in _metrics_sampler.top(metric, n, window)
+    ]
+
+
+@app.get("/admin/metrics")
+async def getMetricsSamplerStats():
+    return _metrics_sampler.stats()
+
+
+# guestproperty enumerate and wait lines, the VirtualBox 6 style then the 7 one
+_guest_property_lines = (
+    re.compile(
+        r"Name: (?P<name>[^,]*), value: (?P<value>.*?)"
+        r"(?:, timestamp: (?P<timestamp>\d+))?, flags: ?(?P<flags>.*)$"
+    ),
+    re.compile(r"(?P<name>/\S*)\s+= '(?P<value>.*)'(?: @ (?P<timestamp>\S+))?(?P<flags>.*)$"),
+)
+
+
+def _parseGuestProperty(line):
+    """
+    Returns (name, {"value", "timestamp", "flags"}) of a property line,
+    the timestamp in Unix seconds, None for any other line
+    """
+    for pattern in _guest_property_lines:
+        match = pattern.match(line.strip())
+        if match is not None:
+            break
+    else:
+        return None
+    record = {"value": match["value"], "timestamp": None}
+    timestamp = match["timestamp"]
+    if timestamp and timestamp.isdigit():
+        record["timestamp"] = int(timestamp) / 1e9
+    elif timestamp:
+        try:
+            record["timestamp"] = datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            pass
+    flags = match["flags"].strip(" ,[]")
+    if flags:
+        record["flags"] = flags
+    return match["name"], record
+
+
+async def _listGuestProperties(vm):
+    properties = {}
+    for line in await _runVBoxManage(["guestproperty", "enumerate", vm]):
+        found = _parseGuestProperty(line)
+        if found is not None:
+            properties[found[0]] = found[1]
+    return properties
+
+
+async def _waitGuestProperty(vm, timeout):
+    # returns once any guest property of the VM changed or after timeout seconds
+    opts = ["guestproperty", "wait", vm, "*", "--timeout", str(int(timeout * 1000))]
+    returncode, stdout, stderr = await _spawnVBoxManage(opts, "guestproperty", _execGuestWait)
+    if returncode != 0:
+        our_error, status = _vboxmanageError(stderr)
+        raise HTTPException(status_code=status, detail=our_error)
+
+
+_guest_watcher = GuestPropertyWatcher(
+    _listGuestProperties,
+    _waitGuestProperty,
+    changed=lambda vm: _cache.invalidate(("guestproperties", vm)),
+)
+
+
+@app.get("/machines/{vm}/guestproperties")
+async def getGuestProperties(
+    request: Request, response: Response, vm: str, pattern: str = "*", format: str = None
+):
+    """
+    Returns {name: {"value", "timestamp", "flags"}} of the guest properties
+    of a VM whose name matches pattern, globs separated by |
+    """
+    return await _respond(
+        request,
+        response,
+        format,
+        lambda: _cached("guestproperties", lambda: _listGuestProperties(vm), response, key=vm),
+        "name",
+        lambda properties: {
+            name: record for name, record in properties.items() if matchName(name, pattern)
+        },
+    )
+
+
+class guestPropertiesInput(BaseModel):
+    """
+    machines is a list of VM names or UUIDs, pattern selects the properties
+    like it does for /machines/{vm}/guestproperties, parallel optionally
+    lowers BulkConcurrency
+    """
+
+    machines: list[str]
+    pattern: str = "*"
+    parallel: int = 0
+
+
+@app.post("/machines/_bulk/guestproperties")
+async def getGuestPropertiesBulk(body: guestPropertiesInput):
+    limit = _bulkLimit(body.parallel)
+    properties = {}
+    errors = {}
+
+    async def fetch(vm):
+        async with limit:
+            try:
+                found = await _cached(
+                    "guestproperties", lambda: _listGuestProperties(vm), key=vm
+                )
+            except HTTPException as e:
+                errors[vm] = {"status": e.status_code, "detail": e.detail}
+                return
+            properties[vm] = {
+                name: record for name, record in found.items() if matchName(name, body.pattern)
+            }
+
+    machines = list(dict.fromkeys(body.machines))
+    await asyncio.gather(*[fetch(vm) for vm in machines])
+    return {
+        "machines": {vm: properties[vm] for vm in machines if vm in properties},
+        "errors": errors,
+    }
+
+
+def _guestError(error):
+    if isinstance(error, HTTPException):
+        return {"status": error.status_code, "detail": error.detail}
+    return {"status": 500, "detail": str(error)}
+
+
+@app.get("/machines/{vm}/guestproperties/wait")
+async def waitGuestProperties(
+    request: Request, vm: str, pattern: str, value: str = None, timeout: float = 60
+):
+    """
+    Blocks until a guest property matching pattern is set (to value if
+    given), returning the matching ones, 504 after timeout seconds. With
+    Accept: text/event-stream every change of the matching properties is
+    streamed instead, ending with a match or timeout event. However many
+    clients wait on a VM, a single guestproperty wait watches it
+    """
+    if timeout <= 0 or timeout > GuestPropertyMaxWait:
+        raise HTTPException(
+            status_code=405,
+            detail=f"The specified timeout ({timeout}) is not between 0 and {GuestPropertyMaxWait}.",
+        )
+    if not "text/event-stream" in request.headers.get("accept", ""):
+        found = await _guest_watcher.wait(vm, pattern, value, timeout)
+        if not found:
+            raise HTTPException(
+                status_code=504,
+                detail=f"No guest property matching {pattern} was set within {timeout} seconds.",
+            )
+        return found
+
+    sent = {}
+
+    def render(watch):
+        if watch.properties is None:
+            if watch.error is not None:
+                return [("error", _guestError(watch.error))], True
+            return [], False
+        frames = []
+        current = {
+            name: record
+            for name, record in watch.properties.items()
+            if matchName(name, pattern)
+        }
+        for name in sorted(current.keys() | sent.keys()):
+            record = current.get(name, {"value": None})
+            if sent.get(name) != record["value"]:
+                sent[name] = record["value"]
+                frames.append(("property", {"name": name, **record}))
+        found = matchProperties(watch.properties, pattern, value)
+        if found:
+            frames.append(("match", found))
+        return frames, bool(found)
+
+    async def stream():
+        with _guest_watcher.subscribe(vm) as (watch, changes):
+            # the changes only wake the stream up, what changed is in watch
+            async for frame in _eventStream(changes, lambda changed: render(watch), timeout):
+                yield frame
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/admin/guestproperties")
+async def getGuestWatcherStatus():
+    return _guest_watcher.status()
+
+
+class execInput(BaseModel):
+    """
+    exe is the path of the program in the guest, args its arguments (the
+    first being argv[0], exe when not given), env NAME=VALUE pairs added to
+    its environment; username and password default to GuestUsername and
+    GuestPasswordFile, timeout to ExecTimeout
+    """
+
+    exe: str
+    args: list[str] = []
+    env: dict[str, str] = {}
+    username: str = None
+    password: str = None
+    timeout: float = None
+
+
+# guest commands running per VM UUID
+_exec_running = collections.Counter()
+
+
+def _execBusy(uuid):
+    return _exec_running[uuid] >= ExecPerVM or sum(_exec_running.values()) >= ExecConcurrency
+
+
+def _execReserve(uuid):
+    """
+    Takes a guest command slot of a VM, returning what gives it back: safe
+    to call more than once, only the first call counts
+    """
+    _exec_running[uuid] += 1
+    reserved = [True]
+
+    def release():
+        if reserved:
+            reserved.clear()
+            _exec_running[uuid] -= 1
+            if not _exec_running[uuid]:
+                del _exec_running[uuid]
+
+    return release
+
+
+class _ExecResponse(StreamingResponse):
+    """
+    Gives back the guest command slot its handler took however the response
+    ends, whether or not it ever started streaming
+    """
+
+    def __init__(self, content, release):
+        super().__init__(content, media_type="application/x-ndjson")
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+async def _readGuestOutput(stream, name, emit, outcome, process):
+    # passes the output on as it comes, VBoxManage's own errors on stderr
+    # kept apart from the guest's; kills the command once over ExecOutputLimit
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = b""
+    while True:
+        chunk = await stream.read(65536)
+        if chunk:
+            outcome["bytes"][name] += len(chunk)
+            if sum(outcome["bytes"].values()) > ExecOutputLimit:
+                outcome["truncated"] = True
+                process.kill()
+                chunk = b""
+        if name == "stderr":
+            lines = (pending + chunk).split(b"\n")
+            # the last line may be incomplete, unless there is no more
+            pending = lines.pop() if chunk else b""
+            kept = []
+            for line in lines:
+                if line.startswith(b"VBoxManage: error: "):
+                    outcome["errors"].append(line[19:].decode("utf-8", "replace"))
+                else:
+                    kept.append(line)
+            chunk = b"\n".join(kept) + (b"\n" if kept and chunk else b"")
+        text = decoder.decode(chunk, final=not chunk)
+        if text:
+            await emit({"stream": name, "data": text})
+        if not chunk and (stream.at_eof() or outcome["truncated"]):
+            return
+
+
+async def _execGuestCommand(command, timeout, emit, outcome):
+    # neither takes a VBoxManageConcurrency slot nor keeps the output, the
+    # exec caps bound how many run
+    try:
+        returncode, _ = await _superviseProcess(
+            command,
+            # VBoxManage kills the guest process itself at timeout
+            timeout + 10,
+            lambda process: (
+                _readGuestOutput(process.stdout, "stdout", emit, outcome, process),
+                _readGuestOutput(process.stderr, "stderr", emit, outcome, process),
+            ),
+        )
+    except asyncio.TimeoutError:
+        outcome["timed_out"] = True
+        # the exit code asyncio reports for the process we killed
+        return -signal.SIGKILL, b"", b""
+    return returncode, b"", b""
+
+
+@app.post("/machines/{vm}/exec")
+async def execInGuest(vm: str, body: execInput):
+    """
+    Runs a program in the guest of a running VM, streaming its output as
+    NDJSON records {"stream": "stdout" or "stderr", "data"} as it is
+    printed. The last record holds the exit code (that of the program
+    unless VBoxManage failed, its errors listed in errors), the seconds it
+    took, the bytes printed and whether it was killed for running over
+    its timeout or printing more than ExecOutputLimit
+    """
+    timeout = ExecTimeout if body.timeout is None else body.timeout
+    if timeout <= 0 or timeout > ExecTimeout:
+        raise HTTPException(
+            status_code=405,
+            detail=f"The specified timeout ({timeout}) is not between 0 and {ExecTimeout}.",
+        )
+    username = body.username or GuestUsername
+    if not username or not (body.password is not None or GuestPasswordFile):
+        raise HTTPException(
+            status_code=405, detail="No guest username and password were given or configured."
+        )
+    # the per VM limit holds whether the VM is named by name or UUID
+    uuid = (await _resolveMachines([vm])).get(vm)
+    if uuid is None:
+        raise HTTPException(
+            status_code=404, detail=f"The specified machine ({vm}) does not exist."
+        )
+    entry = _state_watcher.lookup(uuid) if _state_watcher.ready else None
+    state = entry["state"] if entry is not None else await _getMachineState(vm)
+    if state != "running":
+        raise HTTPException(
+            status_code=409, detail=f"The specified machine ({vm}) is not running ({state})."
+        )
+    if _execBusy(uuid):
+        raise HTTPException(
+            status_code=429,
+            detail="Too many guest commands are running already.",
+            headers={"Retry-After": "5"},
+        )
+    chunks = asyncio.Queue(maxsize=16)
+    outcome = {
+        "bytes": {"stdout": 0, "stderr": 0},
+        "errors": [],
+        "truncated": False,
+        "timed_out": False,
+    }
+
+    async def run():
+        password_file = GuestPasswordFile
+        if body.password is not None:
+            # never on the command line, where every local user could read it
+            with tempfile.NamedTemporaryFile("w", prefix="vbox-", delete=False) as secret:
+                secret.write(body.password)
+            password_file = secret.name
+        opts = ["guestcontrol", vm, "run", "--exe", body.exe]
+        opts += ["--username", username, "--passwordfile", password_file]
+        for name, value in body.env.items():
+            opts += ["--putenv", f"{name}={value}"]
+        opts += ["--timeout", str(int(timeout * 1000)), "--wait-stdout", "--wait-stderr"]
+        opts += ["--", *(body.args or [body.exe])]
+        try:
+            return await _spawnVBoxManage(
+                opts,
+                "guestcontrol",
+                lambda command: _execGuestCommand(command, timeout, chunks.put, outcome),
+            )
+        finally:
+            if password_file != GuestPasswordFile:
+                os.unlink(password_file)
+
+    async def stream():
+        started = time.perf_counter()
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                # a full queue holds the readers back, and VBoxManage with them
+                chunk = asyncio.ensure_future(chunks.get())
+                await asyncio.wait([chunk, task], return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    chunk.cancel()
+                    break
+                yield _dumps(chunk.result()) + b"\n"
+            while not chunks.empty():
+                yield _dumps(chunks.get_nowait()) + b"\n"
+            try:
+                returncode, stdout, stderr = await task
+            except HTTPException as e:
+                returncode, stdout, stderr = None, b"", b""
+                outcome["errors"].append(e.detail)
+            except Exception as e:
+                # the client still gets its final record
+                logger.exception("guest command on %s failed", vm)
+                returncode, stdout, stderr = None, b"", b""
+                outcome["errors"].append(str(e) or type(e).__name__)
+            # only a VBoxManageBackend answers all at once
+            for name, output in (("stdout", stdout), ("stderr", stderr)):
+                if output:
+                    yield _dumps({"stream": name, "data": output.decode("utf-8", "replace")}) + b"\n"
+            yield _dumps(
+                {
+                    "exit": returncode,
+                    "seconds": round(time.perf_counter() - started, 3),
+                    **outcome,
+                }
+            ) + b"\n"
+        finally:
+            # the client went away, or it is all done
+            task.cancel()
+            release()
+
+    # taken last, nothing may fail or wait between here and the response
+    release = _execReserve(uuid)
+    return _ExecResponse(stream(), release)
+
+
+@app.get("/admin/exec")
+async def getExecCounts():
+    return {
+        "running": dict(_exec_running),
+        "limits": {"host": ExecConcurrency, "vm": ExecPerVM},
+    }
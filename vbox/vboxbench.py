@@ -0,0 +1,267 @@
+"""
+Offline benchmarks for the VBoxManage output parsers, run with:
+
+    python -m vbox.vboxbench
+
+or through pytest-benchmark, next to the parser tests in tests/:
+
+    pytest tests/test_bench.py --benchmark-only
+
+Recorded VBoxManage outputs live in vbox/fixtures. Every fixture file holds
+any number of recordings, each introduced by the command that produced it:
+
+    $ VBoxManage list intnets
+    Name: intnet0
+
+A recording whose first line is '! <code>' replays a failure, the remaining
+lines being written to stderr. ReplayBackend feeds these through
+_runVBoxManage, so parsers run exactly as they would against VirtualBox.
+"""
+import asyncio, contextlib, json, statistics, time, tracemalloc
+import click
+from . import vboxapi
+from .vboxfake import FixturePath, loadRecordings
+
+
+class ReplayBackend:
+    """
+    VBoxManageBackend answering from recordings instead of running VBoxManage
+    """
+
+    def __init__(self, recordings):
+        self.recordings = recordings
+        self.calls = 0
+        self.lines = 0
+
+    async def __call__(self, command):
+        key = tuple(command[len(vboxapi.VBoxManagePath) :])
+        self.calls += 1
+        if not key in self.recordings:
+            error = f"VBoxManage: error: no recording for '{' '.join(key)}'\n"
+            return 1, b"", error.encode("ascii")
+        recording = self.recordings[key]
+        self.lines += recording[1].count(b"\n")
+        return recording
+
+
+@contextlib.contextmanager
+def replay(recordings=None):
+    if recordings is None:
+        recordings = loadRecordings()
+    backend = ReplayBackend(recordings)
+    previous = vboxapi.VBoxManageBackend
+    vboxapi.VBoxManageBackend = backend
+    vboxapi._cache.invalidate()
+    try:
+        yield backend
+    finally:
+        vboxapi.VBoxManageBackend = previous
+        vboxapi._cache.invalidate()
+
+
+def machineReadableOutput(controllers=8, ports=30, nics=8, extra=400):
+    """
+    Synthesizes a large showvminfo --machinereadable output, returning the
+    lines and the media the attached images belong to
+    """
+    lines = [
+        'name="bench"',
+        'UUID="00000000-0000-0000-0000-000000000000"',
+        'VMState="running"',
+        'vrde="on"',
+        "vrdeport=3389",
+        'vrdeproperty[TCP/Ports]="3389"',
+        'captureopts="vc_enabled=false,vc_fps=25"',
+    ]
+    lines += [f'extradata{num}="value {num}"' for num in range(extra)]
+    media = {}
+    for ctrl in range(controllers):
+        lines += [
+            f'storagecontrollername{ctrl}="CTL{ctrl}"',
+            f'storagecontrollertype{ctrl}="IntelAhci"',
+            f'storagecontrollerinstance{ctrl}="{ctrl}"',
+            f'storagecontrollermaxportcount{ctrl}="30"',
+            f'storagecontrollerportcount{ctrl}="{ports}"',
+            f'storagecontrollerbootable{ctrl}="on"',
+        ]
+    for ctrl in range(controllers):
+        for port in range(ports):
+            uuid = f"{ctrl:08x}-0000-0000-0000-{port:012x}"
+            media[uuid] = {"Device": "hdd", "Location": f"/vms/bench/{uuid}.vdi"}
+            lines.append(f'"CTL{ctrl}-{port}-0"="/vms/bench/{uuid}.vdi"')
+            lines.append(f'"CTL{ctrl}-ImageUUID-{port}-0"="{uuid}"')
+    for nic in range(1, nics + 1):
+        lines += [
+            f'natnet{nic}="nat"',
+            f'macaddress{nic}="0800270000{nic:02X}"',
+            f'cableconnected{nic}="on"',
+            f'nic{nic}="nat"',
+            f'nictype{nic}="82540EM"',
+            f'nicspeed{nic}="0"',
+            'mtu="0"',
+            'sockSnd="64"',
+            'sockRcv="64"',
+            'tcpWndSnd="64"',
+            'tcpWndRcv="64"',
+        ]
+    return lines, media
+
+
+def bench(func, *args, repeat=5, number=20):
+    """
+    Returns the time of a single call for each of the repeat rounds, in seconds
+    """
+    rounds = []
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        for call in range(number):
+            func(*args)
+        rounds.append((time.perf_counter() - start) / number)
+    return rounds
+
+
+def allocations(func, *args):
+    """
+    Returns the peak traced memory of one call in bytes and the number of
+    memory blocks it allocated that are still alive afterwards
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return peak, blocks
+
+
+def _replayed(recordings):
+    # parser -> coroutine factory, run against the recorded fixtures, and the
+    # line counts of the parsers that take already split output
+    manyctl = recordings[("showvminfo", "manyctl", "--machinereadable")][1]
+    manyctl_keys = vboxapi._parseMachineReadable(manyctl.decode("ascii").splitlines())[2]
+    parsed = {"_getStorageInfo": len(manyctl_keys)}
+    return parsed, {
+        "_listHostInfo": lambda: vboxapi._listHostInfo(),
+        "_listHostExtpacks": lambda: vboxapi._listHostExtpacks(),
+        "_listHostOstypes": lambda: vboxapi._listHostOstypes(),
+        "_listHostProperties": lambda: vboxapi._listHostProperties(),
+        "_listMachines": lambda: vboxapi._listMachines(),
+        "_listMedia": lambda: vboxapi._listMedia(),
+        "getDhcpserversList": lambda: vboxapi.getDhcpserversList(),
+        "getHostonlynetsList": lambda: vboxapi.getHostonlynetsList(),
+        "getInternalnetsList": lambda: vboxapi.getInternalnetsList(),
+        "getNatnetworksList": lambda: vboxapi.getNatnetworksList(),
+        "getNicInfo": lambda: vboxapi.getNicInfo("manynics"),
+        "_buildSharedFolders": lambda: vboxapi._buildSharedFolders("manynics"),
+        "_getStorageInfo": lambda: vboxapi._getStorageInfo(manyctl_keys),
+        "getMachinesNodeInfo[manynics]": lambda: vboxapi.getMachinesNodeInfo("manynics"),
+        "getMachinesNodeInfo[manyctl]": lambda: vboxapi.getMachinesNodeInfo("manyctl"),
+        "getMachinesNodeInfo[chain]": lambda: vboxapi.getMachinesNodeInfo("chain"),
+    }
+
+
+def benchFixtures(recordings=None, repeat=5, number=20, match=None):
+    """
+    Runs every parser against the recorded fixtures, returning
+    {parser: {"lines", "rounds", "peak", "blocks"}}
+    """
+    if recordings is None:
+        recordings = loadRecordings()
+    results = {}
+    loop = asyncio.new_event_loop()
+    try:
+        with replay(recordings) as backend:
+            parsed, parsers = _replayed(recordings)
+            for name, factory in parsers.items():
+                if match and not match in name:
+                    continue
+                run = lambda: loop.run_until_complete(factory())
+                # warm up once so cached lookups (the medium index) are hits
+                run()
+                backend.lines = 0
+                run()
+                lines = backend.lines
+                if not lines:
+                    lines = parsed.get(name, 0)
+                peak, blocks = allocations(run)
+                results[name] = {
+                    "lines": lines,
+                    "rounds": bench(run, repeat=repeat, number=number),
+                    "peak": peak,
+                    "blocks": blocks,
+                }
+    finally:
+        loop.close()
+    return results
+
+
+def benchMachineReadable(repeat=5, number=20):
+    lines, media = machineReadableOutput()
+    vboxapi._cache.set("media", vboxapi.MediumIndex(media), 3600)
+    parsed = vboxapi._parseMachineReadable(lines)
+    loop = asyncio.new_event_loop()
+    try:
+        parsers = {
+            "synthetic _parseMachineReadable": (
+                len(lines),
+                lambda: vboxapi._parseMachineReadable(lines),
+            ),
+            "synthetic _getStorageInfo": (
+                len(parsed[2]),
+                lambda: loop.run_until_complete(vboxapi._getStorageInfo(parsed[2])),
+            ),
+        }
+        results = {}
+        for name, (count, run) in parsers.items():
+            peak, blocks = allocations(run)
+            results[name] = {
+                "lines": count,
+                "rounds": bench(run, repeat=repeat, number=number),
+                "peak": peak,
+                "blocks": blocks,
+            }
+    finally:
+        loop.close()
+        vboxapi._cache.invalidate("media")
+    return results
+
+
+def report(results):
+    print(
+        f"{'parser':<34}{'lines':>7}{'min usec':>11}{'mean usec':>11}"
+        f"{'stdev':>9}{'lines/s':>13}{'peak KiB':>10}{'blocks':>8}"
+    )
+    for name, result in results.items():
+        best = min(result["rounds"])
+        print(
+            f"{name:<34}{result['lines']:>7}{best * 1e6:>11.1f}"
+            f"{statistics.mean(result['rounds']) * 1e6:>11.1f}"
+            f"{statistics.pstdev(result['rounds']) * 1e6:>9.1f}"
+            f"{result['lines'] / best:>13,.0f}"
+            f"{result['peak'] / 1024:>10.1f}{result['blocks']:>8}"
+        )
+
+
+@click.command()
+@click.option("--fixtures", default=FixturePath, help="Directory of recorded outputs.")
+@click.option("--repeat", default=5, help="Timing rounds per parser.")
+@click.option("--number", default=20, help="Calls per timing round.")
+@click.option("-k", "match", default=None, help="Only run parsers containing this.")
+@click.option("--json", "as_json", is_flag=True, help="Print raw results as JSON.")
+def main(fixtures, repeat, number, match, as_json):
+    results = benchFixtures(loadRecordings(fixtures), repeat, number, match)
+    if not match:
+        results.update(benchMachineReadable(repeat, number))
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
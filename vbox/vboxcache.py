@@ -0,0 +1,136 @@
+import asyncio, time
+from collections import OrderedDict, deque
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache where every entry carries its own time to live
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns (True, value) for a live entry, (False, None) otherwise
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if time.monotonic() < expires:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._entries[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """
+        Drops a single entry and those keyed (key, ...), or everything when
+        no key is given; returns the number of entries removed
+        """
+        if key is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        keys = [
+            found
+            for found in self._entries
+            if found == key or (type(found) is tuple and found[0] == key)
+        ]
+        for found in keys:
+            del self._entries[found]
+        return len(keys)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": {
+                str(key): round(expires - now, 3)
+                for key, (expires, value) in self._entries.items()
+                if expires > now
+            },
+        }
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.callers = 0
+        self.waiting = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls sharing a key into a single execution whose
+    result (or exception) is handed to every caller
+    """
+
+    def __init__(self, history=100):
+        self.executions = 0
+        self.callers = 0
+        self.recent = deque(maxlen=history)
+        self._flights = {}
+
+    async def do(self, key, call):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda task: self._land(key, flight))
+            self._flights[key] = flight
+        flight.callers += 1
+        flight.waiting += 1
+        self.callers += 1
+        try:
+            # shield so one caller going away doesn't cancel it for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiting -= 1
+            if flight.waiting == 0 and not flight.task.done():
+                # nobody is interested in the result any more; forget it right
+                # away, a caller arriving before the task has finished
+                # cancelling must start a new flight rather than join this one
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # mark the exception as retrieved even if every caller left
+            flight.task.exception()
+        self.executions += 1
+        self.recent.append({"key": key, "callers": flight.callers})
+
+    def stats(self):
+        return {
+            "executions": self.executions,
+            "callers": self.callers,
+            "inflight": [
+                {"key": key, "callers": flight.callers}
+                for key, flight in self._flights.items()
+            ],
+            "recent": list(self.recent),
+        }
@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 import click
@@ -14,9 +15,105 @@ def server_group():
 
 
 @server_group.command(name="runserver")
-def runserver_command():
-    print("stub run server")
+@click.option("--host", default="127.0.0.1", help="Address to listen on.")
+@click.option("--port", default=8000, help="Port to listen on.")
+@click.option("--workers", default=1, help="Worker processes, each with caches of its own.")
+@click.option("--log-level", default="info", help="uvicorn and vbox log level.")
+@click.option(
+    "--graceful-timeout",
+    default=30,
+    help="Seconds requests in flight get to finish on shutdown.",
+)
+@click.option("--vboxmanage", default=None, help="VBoxManage to run instead of the one found.")
+def runserver_command(host, port, workers, log_level, graceful_timeout, vboxmanage):
+    from .vboxserver import run
+
+    run(host, port, workers, log_level, graceful_timeout, vboxmanage)
+
+
+def _hosts(hosts, hosts_file):
+    # --host options, then the hosts file, then $VBOX_HOSTS
+    found = list(hosts)
+    if hosts_file:
+        with open(hosts_file) as listed:
+            for line in listed:
+                line = line.split("#")[0].strip()
+                if line:
+                    found.append(line)
+    if not found:
+        found = os.environ.get("VBOX_HOSTS", "").replace(",", " ").split()
+    if not found:
+        raise click.UsageError("No hosts given, use --host, --hosts-file or $VBOX_HOSTS.")
+    return list(dict.fromkeys(found))
+
+
+@click.group(name="fleet")
+@click.option("-H", "--host", "hosts", multiple=True, help="API host[:port] or URL, repeatable.")
+@click.option("--hosts-file", type=click.Path(exists=True), help="File listing one host per line.")
+@click.option("--timeout", default=5.0, help="Seconds each host has to answer.")
+@click.option(
+    "--cache-dir", default=None, help="Where host inventories are cached (~/.cache/vbox/hosts)."
+)
+@click.option(
+    "--max-age",
+    type=float,
+    default=None,
+    help="Answer from inventories cached less than this many seconds ago.",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the rows as JSON.")
+@click.pass_context
+def fleet_group(ctx, hosts, hosts_file, timeout, cache_dir, max_age, as_json):
+    from .vboxfleet import DefaultCache, Fleet
+
+    cache_dir = cache_dir or DefaultCache
+    ctx.obj = {
+        "fleet": Fleet(_hosts(hosts, hosts_file), timeout=timeout, cache_dir=cache_dir),
+        "max_age": max_age,
+        "json": as_json,
+    }
+
+
+def _report(options, call, columns=("host", "name", "uuid", "running")):
+    import asyncio
+    from .vboxfleet import table
+
+    async def run():
+        async with options["fleet"] as fleet:
+            return await call(fleet)
+
+    rows, errors = asyncio.run(run())
+    if options["json"]:
+        print(json.dumps(rows, indent=2))
+    else:
+        for line in table(rows, columns):
+            print(line)
+    for host, error in errors.items():
+        print(f"{host}: {error}", file=sys.stderr)
+    return rows, errors
+
+
+@fleet_group.command(name="machines")
+@click.option("--running/--stopped", default=None, help="Only running or only stopped VMs.")
+@click.option("--name", default=None, help="Only VMs whose name matches this glob.")
+@click.pass_obj
+def fleet_machines_command(options, running, name):
+    rows, errors = _report(
+        options,
+        lambda fleet: fleet.machines(running=running, name=name, max_age=options["max_age"]),
+    )
+    if errors:
+        sys.exit(1)
+
+
+@fleet_group.command(name="find")
+@click.argument("vm")
+@click.pass_obj
+def fleet_find_command(options, vm):
+    rows, errors = _report(options, lambda fleet: fleet.find(vm, max_age=options["max_age"]))
+    if not rows:
+        sys.exit(1)
 
 
 cli.add_command(server_group)
+cli.add_command(fleet_group)
 main = cli
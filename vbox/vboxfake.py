@@ -0,0 +1,742 @@
+"""
+Simulated VBoxManage for load testing without VirtualBox, swapped in with:
+
+    vboxapi.VBoxManagePath = [sys.executable, "-I", "-S", vboxfake.__file__]
+
+It only uses the standard library (and little of it) so that it starts as
+quickly as Python allows. The simulated host is configured through the environment:
+
+    VBOXFAKE_STATE    state file, created on first use (default: $TMPDIR)
+    VBOXFAKE_VMS      number of VMs in a new state file (default: 1000)
+    VBOXFAKE_LATENCY  multiplier for the simulated command latency (default: 1)
+    VBOXFAKE_SPAWNS   file every invocation appends its subcommand to
+
+Host-level outputs (ostypes, system properties, networks...) are replayed
+from the recordings in vbox/fixtures, VMs and media are generated. Like
+VirtualBox, a command changing a VM holds its session until it is done, an
+overlapping one on the same VM (by the same name or UUID) fails as locked.
+"""
+import fcntl, json, os, sys, time
+
+FixturePath = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# seconds each subcommand takes on a real host, before VBOXFAKE_LATENCY scaling
+Latency = {
+    "-v": 0.005,
+    "list": 0.015,
+    "showvminfo": 0.03,
+    "startvm": 1.0,
+    "controlvm": 0.2,
+    "discardstate": 0.1,
+    "metrics": 0.02,
+    "clonevm": 2.0,
+    "snapshot": 0.5,
+    "unregistervm": 0.5,
+    "createmedium": 1.0,
+    "clonemedium": 5.0,
+    "modifymedium": 3.0,
+    "guestproperty": 0.02,
+}
+
+# subcommands writing 0%...10%...100% to stderr while they run
+Progress = ("clonevm", "snapshot", "createmedium", "clonemedium", "modifymedium")
+
+# controlvm op -> (states it is valid in, resulting state)
+ControlOps = {
+    "pause": (("running",), "paused"),
+    "resume": (("paused",), "running"),
+    "reset": (("running",), "running"),
+    "poweroff": (("running", "paused", "gurumeditation"), "poweroff"),
+    "savestate": (("running", "paused"), "saved"),
+    "acpipowerbutton": (("running",), "poweroff"),
+}
+
+Templates = 8
+# seconds after startvm the guest additions of a VM report in, before
+# VBOXFAKE_LATENCY scaling
+BootTime = 5
+
+
+def loadRecordings(path=FixturePath):
+    """
+    Returns {argument tuple: (returncode, stdout, stderr)} for every
+    recording in the fixture files under path
+    """
+    import shlex
+
+    recordings = {}
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(path, name)) as fixture:
+            chunks = fixture.read().split("$ VBoxManage ")
+        for chunk in chunks[1:]:
+            command, _, output = chunk.partition("\n")
+            lines = output.rstrip("\n").split("\n")
+            if lines[0].startswith("! "):
+                stderr = "\n".join(lines[1:]) + "\n"
+                recording = (int(lines[0][2:]), b"", stderr.encode("ascii"))
+            else:
+                recording = (0, output.rstrip("\n").encode("ascii") + b"\n", b"")
+            recordings[tuple(shlex.split(command))] = recording
+    return recordings
+
+
+class VBoxManageError(Exception):
+    pass
+
+
+def _uuid(kind, num):
+    return f"{kind:08x}-{num // 65536:04x}-4000-8000-{num % 65536:012x}"
+
+
+def newHost(vm_count):
+    host = {"vms": {}, "media": {}}
+    for tmpl in range(Templates):
+        host["media"][_uuid(0xBA5E, tmpl)] = {
+            "parent": None,
+            "location": f"/srv/vms/templates/template{tmpl}.vdi",
+            "capacity": 20480,
+        }
+    for num in range(vm_count):
+        name = f"vm{num:04d}"
+        uuid = _uuid(0x5EED, num)
+        parent = _uuid(0xBA5E, num % Templates)
+        # linked clones of the templates, some with a few snapshots on top
+        for depth in range(1 + num % 3):
+            disk = _uuid(0xD15C0000 + depth, num)
+            host["media"][disk] = {
+                "parent": parent,
+                "location": f"/srv/vms/{name}/Snapshots/{{{disk}}}.vdi",
+                "capacity": 20480,
+            }
+            parent = disk
+        host["vms"][name] = {
+            "uuid": uuid,
+            "state": "poweroff",
+            "group": f"/lab{num % 10}",
+            "memory": 1024 * (1 + num % 4),
+            "cpus": 1 + num % 4,
+            "disk": parent,
+            "hostonly": f"vboxnet{num % 8}",
+        }
+    return host
+
+
+class FakeHost:
+    def __init__(self, path, vm_count):
+        self.path = path
+        self.vm_count = vm_count
+        self._lock = None
+        self.data = None
+
+    def load(self, write=False):
+        if write:
+            self._lock = open(self.path + ".lock", "w")
+            fcntl.flock(self._lock, fcntl.LOCK_EX)
+        try:
+            with open(self.path) as state:
+                self.data = json.load(state)
+        except FileNotFoundError:
+            self.data = newHost(self.vm_count)
+            self.save()
+
+    def save(self):
+        # write-and-rename so readers never see a half written file
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, "w") as state:
+            json.dump(self.data, state)
+        os.replace(tmp, self.path)
+
+    def release(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def find(self, vm):
+        if vm in self.data["vms"]:
+            return vm, self.data["vms"][vm]
+        for name, attrs in self.data["vms"].items():
+            if attrs["uuid"] == vm:
+                return name, attrs
+        raise VBoxManageError(
+            f"Could not find a registered machine named '{vm}'\n"
+            "Details: code VBOX_E_OBJECT_NOT_FOUND (0x80bb0001), component "
+            "VirtualBoxWrap, interface IVirtualBox, callee nsISupports"
+        )
+
+
+def listVms(host, running=False):
+    lines = []
+    for name, attrs in host.data["vms"].items():
+        if running and not attrs["state"] in ("running", "paused"):
+            continue
+        lines.append(f'"{name}" {{{attrs["uuid"]}}}')
+    return lines
+
+
+def listHdds(host):
+    lines = []
+    for uuid, medium in host.data["media"].items():
+        lines += [
+            f"UUID:           {uuid}",
+            f"Parent UUID:    {medium['parent'] or 'base'}",
+            "State:          created",
+            f"Type:           normal ({'differencing' if medium['parent'] else 'base'})",
+            f"Location:       {medium['location']}",
+            "Storage format: VDI",
+            f"Capacity:       {medium['capacity']} MBytes",
+            "Encryption:     disabled",
+            "",
+        ]
+    return lines
+
+
+def showVmInfo(host, vm, machinereadable):
+    name, attrs = host.find(vm)
+    disk = attrs["disk"]
+    location = host.data["media"][disk]["location"]
+    mac = f"0800270{attrs['uuid'][-5:].upper()}"
+    if not machinereadable:
+        return [
+            f"Name:                        {name}",
+            f"Groups:                      {attrs['group']}",
+            "Guest OS:                    Debian (64-bit)",
+            f"UUID:                        {attrs['uuid']}",
+            f"Memory size:                 {attrs['memory']}MB",
+            f"Number of CPUs:              {attrs['cpus']}",
+            f"NIC 1:                       MAC: {mac}1, Attachment: NAT, Cable connected: on, "
+            "Trace: off (file: none), Type: virtio, Reported speed: 0 Mbps, "
+            "Boot priority: 0, Promisc Policy: deny, Bandwidth group: none",
+            "NIC 1 Settings:  MTU: 0, Socket (send: 64, receive: 64), TCP Window (send:64, receive: 64)",
+            f"NIC 2:                       MAC: {mac}2, Attachment: Host-only Interface "
+            f"'{attrs['hostonly']}', Cable connected: on, Trace: off (file: none), "
+            "Type: virtio, Reported speed: 0 Mbps, Boot priority: 0, "
+            "Promisc Policy: deny, Bandwidth group: none",
+        ] + [f"NIC {nic}:                       disabled" for nic in range(3, 9)] + [
+            "Shared folders:",
+            "",
+            f"Name: 'data', Host path: '/srv/share/{name}' (machine mapping), writable",
+        ]
+    return [
+        f'name="{name}"',
+        f'groups="{attrs["group"]}"',
+        'ostype="Debian (64-bit)"',
+        f'UUID="{attrs["uuid"]}"',
+        f'CfgFile="/srv/vms/{name}/{name}.vbox"',
+        f"memory={attrs['memory']}",
+        f"cpus={attrs['cpus']}",
+        'firmware="BIOS"',
+        f'VMState="{attrs["state"]}"',
+        'VMStateChangeTime="2023-08-14T09:20:11.000000000"',
+        'vrde="off"',
+        'storagecontrollername0="SATA"',
+        'storagecontrollertype0="IntelAhci"',
+        'storagecontrollerinstance0="0"',
+        'storagecontrollermaxportcount0="30"',
+        'storagecontrollerportcount0="1"',
+        'storagecontrollerbootable0="on"',
+        f'"SATA-0-0"="{location}"',
+        f'"SATA-ImageUUID-0-0"="{disk}"',
+        'natnet1="nat"',
+        f'macaddress1="{mac}1"',
+        'cableconnected1="on"',
+        'nic1="nat"',
+        'nictype1="virtio"',
+        'nicspeed1="0"',
+        'mtu="0"',
+        'sockSnd="64"',
+        'sockRcv="64"',
+        'tcpWndSnd="64"',
+        'tcpWndRcv="64"',
+        f'hostonlyadapter2="{attrs["hostonly"]}"',
+        f'macaddress2="{mac}2"',
+        'cableconnected2="on"',
+        'nic2="hostonly"',
+        'nictype2="virtio"',
+        'nicspeed2="0"',
+    ] + [f'nic{nic}="none"' for nic in range(3, 9)] + [
+        'SharedFolderNameMachineMapping1="data"',
+        f'SharedFolderPathMachineMapping1="/srv/share/{name}"',
+        'captureopts=""',
+    ]
+
+
+def changeState(host, vm, op):
+    name, attrs = host.find(vm)
+    if op == "start":
+        valid, result = ("poweroff", "saved", "aborted"), "running"
+    elif op == "discardstate":
+        valid, result = ("saved",), "poweroff"
+    elif op in ControlOps:
+        valid, result = ControlOps[op]
+    else:
+        raise VBoxManageError(f"Invalid parameter '{op}'")
+    if not attrs["state"] in valid:
+        raise VBoxManageError(
+            f"Machine in invalid state {attrs['state']} -- cannot {op} '{name}'\n"
+            "Details: code VBOX_E_INVALID_VM_STATE (0x80bb0002), component "
+            "ConsoleWrap, interface IConsole, callee nsISupports"
+        )
+    attrs["state"] = result
+    if op in ("start", "reset"):
+        attrs["started"] = time.time()
+    host.save()
+    if op == "start":
+        return [
+            f'Waiting for VM "{name}" to power on...',
+            f'VM "{name}" has been successfully started.',
+        ]
+    return []
+
+
+# metric -> (unit, upper bound of the simulated values)
+Metrics = {
+    "CPU/Load/User": ("%", 100),
+    "CPU/Load/Kernel": ("%", 20),
+    "RAM/Usage/Used": ("kB", 4194304),
+    "Disk/Usage/Used": ("MB", 102400),
+    "Net/Rate/Rx": ("B/s", 1048576),
+    "Net/Rate/Tx": ("B/s", 1048576),
+    "Guest/CPU/Load/User": ("%", 100),
+    "Guest/CPU/Load/Kernel": ("%", 20),
+    "Guest/RAM/Usage/Free": ("kB", 2097152),
+    "Guest/RAM/Usage/Total": ("kB", 2097152),
+}
+
+
+def metricsQuery(host, args):
+    # values change every 10 seconds and differ per object and metric, but
+    # are the same for every caller within those 10 seconds
+    names = args[3].split(",") if len(args) > 3 else list(Metrics)
+    objects = ["host"] + [
+        name
+        for name, attrs in host.data["vms"].items()
+        if attrs["state"] in ("running", "paused")
+    ]
+    lines = [
+        f"{'Object':<15} {'Metric':<40} Values",
+        f"{'-' * 15} {'-' * 40} {'-' * 44}",
+    ]
+    tick = int(time.time() // 10)
+    for obj in objects:
+        for name in names:
+            unit, bound = Metrics.get(name, ("", 100))
+            seed = sum(map(ord, obj + name)) * 37 + tick * 11
+            value = bound * (seed % 100) / 100
+            if unit == "%":
+                value = f"{value:.2f}%"
+            else:
+                value = f"{int(value)} {unit}"
+            lines.append(f"{obj:<15} {name:<40} {value}")
+    return lines
+
+
+def _option(args, name):
+    # value following an option, None if it isn't given
+    if name in args[:-1]:
+        return args[args.index(name) + 1]
+    return None
+
+
+def cloneVm(host, args):
+    source, attrs = host.find(args[1])
+    name = _option(args, "--name") or f"{source} Clone"
+    if name in host.data["vms"]:
+        raise VBoxManageError(
+            f"Could not create machine '{name}': a machine with that name already exists\n"
+            "Details: code VBOX_E_FILE_ERROR (0x80bb0004), component MachineWrap, "
+            "interface IMachine, callee nsISupports"
+        )
+    snapshot = _option(args, "--snapshot")
+    if snapshot is not None and not snapshot in attrs.get("snapshots", {}):
+        raise VBoxManageError(
+            f"Could not find a snapshot named '{snapshot}'\n"
+            "Details: code VBOX_E_OBJECT_NOT_FOUND (0x80bb0001), component "
+            "SnapshotWrap, interface ISnapshot, callee nsISupports"
+        )
+    num = host.data["clones"] = host.data.get("clones", 0) + 1
+    disk = _uuid(0xD15CC10E, num)
+    location = f"/srv/vms/{name}/{name}.vdi"
+    parent = None
+    if "link" in (_option(args, "--options") or "").split(","):
+        # a linked clone writes to a differencing image of the source's disk
+        location = f"/srv/vms/{name}/Snapshots/{{{disk}}}.vdi"
+        parent = attrs["disk"]
+    host.data["media"][disk] = {"parent": parent, "location": location, "capacity": 20480}
+    host.data["vms"][name] = {
+        **attrs,
+        "uuid": _uuid(0xC10E, num),
+        "state": "poweroff",
+        "disk": disk,
+        "snapshots": {},
+    }
+    host.save()
+    return [f'Machine has been successfully cloned as "{name}"']
+
+
+def snapshotVm(host, args):
+    name, attrs = host.find(args[1])
+    op = args[2] if len(args) > 2 else ""
+    snapshot = args[3] if len(args) > 3 else ""
+    snapshots = attrs.setdefault("snapshots", {})
+    if op == "take" and snapshot:
+        # a snapshot of a running VM includes its saved state
+        snapshots[snapshot] = "saved" if attrs["state"] in ("running", "paused") else "poweroff"
+        host.save()
+        return []
+    if op == "restore" and snapshot:
+        if not snapshot in snapshots:
+            raise VBoxManageError(
+                f"Could not find a snapshot named '{snapshot}'\n"
+                "Details: code VBOX_E_OBJECT_NOT_FOUND (0x80bb0001), component "
+                "SnapshotWrap, interface ISnapshot, callee nsISupports"
+            )
+        if attrs["state"] in ("running", "paused"):
+            raise VBoxManageError(
+                f"Machine in invalid state {attrs['state']} -- cannot restore a snapshot "
+                f"of '{name}'\n"
+                "Details: code VBOX_E_INVALID_VM_STATE (0x80bb0002), component "
+                "MachineWrap, interface IMachine, callee nsISupports"
+            )
+        attrs["state"] = snapshots[snapshot]
+        host.save()
+        return [f"Restoring snapshot '{snapshot}'"]
+    raise VBoxManageError(f"Invalid parameter '{op}'")
+
+
+def unregisterVm(host, args):
+    name, attrs = host.find(args[1])
+    if attrs["state"] in ("running", "paused"):
+        raise VBoxManageError(
+            f"Cannot unregister the machine '{name}' while it is locked\n"
+            "Details: code VBOX_E_INVALID_OBJECT_STATE (0x80bb0007), component "
+            "MachineWrap, interface IMachine, callee nsISupports"
+        )
+    del host.data["vms"][name]
+    if "--delete" in args:
+        # its own disk only, shared parents belong to other VMs too
+        medium = host.data["media"].get(attrs["disk"])
+        if medium and medium["location"].startswith(f"/srv/vms/{name}/"):
+            del host.data["media"][attrs["disk"]]
+    host.save()
+    return []
+
+
+def findMedium(host, medium):
+    if medium in host.data["media"]:
+        return medium, host.data["media"][medium]
+    for uuid, attrs in host.data["media"].items():
+        if attrs["location"] == medium:
+            return uuid, attrs
+    raise VBoxManageError(
+        f"Could not find file for the medium '{medium}' (VERR_FILE_NOT_FOUND)\n"
+        "Details: code VBOX_E_FILE_ERROR (0x80bb0004), component MediumWrap, "
+        "interface IMedium, callee nsISupports"
+    )
+
+
+def _newMedium(host, location, capacity, parent=None):
+    if not location.endswith((".vdi", ".vmdk", ".vhd")):
+        location += ".vdi"
+    if any(attrs["location"] == location for attrs in host.data["media"].values()):
+        raise VBoxManageError(
+            f"Failed to create medium: a file '{location}' already exists\n"
+            "Details: code VBOX_E_FILE_ERROR (0x80bb0004), component MediumWrap, "
+            "interface IMedium, callee nsISupports"
+        )
+    num = host.data["media_created"] = host.data.get("media_created", 0) + 1
+    uuid = _uuid(0x3ED1A, num)
+    host.data["media"][uuid] = {"parent": parent, "location": location, "capacity": capacity}
+    host.save()
+    return uuid
+
+
+def mediumCommand(host, args):
+    # the optional disk|dvd|floppy type argument is only taken as disk
+    command = args[0]
+    args = [arg for arg in args[1:] if arg != "disk"]
+    if command == "createmedium":
+        size = _option(args, "--size")
+        if not _option(args, "--filename") or not size:
+            raise VBoxManageError("Parameters --filename and --size are required")
+        uuid = _newMedium(host, _option(args, "--filename"), int(size))
+        return [f"Medium created. UUID: {uuid}"]
+    if command == "clonemedium" and len(args) > 1:
+        source, attrs = findMedium(host, args[0])
+        uuid = _newMedium(host, args[1], attrs["capacity"])
+        return [f"Clone medium created in format 'VDI'. UUID: {uuid}"]
+    if command == "modifymedium" and args:
+        uuid, attrs = findMedium(host, args[0])
+        size = _option(args, "--resize")
+        if size is not None:
+            if int(size) < attrs["capacity"]:
+                raise VBoxManageError(
+                    "Failed to resize medium\n"
+                    "Details: code VBOX_E_NOT_SUPPORTED (0x80bb0009), component "
+                    "MediumWrap, interface IMedium, callee nsISupports"
+                )
+            attrs["capacity"] = int(size)
+            host.save()
+        return []
+    raise VBoxManageError(f"Invalid parameters for {command}")
+
+
+def guestProperties(host, vm):
+    """
+    Returns {name: (value, timestamp in ns)} of a VM, the guest ones set
+    BootTime after it was started
+    """
+    name, attrs = host.find(vm)
+    properties = {"/VirtualBox/HostInfo/VBoxVer": ("7.0.10", 0)}
+    booted = attrs.get("started", 0) + BootTime * float(os.environ.get("VBOXFAKE_LATENCY", "1"))
+    if attrs["state"] in ("running", "paused") and time.time() >= booted:
+        num = int(attrs["uuid"][-12:], 16)
+        subnet = int(attrs["hostonly"][len("vboxnet") :])
+        for key, value in (
+            ("GuestAdd/Version", "7.0.10"),
+            ("GuestInfo/OS/Product", "Linux"),
+            ("GuestInfo/OS/Release", "6.1.0-10-amd64"),
+            ("GuestInfo/Net/Count", "2"),
+            ("GuestInfo/Net/0/V4/IP", "10.0.2.15"),
+            ("GuestInfo/Net/0/Status", "Up"),
+            ("GuestInfo/Net/1/V4/IP", f"192.168.{56 + subnet}.{num % 250 + 2}"),
+            ("GuestInfo/Net/1/Status", "Up"),
+        ):
+            properties[f"/VirtualBox/{key}"] = (value, int(booted * 1e9))
+    return properties
+
+
+def guestProperty(host, args):
+    if args[1] == "enumerate" and len(args) > 2:
+        properties = guestProperties(host, args[2])
+        return [
+            f"Name: {name}, value: {value}, timestamp: {timestamp}, flags: "
+            for name, (value, timestamp) in sorted(properties.items())
+        ]
+    if args[1] == "wait" and len(args) > 3:
+        import fnmatch
+
+        # polls the state file, a real guest notifies VBoxManage
+        patterns = args[3].split("|")
+        timeout = int(_option(args, "--timeout") or 0) / 1000
+        deadline = time.monotonic() + timeout if timeout else None
+        start = guestProperties(host, args[2])
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(0.1)
+            host.load()
+            current = guestProperties(host, args[2])
+            for name in sorted(current.keys() | start.keys()):
+                if not any(fnmatch.fnmatchcase(name, glob) for glob in patterns):
+                    continue
+                if current.get(name, ("",))[0] != start.get(name, ("",))[0]:
+                    return [f"Name: {name}, value: {current.get(name, ('',))[0]}, flags: "]
+        return ["Time out or interruption while waiting for a notification."]
+    raise VBoxManageError(f"Invalid parameters for {' '.join(args[:2])}")
+
+
+def guestRun(host, args):
+    """
+    Runs one of a few simulated guest programs, writing its output as it
+    is printed and returning its exit code: echo, seq (a line every 10 ms),
+    sleep, yes (until --timeout), cat (of missing files), true and false
+    """
+    host.load()
+    try:
+        name, attrs = host.find(args[1])
+        if len(args) < 4 or args[2] != "run" or not "--" in args:
+            raise VBoxManageError("Invalid parameters for guestcontrol")
+        if attrs["state"] != "running":
+            raise VBoxManageError(f'Machine "{name}" is not running (currently {attrs["state"]})!')
+    except VBoxManageError as e:
+        returncode, stdout, stderr = _failure(e)
+        sys.stderr.buffer.write(stderr)
+        return returncode
+    argv = args[args.index("--") + 1 :]
+    program = os.path.basename(_option(args, "--exe") or argv[0])
+    params = argv[1:]
+    timeout = int(_option(args, "--timeout") or 0) / 1000
+    deadline = time.monotonic() + timeout if timeout else float("inf")
+    if program == "echo":
+        sys.stdout.write(" ".join(params) + "\n")
+    elif program == "seq":
+        for num in range(1, int(params[0]) + 1):
+            sys.stdout.write(f"{num}\n")
+            sys.stdout.flush()
+            time.sleep(0.01)
+    elif program == "sleep":
+        time.sleep(max(0, min(float(params[0]), deadline - time.monotonic())))
+    elif program == "yes":
+        while time.monotonic() < deadline:
+            sys.stdout.write("y\n" * 4096)
+    elif program == "cat":
+        for path in params:
+            sys.stderr.write(f"cat: {path}: No such file or directory\n")
+        return 1 if params else 0
+    elif program == "false":
+        return 1
+    elif program != "true":
+        sys.stderr.write(f"VBoxManage: error: File '{argv[0]}' does not exist in the guest\n")
+        return 1
+    if time.monotonic() >= deadline:
+        sys.stderr.write("VBoxManage: error: Process timed out and was killed\n")
+        return 1
+    return 0
+
+
+def usage():
+    # what VBoxManage prints when run without arguments, one line per command
+    commands = ["list", "showvminfo", "startvm", "controlvm", "discardstate"]
+    commands += ["clonevm", "snapshot", "unregistervm", "metrics"]
+    commands += ["createmedium", "clonemedium", "modifymedium", "guestproperty", "guestcontrol"]
+    return ["Usage:", "", "VBoxManage [<general option>] <command>", ""] + [
+        f"VBoxManage {command} [<options>]" for command in commands
+    ]
+
+
+def _generated(args, host):
+    # returns the output lines of the commands answered from the state file,
+    # None for everything else
+    command = args[0] if args else ""
+    if not args:
+        return usage()
+    if args == ["list", "vms"]:
+        return listVms(host)
+    if args == ["list", "runningvms"]:
+        return listVms(host, running=True)
+    if args in (["list", "--long", "vms"], ["list", "-l", "vms"]):
+        lines = []
+        for name in host.data["vms"]:
+            lines += showVmInfo(host, name, False) + [""]
+        return lines
+    if args == ["list", "hdds"]:
+        return listHdds(host)
+    if args[:2] == ["metrics", "setup"]:
+        return []
+    if args[:2] == ["metrics", "query"]:
+        return metricsQuery(host, args)
+    if command == "showvminfo" and len(args) > 1:
+        return showVmInfo(host, args[1], "--machinereadable" in args)
+    if command == "startvm" and len(args) > 1:
+        return changeState(host, args[-1], "start")
+    if command == "discardstate" and len(args) > 1:
+        return changeState(host, args[1], "discardstate")
+    if command == "controlvm" and len(args) > 2:
+        return changeState(host, args[1], args[2])
+    if command == "clonevm" and len(args) > 1:
+        return cloneVm(host, args)
+    if command == "snapshot" and len(args) > 1:
+        return snapshotVm(host, args)
+    if command == "unregistervm" and len(args) > 1:
+        return unregisterVm(host, args)
+    if command in ("createmedium", "clonemedium", "modifymedium"):
+        return mediumCommand(host, args)
+    if command == "guestproperty" and len(args) > 1:
+        return guestProperty(host, args)
+    return None
+
+
+# commands taking the session of the VM named by their first argument
+_sessions = (["controlvm"], ["discardstate"], ["snapshot"], ["unregistervm"])
+
+
+def _lockSession(state, args):
+    # returns the open lock file holding the session of the VM a mutating
+    # command works on, None for other commands, raises if already locked
+    if args[:1] == ["startvm"]:
+        vm = args[-1]
+    elif args[:1] in _sessions and len(args) > 1:
+        vm = args[1]
+    else:
+        return None
+    session = open(f"{state}.{vm}.session", "w")
+    try:
+        fcntl.flock(session, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        session.close()
+        raise VBoxManageError(
+            f"The machine '{vm}' is already locked for a session (or being unlocked)\n"
+            "Details: code VBOX_E_INVALID_OBJECT_STATE (0x80bb0007), component "
+            "MachineWrap, interface IMachine, callee nsISupports"
+        )
+    return session
+
+
+def _failure(error):
+    stderr = "".join(f"VBoxManage: error: {line}\n" for line in str(error).splitlines())
+    return 1, b"", stderr.encode("ascii")
+
+
+def run(args, host, recordings=None):
+    """
+    Returns (returncode, stdout, stderr) for a VBoxManage command line
+    """
+    mutating = args[:1] in (
+        ["startvm"],
+        ["controlvm"],
+        ["discardstate"],
+        ["clonevm"],
+        ["snapshot"],
+        ["unregistervm"],
+        ["createmedium"],
+        ["clonemedium"],
+        ["modifymedium"],
+    )
+    host.load(write=mutating)
+    try:
+        lines = _generated(args, host)
+        if lines is None:
+            if recordings is None:
+                recordings = loadRecordings()
+            if tuple(args) in recordings:
+                return recordings[tuple(args)]
+            raise VBoxManageError(f"Unknown command: {' '.join(args)}")
+    except VBoxManageError as e:
+        return _failure(e)
+    finally:
+        host.release()
+    return 0, ("\n".join(lines) + "\n").encode("ascii"), b""
+
+
+def main(args):
+    start = time.monotonic()
+    state = os.environ.get("VBOXFAKE_STATE") or os.path.join(
+        os.environ.get("TMPDIR", "/tmp"), "vboxfake-state.json"
+    )
+    host = FakeHost(state, int(os.environ.get("VBOXFAKE_VMS", "1000")))
+    spawns = os.environ.get("VBOXFAKE_SPAWNS")
+    if spawns:
+        # a single small O_APPEND write is atomic, so concurrent spawns don't mix
+        fd = os.open(spawns, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        os.write(fd, f"{args[0] if args else ''}\n".encode("ascii"))
+        os.close(fd)
+    if args[:1] == ["guestcontrol"]:
+        # the guest prints as it goes, not all at once like VBoxManage
+        return guestRun(host, args)
+    try:
+        # held until the process exits, simulated latency included
+        session = _lockSession(state, args)
+    except VBoxManageError as e:
+        returncode, stdout, stderr = _failure(e)
+    else:
+        returncode, stdout, stderr = run(args, host)
+    latency = Latency.get(args[0] if args else "", 0.01)
+    latency *= float(os.environ.get("VBOXFAKE_LATENCY", "1"))
+    if returncode == 0 and args and args[0] in Progress:
+        # spread over the simulated run time, the way VirtualBox reports it
+        for percent in range(0, 101, 10):
+            remaining = latency * percent / 100 - (time.monotonic() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+            sys.stderr.write(f"{percent}%..." if percent < 100 else "100%\n")
+            sys.stderr.flush()
+    remaining = latency - (time.monotonic() - start)
+    if remaining > 0:
+        time.sleep(remaining)
+    sys.stdout.buffer.write(stdout)
+    sys.stderr.buffer.write(stderr)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,186 @@
+"""
+Client for the vbox API of many hosts at once:
+
+    async with Fleet(["hv01", "hv02:8080", "https://hv03"]) as fleet:
+        rows, errors = await fleet.machines(running=True)
+
+Every request is sent to all hosts concurrently over one pool of keep-alive
+connections, a host that doesn't answer within the timeout is reported in
+errors instead of holding up the others. Host inventories can be kept on
+disk so repeated queries within max_age don't ask the hosts at all.
+"""
+import asyncio, fnmatch, json, os, time
+
+# port the API listens on when a host is given without one
+DefaultPort = 8000
+# where host inventories are cached when no cache directory is given
+DefaultCache = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "vbox", "hosts"
+)
+
+
+class HostError(Exception):
+    pass
+
+
+def hostURL(host):
+    if "://" in host:
+        return host.rstrip("/")
+    if not ":" in host:
+        host = f"{host}:{DefaultPort}"
+    return f"http://{host}"
+
+
+class Fleet:
+    """
+    The vbox API of a list of hosts, used as an async context manager that
+    holds the connection pool
+    """
+
+    def __init__(self, hosts, timeout=5, connections=4, cache_dir=DefaultCache):
+        self.hosts = {host: hostURL(host) for host in hosts}
+        self.timeout = timeout
+        self.connections = connections
+        self.cache_dir = cache_dir
+        self._client = None
+
+    async def __aenter__(self):
+        import httpx
+
+        limits = httpx.Limits(
+            max_connections=self.connections * len(self.hosts),
+            max_keepalive_connections=self.connections * len(self.hosts),
+        )
+        self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._client = None
+
+    async def request(self, host, method, path, **kwargs):
+        """
+        Returns the decoded JSON answer of a host, raises HostError for
+        anything else, timeouts included
+        """
+        import httpx
+
+        try:
+            response = await asyncio.wait_for(
+                self._client.request(method, self.hosts[host] + path, **kwargs),
+                self.timeout,
+            )
+        except asyncio.TimeoutError:
+            raise HostError(f"no answer within {self.timeout} seconds")
+        except httpx.HTTPError as e:
+            raise HostError(str(e) or type(e).__name__)
+        if response.status_code >= 400:
+            try:
+                detail = response.json()["detail"]
+            except (ValueError, KeyError, TypeError):
+                detail = response.text
+            raise HostError(f"{response.status_code}: {detail}")
+        return response.json()
+
+    async def fanout(self, method, path, hosts=None, **kwargs):
+        """
+        Sends the same request to every host, returning ({host: answer},
+        {host: error message})
+        """
+        hosts = list(self.hosts) if hosts is None else hosts
+        answers = await asyncio.gather(
+            *[self.request(host, method, path, **kwargs) for host in hosts],
+            return_exceptions=True,
+        )
+        results = {}
+        errors = {}
+        for host, answer in zip(hosts, answers):
+            if isinstance(answer, HostError):
+                errors[host] = str(answer)
+            elif isinstance(answer, BaseException):
+                raise answer
+            else:
+                results[host] = answer
+        return results, errors
+
+    def _cachePath(self, host):
+        safe = "".join(char if char.isalnum() or char in ".-" else "_" for char in host)
+        return os.path.join(self.cache_dir, f"{safe}.json")
+
+    def _loadCache(self, host, max_age):
+        try:
+            with open(self._cachePath(host)) as cached:
+                entry = json.load(cached)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["fetched"] > max_age:
+            return None
+        return entry["machines"]
+
+    def _saveCache(self, host, machines):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cachePath(host)
+        # write-and-rename so concurrent commands never read half a file
+        tmp = f"{path}.{os.getpid()}"
+        with open(tmp, "w") as cached:
+            json.dump({"fetched": time.time(), "machines": machines}, cached)
+        os.replace(tmp, path)
+
+    async def inventory(self, max_age=None):
+        """
+        Returns ({host: {VM name: {"uuid", "running"}}}, {host: error}),
+        from the on-disk cache for hosts fetched less than max_age seconds ago
+        """
+        inventories = {}
+        if max_age is not None and self.cache_dir:
+            for host in self.hosts:
+                machines = self._loadCache(host, max_age)
+                if machines is not None:
+                    inventories[host] = machines
+        missing = [host for host in self.hosts if not host in inventories]
+        fetched, errors = await self.fanout("GET", "/machines", hosts=missing)
+        for host, machines in fetched.items():
+            inventories[host] = machines
+            if self.cache_dir:
+                self._saveCache(host, machines)
+        return inventories, errors
+
+    async def machines(self, running=None, name=None, max_age=None):
+        """
+        Returns the rows {"host", "name", "uuid", "running"} of the VMs of
+        every host, optionally only the (not) running ones or those whose
+        name matches a glob, and {host: error}
+        """
+        inventories, errors = await self.inventory(max_age)
+        rows = []
+        for host in self.hosts:
+            for vm, record in sorted(inventories.get(host, {}).items()):
+                if running is not None and (record["running"] == "true") != running:
+                    continue
+                if name and not fnmatch.fnmatchcase(vm, name):
+                    continue
+                rows.append({"host": host, "name": vm, **record})
+        return rows, errors
+
+    async def find(self, vm, max_age=None):
+        """
+        Returns the rows of the VMs named vm or with that UUID on any host
+        """
+        rows, errors = await self.machines(max_age=max_age)
+        return [row for row in rows if vm in (row["name"], row["uuid"])], errors
+
+
+def table(rows, columns):
+    """
+    Returns rows of dicts as lines of left aligned columns under a header
+    """
+    widths = {
+        column: max([len(column)] + [len(str(row.get(column, ""))) for row in rows])
+        for column in columns
+    }
+    lines = ["  ".join(column.upper().ljust(widths[column]) for column in columns).rstrip()]
+    for row in rows:
+        lines.append(
+            "  ".join(str(row.get(column, "")).ljust(widths[column]) for column in columns).rstrip()
+        )
+    return lines
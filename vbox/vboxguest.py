@@ -0,0 +1,138 @@
+import asyncio, contextlib, fnmatch
+from .vboxtasks import cancelTasks, detachTask, publish
+
+
+def matchName(name, pattern):
+    # pattern is one or more globs separated by |, like guestproperty wait takes
+    return any(fnmatch.fnmatchcase(name, glob) for glob in pattern.split("|"))
+
+
+def matchProperties(properties, pattern="*", value=None):
+    """
+    Returns {name: record} of the set properties whose name matches
+    pattern, only those set to value if given
+    """
+    return {
+        name: record
+        for name, record in properties.items()
+        if matchName(name, pattern)
+        and (record["value"] == value if value is not None else record["value"] != "")
+    }
+
+
+class _Watch:
+    def __init__(self):
+        # name -> record, None until the first enumerate
+        self.properties = None
+        self.error = None
+        self.task = None
+        self._subscribers = set()
+
+
+class GuestPropertyWatcher:
+    """
+    Watches the guest properties of the VMs somebody is waiting on, one
+    loop per VM however many clients wait for it.
+
+    enumerate(vm) must return {name: {"value", ...}} of every property of a
+    VM and wait(vm, timeout) return as soon as one changes, or after timeout
+    seconds. The loop enumerates again after every wait: a guest booting
+    sets a burst of properties, only the first of which the wait sees, and
+    whatever changes between two waits is caught that way too. It stops as
+    soon as the last client is gone; changed(vm) is called whenever any
+    property changed.
+    """
+
+    def __init__(self, enumerate, wait, changed=None, interval=30, retry_interval=5):
+        self.enumerate = enumerate
+        self.wait_change = wait
+        self.changed = changed
+        self.interval = interval
+        self.retry_interval = retry_interval
+        # vm -> _Watch
+        self.watches = {}
+
+    @contextlib.contextmanager
+    def subscribe(self, vm, maxsize=100):
+        """
+        Yields the watch of a VM, with its properties and error, and a queue
+        of the sets of property names changed since
+        """
+        watch = self.watches.get(vm)
+        if watch is None:
+            watch = self.watches[vm] = _Watch()
+            # a fresh context, the loop must not share the VBoxManage output
+            # captured for the request that happened to start it
+            watch.task = detachTask(self._run(vm, watch))
+        queue = asyncio.Queue(maxsize=maxsize)
+        watch._subscribers.add(queue)
+        try:
+            yield watch, queue
+        finally:
+            watch._subscribers.discard(queue)
+            if not watch._subscribers and self.watches.get(vm) is watch:
+                del self.watches[vm]
+                watch.task.cancel()
+
+    async def wait(self, vm, pattern="*", value=None, timeout=60):
+        """
+        Returns the properties matching pattern (and value) as soon as there
+        are any, {} if there still aren't after timeout seconds
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        with self.subscribe(vm) as (watch, changes):
+            while True:
+                if watch.properties is not None:
+                    found = matchProperties(watch.properties, pattern, value)
+                    if found:
+                        return found
+                elif watch.error is not None:
+                    raise watch.error
+                try:
+                    await asyncio.wait_for(changes.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return {}
+
+    async def stop(self):
+        tasks = [watch.task for watch in self.watches.values()]
+        self.watches.clear()
+        await cancelTasks(tasks)
+
+    def status(self):
+        return {
+            vm: {
+                "clients": len(watch._subscribers),
+                "properties": None if watch.properties is None else len(watch.properties),
+                "error": None if watch.error is None else str(watch.error),
+            }
+            for vm, watch in self.watches.items()
+        }
+
+    def _publish(self, vm, watch, names):
+        if self.changed is not None:
+            self.changed(vm)
+        publish(watch._subscribers, names)
+
+    async def _run(self, vm, watch):
+        while True:
+            try:
+                properties = await self.enumerate(vm)
+                first = watch.properties is None
+                known = watch.properties or {}
+                names = {
+                    name
+                    for name in properties.keys() | known.keys()
+                    if not name in properties
+                    or not name in known
+                    or properties[name]["value"] != known[name]["value"]
+                }
+                watch.properties = properties
+                watch.error = None
+                if names or first:
+                    self._publish(vm, watch, names)
+                await self.wait_change(vm, self.interval)
+            except Exception as e:
+                watch.error = e
+                self._publish(vm, watch, set())
+                await asyncio.sleep(self.retry_interval)
@@ -0,0 +1,178 @@
+import asyncio, contextlib, time, uuid
+from collections import OrderedDict
+from fastapi import HTTPException
+from .vboxtasks import cancelTasks, publish
+
+
+class Job:
+    """
+    A batch of items run through the same coroutine function, with per-item
+    progress, timing and failures
+    """
+
+    def __init__(self, kind, items, func):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.created = time.time()
+        self.finished = None
+        self.items = OrderedDict(
+            (item, {"status": "queued", "queued": self.created}) for item in items
+        )
+        self._subscribers = set()
+
+    @property
+    def state(self):
+        statuses = {progress["status"] for progress in self.items.values()}
+        if statuses <= {"done", "failed"}:
+            return "done"
+        if statuses == {"queued"}:
+            return "queued"
+        return "running"
+
+    def status(self):
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for progress in self.items.values():
+            counts[progress["status"]] += 1
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "created": self.created,
+            "finished": self.finished,
+            "counts": counts,
+            "items": self.items,
+        }
+
+    @contextlib.contextmanager
+    def subscribe(self, maxsize=100):
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    def publish(self, item, **event):
+        """
+        Tells the subscribers about a change of an item, its status included
+        """
+        event = {"item": item, "status": self.items[item]["status"], **event}
+        publish(self._subscribers, event)
+
+
+class KeyedLock:
+    """
+    One FIFO lock per key: holders of the same key run one at a time in
+    arrival order, different keys don't wait for each other
+    """
+
+    def __init__(self):
+        # key -> [lock, holder and waiters]
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def depth(self, key):
+        """
+        Returns the number of operations running or waiting for a key
+        """
+        entry = self._locks.get(key)
+        return 0 if entry is None else entry[1]
+
+    def depths(self):
+        return {key: entry[1] for key, entry in self._locks.items()}
+
+
+class JobQueue:
+    """
+    Runs job items on a fixed pool of workers, optionally starting no more
+    than rate items per second
+    """
+
+    def __init__(self, workers=8, rate=0, history=100):
+        self.workers = workers
+        self.rate = rate
+        self.history = history
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+        self._rate_lock = None
+        self._next_start = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._rate_lock = asyncio.Lock()
+        for worker in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def stop(self):
+        await cancelTasks(self._tasks)
+        self._tasks = []
+
+    def submit(self, kind, items, func):
+        self.start()
+        job = Job(kind, items, func)
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.state != "done":
+                break
+            self.jobs.popitem(last=False)
+        for item in job.items:
+            self._queue.put_nowait((job, item))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def _throttle(self):
+        if not self.rate:
+            return
+        async with self._rate_lock:
+            now = time.monotonic()
+            if self._next_start > now:
+                await asyncio.sleep(self._next_start - now)
+            self._next_start = max(now, self._next_start) + 1 / self.rate
+
+    async def _work(self):
+        while True:
+            job, item = await self._queue.get()
+            progress = job.items[item]
+            try:
+                await self._throttle()
+                progress["status"] = "running"
+                progress["started"] = time.time()
+                job.publish(item)
+                progress["result"] = await job.func(item)
+                progress["status"] = "done"
+            except HTTPException as e:
+                progress["status"] = "failed"
+                progress["error"] = {"status": e.status_code, "detail": e.detail}
+            except Exception as e:
+                progress["status"] = "failed"
+                progress["error"] = {"status": 500, "detail": str(e)}
+            finally:
+                if "started" in progress:
+                    progress["finished"] = time.time()
+                    progress["duration"] = round(
+                        progress["finished"] - progress["started"], 3
+                    )
+                if job.state == "done" and job.finished is None:
+                    job.finished = time.time()
+                job.publish(item)
+                self._queue.task_done()
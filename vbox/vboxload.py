@@ -0,0 +1,270 @@
+"""
+Load generator for the API, run against the simulated VBoxManage with:
+
+    python -m vbox.vboxload --vms 1000 --concurrency 64
+
+Every route of vboxapi.app gets its own phase of --requests requests at
+--concurrency, reporting latency percentiles, throughput and how many
+VBoxManage processes each request spawned (background polling included).
+By default the app runs in-process with VBoxManagePath pointed at
+vbox.vboxfake; --url drives a running server instead (start it with the
+same VBOXFAKE_* environment and pass --spawns to count its processes).
+"""
+import asyncio, contextlib, json, os, statistics, sys, tempfile, time
+import click
+
+# routes the generator deliberately leaves alone
+Skipped = {
+    # endless event streams, not request/response routes
+    ("GET", "/machines/events"),
+    ("GET", "/jobs/{job_id}/events"),
+    # blocks until a guest boots, up to its timeout
+    ("GET", "/machines/{vm}/guestproperties/wait"),
+    # needs a running VM and guest credentials, and streams for as long as
+    # the guest command runs
+    ("POST", "/machines/{vm}/exec"),
+    # needs a VirtualBox settings directory, which the simulated host lacks
+    ("GET", "/admin/xml/check"),
+    # register new VMs on every request, the state file would only grow
+    ("POST", "/machines/{vm}/clone"),
+    ("POST", "/pool/{template}/lease"),
+    ("DELETE", "/pool/leases/{vm}"),
+    # run for minutes on a real host, and create media in the state file
+    ("POST", "/storage"),
+    ("POST", "/storage/{medium:path}/clone"),
+    ("PUT", "/storage/{medium:path}"),
+}
+
+
+def _routes(vms):
+    """
+    Returns [(method, path template, request factory)], the factory turning
+    a request number into (url, json body)
+    """
+
+    def vm(num):
+        return vms[num % len(vms)]
+
+    def control(num):
+        # walk every VM through start, pause, resume and poweroff
+        op = ("start", "pause", "resume", "poweroff")[num // len(vms) % 4]
+        return f"/machines/{vm(num)}/control", {"op": op}
+
+    def machines(num):
+        # the whole list, then filtered pages
+        queries = ("", "?running=true", "?group=/lab1&limit=50", "?name=vm00*&limit=20")
+        return "/machines" + queries[num % len(queries)], None
+
+    def bulk(num):
+        return "/machines/_bulk", {"machines": [vm(num + i) for i in range(10)]}
+
+    def bulk_guest(num):
+        return "/machines/_bulk/guestproperties", {
+            "machines": [vm(num + i) for i in range(10)],
+            "pattern": "/VirtualBox/GuestInfo/Net/*",
+        }
+
+    def bulk_control(num):
+        return "/machines/_bulk/control", {"machines": [vm(num)], "op": "poweroff"}
+
+    return [
+        ("GET", "/host", lambda num: ("/host", None)),
+        ("GET", "/host/extpacks", lambda num: ("/host/extpacks", None)),
+        ("GET", "/host/ostypes", lambda num: ("/host/ostypes", None)),
+        ("GET", "/host/properties", lambda num: ("/host/properties", None)),
+        ("GET", "/machines", machines),
+        ("POST", "/machines/_bulk", bulk),
+        ("GET", "/machines/{vm}", lambda num: (f"/machines/{vm(num)}", None)),
+        ("GET", "/dhcpservers", lambda num: ("/dhcpservers", None)),
+        ("GET", "/hostonlynets", lambda num: ("/hostonlynets", None)),
+        ("GET", "/intnets", lambda num: ("/intnets", None)),
+        ("GET", "/natnetworks", lambda num: ("/natnetworks", None)),
+        ("GET", "/networks/topology", lambda num: ("/networks/topology", None)),
+        ("GET", "/storage", lambda num: ("/storage", None)),
+        ("PUT", "/machines/{vm}/control", control),
+        ("POST", "/machines/_bulk/control", bulk_control),
+        ("GET", "/jobs", lambda num: ("/jobs", None)),
+        ("GET", "/jobs/{job_id}", None),
+        ("GET", "/admin/cache", lambda num: ("/admin/cache", None)),
+        ("GET", "/admin/flights", lambda num: ("/admin/flights", None)),
+        ("GET", "/admin/queues", lambda num: ("/admin/queues", None)),
+        ("DELETE", "/admin/cache", lambda num: ("/admin/cache?name=media", None)),
+        ("GET", "/metrics", lambda num: ("/metrics", None)),
+        ("GET", "/metrics/top", lambda num: ("/metrics/top?n=5", None)),
+        ("GET", "/machines/{vm}/metrics", lambda num: (f"/machines/{vm(num)}/metrics", None)),
+        ("GET", "/admin/metrics", lambda num: ("/admin/metrics", None)),
+        ("GET", "/admin/vboxmanage", lambda num: ("/admin/vboxmanage", None)),
+        ("GET", "/pool", lambda num: ("/pool", None)),
+        (
+            "GET",
+            "/machines/{vm}/guestproperties",
+            lambda num: (f"/machines/{vm(num)}/guestproperties", None),
+        ),
+        ("POST", "/machines/_bulk/guestproperties", bulk_guest),
+        ("GET", "/admin/guestproperties", lambda num: ("/admin/guestproperties", None)),
+        ("GET", "/admin/exec", lambda num: ("/admin/exec", None)),
+    ]
+
+
+def uncovered(app, routes):
+    """
+    Returns the (method, path) pairs of the app no phase exercises
+    """
+    covered = {(method, path) for method, path, factory in routes} | Skipped
+    missing = []
+    for route in app.routes:
+        for method in sorted(getattr(route, "methods", None) or ()):
+            if method in ("HEAD", "OPTIONS") or route.path.startswith(("/docs", "/openapi", "/redoc")):
+                continue
+            if not (method, route.path) in covered:
+                missing.append((method, route.path))
+    return missing
+
+
+def _spawned(path):
+    if not path:
+        return None
+    with contextlib.suppress(FileNotFoundError):
+        with open(path, "rb") as spawns:
+            return spawns.read().count(b"\n")
+    return 0
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def phase(client, factory, method, requests, concurrency, spawns=None):
+    """
+    Sends requests requests built by factory with at most concurrency in
+    flight, returning their latencies, status counts, wall time and spawns
+    """
+    latencies = []
+    statuses = {}
+    counter = iter(range(requests))
+    before = _spawned(spawns)
+
+    async def worker():
+        for num in counter:
+            url, body = factory(num)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for num in range(concurrency)])
+    wall = time.perf_counter() - start
+    after = _spawned(spawns)
+    latencies.sort()
+    return {
+        "requests": requests,
+        "statuses": statuses,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "mean": statistics.mean(latencies),
+        "rps": requests / wall,
+        "spawns": None if before is None else (after - before) / requests,
+    }
+
+
+async def run(client, vms, requests, concurrency, spawns=None, match=None):
+    results = {}
+    job_ids = []
+    for method, path, factory in _routes(vms):
+        if match and not match in path:
+            continue
+        if path == "/jobs/{job_id}":
+            if not job_ids:
+                response = await client.post(
+                    "/machines/_bulk/control", json={"machines": vms[:1], "op": "poweroff"}
+                )
+                job_ids.append(response.json()["job"])
+            factory = lambda num: (f"/jobs/{job_ids[num % len(job_ids)]}", None)
+        results[f"{method} {path}"] = await phase(
+            client, factory, method, requests, concurrency, spawns
+        )
+        if path == "/machines/_bulk/control":
+            response = await client.get("/jobs")
+            job_ids.extend(response.json())
+    return results
+
+
+def report(results):
+    print(
+        f"{'route':<34}{'reqs':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'rps':>9}{'spawns':>8}  statuses"
+    )
+    for name, result in results.items():
+        spawns = "-" if result["spawns"] is None else f"{result['spawns']:.2f}"
+        statuses = " ".join(f"{code}:{count}" for code, count in result["statuses"].items())
+        print(
+            f"{name:<34}{result['requests']:>6}{result['p50'] * 1e3:>9.1f}"
+            f"{result['p95'] * 1e3:>9.1f}{result['p99'] * 1e3:>9.1f}"
+            f"{result['rps']:>9.1f}{spawns:>8}  {statuses}"
+        )
+
+
+async def _inprocess(vms, requests, concurrency, match):
+    import httpx
+    from . import vboxapi, vboxfake
+
+    vboxapi.VBoxManagePath = [sys.executable, "-I", "-S", vboxfake.__file__]
+    missing = uncovered(vboxapi.app, _routes(vms))
+    if missing:
+        print(f"not exercised: {', '.join(' '.join(route) for route in missing)}")
+    transport = httpx.ASGITransport(app=vboxapi.app)
+    async with vboxapi._lifespan(vboxapi.app):
+        # let the watcher's initial poll finish so its spawns aren't charged
+        # to the first phase; the ones of later polls still are
+        while vboxapi.StateWatcherEnabled and not vboxapi._state_watcher.ready:
+            await asyncio.sleep(0.1)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://vboxload", timeout=None
+        ) as client:
+            return await run(
+                client, vms, requests, concurrency, os.environ["VBOXFAKE_SPAWNS"], match
+            )
+
+
+async def _remote(url, vms, requests, concurrency, spawns, match):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+        return await run(client, vms, requests, concurrency, spawns, match)
+
+
+@click.command()
+@click.option("--vms", default=1000, help="VMs on the simulated host.")
+@click.option("--requests", default=200, help="Requests per route.")
+@click.option("--concurrency", default=32, help="Requests in flight at once.")
+@click.option("--latency", default=1.0, help="Scale of the simulated VBoxManage latency.")
+@click.option("--url", default=None, help="Drive a running server instead.")
+@click.option("--spawns", default=None, help="VBOXFAKE_SPAWNS file of that server.")
+@click.option("-k", "match", default=None, help="Only run routes containing this.")
+@click.option("--json", "as_json", is_flag=True, help="Print raw results as JSON.")
+def main(vms, requests, concurrency, latency, url, spawns, match, as_json):
+    names = [f"vm{num:04d}" for num in range(vms)]
+    if url:
+        results = asyncio.run(_remote(url, names, requests, concurrency, spawns, match))
+    else:
+        workdir = tempfile.mkdtemp(prefix="vboxload-")
+        os.environ["VBOXFAKE_STATE"] = os.path.join(workdir, "state.json")
+        os.environ["VBOXFAKE_SPAWNS"] = os.path.join(workdir, "spawns")
+        os.environ["VBOXFAKE_VMS"] = str(vms)
+        os.environ["VBOXFAKE_LATENCY"] = str(latency)
+        results = asyncio.run(_inprocess(names, requests, concurrency, match))
+    if as_json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import asyncio, collections, re, time, uuid
+from .vboxtasks import cancelTasks, detachTask
+
+
+class WarmPool:
+    """
+    Keeps clones of template VMs ready to be handed out.
+
+    build(template, name) must create the VM and leave it ready,
+    recycle(template, name) bring a returned one back to that state and
+    destroy(name) delete one that failed either. Missing VMs are built in
+    the background, at most concurrency of them (recycled ones included)
+    at a time across every template, so leasing never waits for VBoxManage.
+
+    existing() must return the names of the registered VMs: the pool VMs a
+    previous run left behind are adopted when it starts. Their leases only
+    lived in memory, so every one of them is recycled; those that can't be,
+    and any beyond the size of the pool, are destroyed.
+    """
+
+    def __init__(
+        self, build, recycle, destroy, existing=None, concurrency=2, retry_interval=30
+    ):
+        self.build = build
+        self.recycle = recycle
+        self.destroy = destroy
+        self.existing = existing
+        self.concurrency = concurrency
+        self.retry_interval = retry_interval
+        # template -> number of VMs kept ready
+        self.sizes = {}
+        # template -> names of the ready VMs, oldest first
+        self.ready = {}
+        # template -> VMs being built or recycled
+        self.pending = {}
+        # name -> lease
+        self.leases = {}
+        self.last_error = None
+        self._tasks = set()
+        self._limit = None
+        self._wakeup = None
+        self._task = None
+
+    def configure(self, sizes):
+        self.sizes = dict(sizes)
+        for template in self.sizes:
+            self.ready.setdefault(template, collections.deque())
+            self.pending.setdefault(template, 0)
+        self.wake()
+
+    def start(self):
+        if self._task is None:
+            self._limit = asyncio.Semaphore(self.concurrency)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # ready and leased VMs are left registered for the next start to adopt
+        await cancelTasks([self._task, *self._tasks])
+        self._tasks.clear()
+        self._task = None
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def lease(self, template, holder=None):
+        """
+        Returns the lease of a ready VM of the template, None if none is
+        ready, the VM replaced in the background
+        """
+        ready = self.ready.get(template)
+        if not ready:
+            return None
+        name = ready.popleft()
+        lease = {"name": name, "template": template, "holder": holder, "leased": time.time()}
+        self.leases[name] = lease
+        self.wake()
+        return lease
+
+    def release(self, name):
+        """
+        Recycles a leased VM in the background, returns its lease or None
+        if it isn't leased
+        """
+        lease = self.leases.pop(name, None)
+        if lease is not None:
+            self._spawn(lease["template"], name, recycled=True)
+        return lease
+
+    def status(self):
+        return {
+            template: {
+                "size": size,
+                "ready": list(self.ready[template]),
+                "pending": self.pending[template],
+                "leased": sum(
+                    lease["template"] == template for lease in self.leases.values()
+                ),
+            }
+            for template, size in self.sizes.items()
+        }
+
+    def _spawn(self, template, name, recycled=False):
+        self.pending[template] = self.pending.get(template, 0) + 1
+        self._track(self._prepare(template, name, recycled))
+
+    def _track(self, coroutine):
+        # release() runs in request handlers, don't hand their context down
+        task = detachTask(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _prepare(self, template, name, recycled):
+        try:
+            async with self._limit:
+                if recycled:
+                    await self.recycle(template, name)
+                else:
+                    await self.build(template, name)
+        except Exception as e:
+            self.last_error = f"{name}: {e}"
+            await self._discard(name)
+            if recycled:
+                # replaced right away, failed builds wait for the retry
+                self.wake()
+            return
+        finally:
+            self.pending[template] -= 1
+        if len(self.ready.get(template, ())) < self.sizes.get(template, 0):
+            self.ready[template].append(name)
+        else:
+            # the pool shrank or went away while it was being prepared
+            await self._discard(name)
+
+    async def _discard(self, name):
+        try:
+            await self.destroy(name)
+        except Exception as e:
+            self.last_error = f"{name}: {e}"
+
+    async def _adopt(self):
+        try:
+            names = await self.existing()
+        except Exception as e:
+            self.last_error = f"listing the VMs to adopt: {e}"
+            return False
+        for name in names:
+            for template in self.sizes:
+                if _poolName(template).fullmatch(name):
+                    self._spawn(template, name, recycled=True)
+        return True
+
+    async def _run(self):
+        # nothing is built before the VMs left behind are adopted
+        adopted = self.existing is None
+        while True:
+            self._wakeup.clear()
+            if not adopted:
+                adopted = await self._adopt()
+                if not adopted:
+                    await self._sleep()
+                    continue
+            for template, ready in self.ready.items():
+                # newest first, the oldest are the likeliest to have finished booting
+                while len(ready) > self.sizes.get(template, 0):
+                    self._track(self._discard(ready.pop()))
+            for template, size in self.sizes.items():
+                for missing in range(size - len(self.ready[template]) - self.pending[template]):
+                    self._spawn(template, f"{template}-pool-{uuid.uuid4().hex[:8]}")
+            await self._sleep()
+
+    async def _sleep(self):
+        # failed builds are retried when something changes or after a while
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.retry_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _poolName(template):
+    # the names _run gives the VMs of a template
+    return re.compile(re.escape(template) + "-pool-[0-9a-f]{8}")
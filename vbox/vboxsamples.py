@@ -0,0 +1,277 @@
+import asyncio, math, time
+from array import array
+from .vboxtasks import cancelTasks
+
+
+class Ring:
+    """
+    Fixed-size series of float32 values one step apart, kept in a flat array.
+
+    Values landing in the same step are averaged, steps without any value
+    are NaN. Only the slot number of the newest step is stored, the time of
+    every other slot follows from its position.
+    """
+
+    def __init__(self, size, step):
+        self.size = size
+        self.step = step
+        self.values = array("f", [math.nan]) * size
+        self.last = None
+        self._sum = 0.0
+        self._count = 0
+
+    def add(self, when, value):
+        slot = int(when // self.step)
+        if self.last is not None:
+            if slot < self.last:
+                # older than the step being filled, only late samples get here
+                return
+            if slot > self.last:
+                # blank the steps nobody reported in
+                for gap in range(self.last + 1, min(slot, self.last + self.size + 1)):
+                    self.values[gap % self.size] = math.nan
+                self._sum, self._count = 0.0, 0
+        self.last = slot
+        self._sum += value
+        self._count += 1
+        self.values[slot % self.size] = self._sum / self._count
+
+    def range(self, start, end):
+        """
+        Returns [(step start time, value)] of the steps between start and
+        end, gaps left out
+        """
+        if self.last is None:
+            return []
+        first = max(int(start // self.step), self.last - self.size + 1)
+        last = min(int(end // self.step), self.last)
+        samples = []
+        for slot in range(first, last + 1):
+            value = self.values[slot % self.size]
+            if not math.isnan(value):
+                # float32 keeps about 7 significant digits, don't pretend more
+                samples.append((slot * self.step, float(f"{value:.7g}")))
+        return samples
+
+    @property
+    def span(self):
+        return self.size * self.step
+
+
+class Series:
+    """
+    One metric of one object at several resolutions, from finest to coarsest
+    """
+
+    def __init__(self, unit, tiers):
+        self.unit = unit
+        # name -> Ring
+        self.tiers = {name: Ring(size, step) for name, (size, step) in tiers.items()}
+        self.updated = None
+
+    def add(self, when, value):
+        for ring in self.tiers.values():
+            ring.add(when, value)
+        self.updated = when
+
+    def tier(self, start, now):
+        """
+        Returns the name of the finest tier still holding start
+        """
+        for name, ring in self.tiers.items():
+            if now - ring.span <= start:
+                return name
+        return name
+
+
+def parseQuery(lines):
+    """
+    Returns [(object, metric, [values], unit)] from metrics query output,
+    aggregates (CPU/Load/User:avg) left out
+    """
+    samples = []
+    widths = None
+    for line in lines:
+        if widths is None:
+            # the dashes under the header give the column widths, object
+            # names may contain spaces
+            if line.startswith("-"):
+                widths = [len(dashes) for dashes in line.split(" ")]
+            continue
+        if not line.strip():
+            continue
+        obj = line[: widths[0]].strip()
+        metric = line[widths[0] + 1 : widths[0] + widths[1] + 1].strip()
+        if ":" in metric:
+            continue
+        values = []
+        unit = ""
+        for value in line[widths[0] + widths[1] + 2 :].split(","):
+            number = value.strip().rstrip("%")
+            number, _, unit = number.partition(" ")
+            if value.strip().endswith("%"):
+                unit = "%"
+            try:
+                values.append(float(number))
+            except ValueError:
+                continue
+        samples.append((obj, metric, values, unit))
+    return samples
+
+
+# seconds per sample of the aggregated tiers
+TierSteps = {"1m": 60, "1h": 3600}
+
+
+class MetricsSampler:
+    """
+    Collects VirtualBox performance metrics of the running VMs in the
+    background and keeps them in memory at several resolutions.
+
+    run(opts) must run a VBoxManage command and return its output lines,
+    running_vms() the names of the running VMs. Every interval a single
+    metrics query covers the whole host; metrics setup is repeated whenever
+    VMs started since the previous one, VirtualBox only collects metrics of
+    VMs that were running when it was set up.
+    """
+
+    def __init__(self, run, running_vms, metrics=(), interval=10, retention=None):
+        self.run = run
+        self.running_vms = running_vms
+        self.metrics = tuple(metrics)
+        self.interval = interval
+        # tier name -> samples kept, finest first
+        self.retention = retention or {"raw": 360, "1m": 1440, "1h": 168}
+        # object -> metric -> Series
+        self.series = {}
+        self.last_sample = None
+        self.last_error = None
+        self.samples = 0
+        self._set_up = set()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await cancelTasks([self._task])
+        self._task = None
+
+    async def sample(self):
+        running = set(await self.running_vms())
+        if not running:
+            self._set_up = set()
+            return
+        if not running <= self._set_up:
+            await self.run(
+                [
+                    "metrics",
+                    "setup",
+                    "--period",
+                    str(self.interval),
+                    "--samples",
+                    "1",
+                    "*",
+                    ",".join(self.metrics),
+                ]
+            )
+            self._set_up = running
+        now = time.time()
+        for obj, metric, values, unit in parseQuery(
+            await self.run(["metrics", "query", "*", ",".join(self.metrics)])
+        ):
+            if not values:
+                continue
+            metrics = self.series.setdefault(obj, {})
+            series = metrics.get(metric)
+            if series is None:
+                series = metrics[metric] = Series(unit, self.tiers())
+            series.add(now, values[-1])
+            self.samples += 1
+        self._expire(now)
+        self.last_sample = now
+
+    def tiers(self):
+        """
+        Returns {tier name: (samples kept, seconds per sample)}, the raw tier
+        taking one sample per interval
+        """
+        return {
+            name: (size, TierSteps.get(name, self.interval))
+            for name, size in self.retention.items()
+        }
+
+    def _expire(self, now):
+        # objects gone for longer than the coarsest tier reaches back
+        span = max(size * step for size, step in self.tiers().values())
+        for obj in list(self.series):
+            if all(series.updated < now - span for series in self.series[obj].values()):
+                del self.series[obj]
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sample()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def query(self, obj, metrics=None, start=None, end=None, tier=None):
+        """
+        Returns {metric: {"unit", "tier", "step", "samples"}} of an object,
+        None if nothing was collected for it
+        """
+        if not obj in self.series:
+            return None
+        now = time.time()
+        end = now if end is None else end
+        start = end - 3600 if start is None else start
+        result = {}
+        for metric, series in self.series[obj].items():
+            if metrics and not metric in metrics:
+                continue
+            name = tier or series.tier(start, now)
+            ring = series.tiers[name]
+            result[metric] = {
+                "unit": series.unit,
+                "tier": name,
+                "step": ring.step,
+                "samples": ring.range(start, end),
+            }
+        return result
+
+    def top(self, metric, count=10, window=300, exclude=("host",)):
+        """
+        Returns [(object, average over the last window seconds)] of the
+        count objects with the highest average
+        """
+        now = time.time()
+        averages = []
+        for obj, metrics in self.series.items():
+            series = metrics.get(metric)
+            if obj in exclude or series is None:
+                continue
+            name = series.tier(now - window, now)
+            samples = series.tiers[name].range(now - window, now)
+            if samples:
+                averages.append((obj, sum(value for when, value in samples) / len(samples)))
+        averages.sort(key=lambda average: average[1], reverse=True)
+        return averages[:count]
+
+    def stats(self):
+        return {
+            "objects": len(self.series),
+            "series": sum(len(metrics) for metrics in self.series.values()),
+            "bytes": sum(
+                ring.values.itemsize * ring.size
+                for metrics in self.series.values()
+                for series in metrics.values()
+                for ring in series.tiers.values()
+            ),
+            "samples": self.samples,
+            "last_sample": self.last_sample,
+            "last_error": self.last_error,
+        }
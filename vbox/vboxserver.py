@@ -0,0 +1,78 @@
+"""
+Runs the API under uvicorn, started with 'vbox server runserver'.
+
+Only the standard library is imported up front, uvicorn and the app itself
+are imported once the server starts, so that the other vbox commands (and
+vboxapi, which finds VBoxManage through this module) start quickly.
+"""
+import copy, os, shutil, sys
+
+# where VirtualBox installs VBoxManage, for when it isn't on the PATH
+InstallPaths = {
+    "darwin": ("/Applications/VirtualBox.app/Contents/MacOS/VBoxManage",),
+    "win32": (
+        os.path.join(
+            os.environ.get("ProgramFiles", r"C:\Program Files"),
+            "Oracle",
+            "VirtualBox",
+            "VBoxManage.exe",
+        ),
+    ),
+}
+
+
+def findVBoxManage():
+    """
+    Returns the VBoxManage to run: $VBOX_MANAGE, the one on the PATH or the
+    one where VirtualBox installs it, in that order
+    """
+    if os.environ.get("VBOX_MANAGE"):
+        return os.environ["VBOX_MANAGE"]
+    for name in ("VBoxManage", "vboxmanage"):
+        found = shutil.which(name)
+        if found:
+            return found
+    for path in InstallPaths.get(sys.platform, ()):
+        if os.path.exists(path):
+            return path
+    # not installed, the startup probe reports it
+    return "/usr/bin/VBoxManage"
+
+
+def run(
+    host="127.0.0.1",
+    port=8000,
+    workers=1,
+    log_level="info",
+    graceful_timeout=30,
+    vboxmanage=None,
+):
+    """
+    Serves the API until interrupted. uvloop and httptools are used when
+    installed; on SIGINT or SIGTERM requests in flight get graceful_timeout
+    seconds to finish before the background tasks are stopped
+    """
+    if vboxmanage:
+        # every worker imports the app itself, so pass it on through the environment
+        os.environ["VBOX_MANAGE"] = vboxmanage
+    import uvicorn
+    from uvicorn.config import LOGGING_CONFIG
+
+    # the vbox loggers log through uvicorn's handler, at the same level
+    log_config = copy.deepcopy(LOGGING_CONFIG)
+    log_config["loggers"]["vbox"] = {
+        "handlers": ["default"],
+        "level": log_level.upper(),
+        "propagate": False,
+    }
+    uvicorn.run(
+        "vbox.vboxapi:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        log_level=log_level,
+        log_config=log_config,
+        timeout_graceful_shutdown=graceful_timeout,
+    )
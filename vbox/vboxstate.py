@@ -0,0 +1,182 @@
+import asyncio, contextlib, time
+from .vboxtasks import cancelTasks, publish
+
+
+class StateWatcher:
+    """
+    Keeps a VM name/UUID -> state table fresh by polling in the background.
+
+    list_machines() must return ({name: uuid}, {running uuids}) and
+    machine_state(vm) the VMState of a single VM. States are only queried
+    for VMs whose running membership changed, plus a periodic sweep of
+    the running ones (running <-> paused doesn't change membership).
+    """
+
+    def __init__(
+        self,
+        list_machines,
+        machine_state,
+        min_interval=1,
+        max_interval=15,
+        sweep_interval=60,
+    ):
+        self.list_machines = list_machines
+        self.machine_state = machine_state
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.sweep_interval = sweep_interval
+        self.interval = min_interval
+        self.machines = {}
+        self.names = {}
+        # bumped whenever anything in the table changes
+        self.version = 0
+        self.last_poll = None
+        self.last_error = None
+        self._last_sweep = 0
+        self._subscribers = set()
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def ready(self):
+        if self.last_poll is None:
+            return False
+        return time.monotonic() - self.last_poll < self.max_interval * 3
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await cancelTasks([self._task])
+        self._task = None
+
+    def lookup(self, vm):
+        """
+        Returns the table entry for a VM name or UUID, None if unknown
+        """
+        uuid = self.names.get(vm, vm)
+        return self.machines.get(uuid)
+
+    def wake(self):
+        self.interval = self.min_interval
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def refresh(self, vm):
+        # called right after we changed a VM ourselves
+        entry = self.lookup(vm)
+        if entry is not None:
+            try:
+                state = await self.machine_state(vm)
+            except Exception:
+                # the next poll will pick it up
+                state = None
+            self._update(entry["uuid"], entry["name"], state)
+        self.wake()
+
+    @contextlib.contextmanager
+    def subscribe(self, maxsize=100):
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+    def _publish(self, event):
+        publish(self._subscribers, event)
+
+    def _update(self, uuid, name, state, running=None):
+        entry = self.machines.get(uuid)
+        if entry is None:
+            entry = self.machines[uuid] = {
+                "name": name,
+                "uuid": uuid,
+                "state": None,
+                "running": False,
+            }
+        self.names[name] = uuid
+        if entry["name"] != name or (running is not None and entry["running"] != running):
+            self.version += 1
+        entry["name"] = name
+        if running is not None:
+            entry["running"] = running
+        if state is None or state == entry["state"]:
+            return False
+        self.version += 1
+        previous = entry["state"]
+        entry["state"] = state
+        entry["changed"] = time.time()
+        # VMs found by the initial poll aren't transitions
+        if previous is not None or self.last_poll is not None:
+            self._publish(
+                {
+                    "vm": name,
+                    "uuid": uuid,
+                    "from": previous,
+                    "to": state,
+                    "time": entry["changed"],
+                }
+            )
+        return True
+
+    async def poll(self):
+        all_vms, running = await self.list_machines()
+        now = time.monotonic()
+        sweep = now - self._last_sweep >= self.sweep_interval
+        changed = False
+        stale = []
+        for name, uuid in all_vms.items():
+            entry = self.machines.get(uuid)
+            is_running = uuid in running
+            if entry is None or entry["running"] != is_running:
+                stale.append((name, uuid))
+            elif sweep and is_running:
+                stale.append((name, uuid))
+            self._update(uuid, name, None, running=is_running)
+        states = await asyncio.gather(
+            *[self.machine_state(uuid) for name, uuid in stale], return_exceptions=True
+        )
+        for (name, uuid), state in zip(stale, states):
+            if not isinstance(state, Exception):
+                changed = self._update(uuid, name, state) or changed
+        registered = set(all_vms.values())
+        for uuid in list(self.machines):
+            if uuid not in registered:
+                entry = self.machines.pop(uuid)
+                changed = True
+                self.version += 1
+                if self.names.get(entry["name"]) == uuid:
+                    del self.names[entry["name"]]
+                self._publish(
+                    {
+                        "vm": entry["name"],
+                        "uuid": uuid,
+                        "from": entry["state"],
+                        "to": "unregistered",
+                        "time": time.time(),
+                    }
+                )
+        if sweep:
+            self._last_sweep = now
+        self.last_poll = now
+        return changed
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                changed = await self.poll()
+                self.last_error = None
+            except Exception as e:
+                changed = False
+                self.last_error = str(e)
+            # poll quickly while things are moving, back off while they're not
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
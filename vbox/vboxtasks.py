@@ -0,0 +1,34 @@
+import asyncio, contextvars
+
+
+def publish(queues, event):
+    """
+    Puts an event on every subscriber queue without ever blocking the
+    publisher
+    """
+    for queue in queues:
+        if queue.full():
+            # slow consumer - drop its oldest event rather than block
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+def detachTask(coroutine):
+    """
+    Runs the coroutine in a task of its own with a fresh context, so it
+    doesn't carry the context variables of the request that started it
+    """
+    return contextvars.Context().run(asyncio.create_task, coroutine)
+
+
+async def cancelTasks(tasks):
+    """
+    Cancels the tasks (None entries skipped) and waits until all have ended
+    """
+    pending = {task for task in tasks if task is not None}
+    while pending:
+        for task in pending:
+            task.cancel()
+        # before Python 3.12 asyncio.wait_for drops a cancellation that
+        # arrives as the wrapped call finishes, so cancel stragglers again
+        done, pending = await asyncio.wait(pending, timeout=1)
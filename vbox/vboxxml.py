@@ -0,0 +1,788 @@
+"""
+Reads VM and medium configuration straight from VirtualBox.xml and the .vbox
+files of the registered VMs, the read-only fast path behind
+vboxapi.XMLBackend. VMs are rendered as showvminfo --machinereadable lines
+and media as list hdds/dvds/floppies records, so the regular parsers turn
+them into the same JSON. Every file is parsed again only once its inode,
+size or modification time changed.
+
+Only the configuration is on disk: runtime state (running, paused...) and
+the details of running VMs still have to come from VBoxManage.
+"""
+import os, struct, sys
+import xml.etree.ElementTree as ElementTree
+
+
+class XMLConfigError(Exception):
+    pass
+
+
+def findUserHome():
+    """
+    Returns the VirtualBox settings directory, looked up the way VirtualBox does
+    """
+    if os.environ.get("VBOX_USER_HOME"):
+        return os.environ["VBOX_USER_HOME"]
+    user = os.path.expanduser("~")
+    if sys.platform == "darwin":
+        return os.path.join(user, "Library", "VirtualBox")
+    legacy = os.path.join(user, ".VirtualBox")
+    if sys.platform == "win32":
+        return legacy
+    config = os.environ.get("XDG_CONFIG_HOME") or os.path.join(user, ".config")
+    current = os.path.join(config, "VirtualBox")
+    # older installations keep using ~/.VirtualBox until it is moved
+    if os.path.isdir(legacy) and not os.path.isdir(current):
+        return legacy
+    return current
+
+
+class FileCache:
+    """
+    Results of parse(path) per file, kept until the file's inode, size or
+    modification time changes
+    """
+
+    def __init__(self, parse):
+        self.parse = parse
+        self.parses = 0
+        self._entries = {}
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._entries.pop(path, None)
+            raise
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != key:
+            entry = self._entries[path] = (key, self.parse(path))
+            self.parses += 1
+        return entry[1]
+
+    def stats(self):
+        return {"files": len(self._entries), "parses": self.parses}
+
+
+def _load(path):
+    root = ElementTree.parse(path).getroot()
+    # every element lives in the http://www.virtualbox.org/ namespace
+    for element in root.iter():
+        element.tag = element.tag.rpartition("}")[2]
+    return root
+
+
+def _true(element, attribute, default=False):
+    if element is None or element.get(attribute) is None:
+        return default
+    return element.get(attribute).lower() in ("true", "yes", "1", "on")
+
+
+def _onoff(value):
+    return "on" if value else "off"
+
+
+def _uuid(value):
+    return value.strip("{}") if value else value
+
+
+def _absolute(base, path):
+    return os.path.normpath(os.path.join(base, os.path.expanduser(path)))
+
+
+def readCapacity(path):
+    """
+    Returns the virtual size in bytes of a VDI, VMDK, VHD or QCOW image,
+    None for anything else
+    """
+    with open(path, "rb") as image:
+        head = image.read(512)
+        if head[64:68] == b"\x7f\x10\xda\xbe":
+            # VDI: pre-header signature, the size follows the v1 header
+            return struct.unpack_from("<Q", head, 0x170)[0]
+        if head[:4] == b"KDMV":
+            # sparse VMDK extent, capacity in sectors
+            return struct.unpack_from("<Q", head, 12)[0] * 512
+        if head[:4] == b"QFI\xfb":
+            return struct.unpack_from(">Q", head, 24)[0]
+        if head.startswith(b"# Disk DescriptorFile"):
+            # flat/split VMDK descriptor: RW <sectors> FLAT "file" ...
+            sectors = 0
+            for line in head.decode("ascii", "replace").splitlines():
+                fields = line.split()
+                if len(fields) > 2 and fields[0] in ("RW", "RDONLY", "NOACCESS"):
+                    sectors += int(fields[1])
+            return sectors * 512
+        if head[:8] != b"conectix":
+            image.seek(-512, os.SEEK_END)
+            head = image.read(512)
+        if head[:8] == b"conectix":
+            # VHD footer (dynamic images also keep a copy at the start)
+            return struct.unpack_from(">Q", head, 48)[0]
+    return None
+
+
+def _parseMedia(registry, base, media):
+    """
+    Adds the media of a MediaRegistry element to media, as {uuid: record}
+    with relative locations resolved against base
+    """
+    if registry is None:
+        return media
+    sections = (
+        ("HardDisks", "HardDisk", "hdd"),
+        ("DVDImages", "Image", "dvddrive"),
+        ("FloppyImages", "Image", "fdd"),
+    )
+    for section, tag, device in sections:
+        for element in registry.findall(f"{section}/{tag}"):
+            _parseMedium(element, base, device, media)
+    return media
+
+
+def _parseMedium(element, base, device, media, parent=None):
+    uuid = _uuid(element.get("uuid"))
+    medium = {
+        "Device": device,
+        "parent": parent,
+        "location": _absolute(base, element.get("location", "")),
+        "format": element.get("format", "RAW"),
+        "type": element.get("type", "Readonly" if device == "dvddrive" else "Normal"),
+        "encrypted": element.find("Property[@name='CRYPT/KeyStore']") is not None,
+    }
+    media[uuid] = medium
+    # differencing images are nested inside their parent
+    for child in element.findall("HardDisk"):
+        _parseMedium(child, base, device, media, uuid)
+
+
+def _parseGlobal(path):
+    root = _load(path)
+    home = os.path.dirname(path)
+    machines = []
+    for entry in root.findall("Global/MachineRegistry/MachineEntry"):
+        machines.append((_uuid(entry.get("uuid")), _absolute(home, entry.get("src"))))
+    media = _parseMedia(root.find("Global/MediaRegistry"), home, {})
+    return {"machines": machines, "media": media}
+
+
+# showvminfo --machinereadable key, element below Machine, attribute, default
+# and the conversion of the attribute value
+_settings = (
+    ("memory", "Hardware/Memory", "RAMSize", "128", int),
+    ("pagefusion", "Hardware/Memory", "PageFusion", False, _onoff),
+    ("vram", "Hardware/Display", "VRAMSize", "8", int),
+    ("cpuexecutioncap", "Hardware/CPU", "executionCap", "100", int),
+    ("hpet", "Hardware/HPET", "enabled", False, _onoff),
+    ("chipset", "Hardware/Chipset", "type", "PIIX3", str.lower),
+    ("firmware", "Hardware/Firmware", "type", "BIOS", str),
+    ("cpus", "Hardware/CPU", "count", "1", int),
+    ("cpu-profile", "Hardware/CPU", "CpuProfile", "host", str),
+    ("cpuid-portability-level", "Hardware/CPU", "CpuIdPortabilityLevel", "0", int),
+    ("pae", "Hardware/CPU/PAE", "enabled", False, _onoff),
+    ("longmode", "Hardware/CPU/LongMode", "enabled", True, _onoff),
+    ("triplefaultreset", "Hardware/CPU/TripleFaultReset", "enabled", False, _onoff),
+    ("apic", "Hardware/CPU/APIC", "enabled", True, _onoff),
+    ("x2apic", "Hardware/CPU/X2APIC", "enabled", True, _onoff),
+    ("nested-hw-virt", "Hardware/CPU/NestedHWVirt", "enabled", False, _onoff),
+    ("bootmenu", "Hardware/BIOS/BootMenu", "mode", "MessageAndMenu", str.lower),
+    ("acpi", "Hardware/BIOS/ACPI", "enabled", True, _onoff),
+    ("ioapic", "Hardware/BIOS/IOAPIC", "enabled", False, _onoff),
+    ("biosapic", "Hardware/BIOS/APIC", "mode", "APIC", str.lower),
+    ("biossystemtimeoffset", "Hardware/BIOS/TimeOffset", "value", "0", int),
+    ("hwvirtex", "Hardware/CPU/HardwareVirtEx", "enabled", True, _onoff),
+    ("nestedpaging", "Hardware/CPU/HardwareVirtExNestedPaging", "enabled", True, _onoff),
+    ("largepages", "Hardware/CPU/HardwareVirtExLargePages", "enabled", True, _onoff),
+    ("vtxvpid", "Hardware/CPU/HardwareVirtExVPID", "enabled", True, _onoff),
+    ("vtxux", "Hardware/CPU/HardwareVirtExUX", "enabled", True, _onoff),
+    (
+        "virtvmsavevmload",
+        "Hardware/CPU/HardwareVirtExVirtVmsaveVmload",
+        "enabled",
+        True,
+        _onoff,
+    ),
+    ("paravirtprovider", "Hardware/Paravirt", "provider", "Default", str.lower),
+    ("graphicscontroller", "Hardware/Display", "controller", "VBoxVGA", str.lower),
+    ("monitorcount", "Hardware/Display", "monitorCount", "1", int),
+    ("accelerate3d", "Hardware/Display", "accelerate3D", False, _onoff),
+    ("accelerate2dvideo", "Hardware/Display", "accelerate2DVideo", False, _onoff),
+    ("teleporterenabled", "Teleporter", "enabled", False, _onoff),
+    ("teleporterport", "Teleporter", "port", "0", int),
+    ("teleporteraddress", "Teleporter", "address", "", str),
+    ("teleporterpassword", "Teleporter", "password", "", str),
+    ("tracing-enabled", "Debugging/Tracing", "enabled", False, _onoff),
+    ("tracing-allow-vm-access", "Debugging/Tracing", "allowTracingToAccessVM", False, _onoff),
+    ("tracing-config", "Debugging/Tracing", "config", "", str),
+    ("autostart-enabled", "Autostart", "enabled", False, _onoff),
+    ("autostart-delay", "Autostart", "delay", "0", int),
+    ("defaultfrontend", "Hardware/Frontend/Default", "type", "", str),
+    ("vmprocpriority", "Hardware/VMPriority", "value", "Default", str.lower),
+    ("clipboard", "Hardware/Clipboard", "mode", "Disabled", str.lower),
+    ("draganddrop", "Hardware/DragAndDrop", "mode", "Disabled", str.lower),
+    ("GuestMemoryBalloon", "Hardware/Guest", "memoryBalloonSize", "0", int),
+)
+
+# OS type family -> provider the default paravirtualization interface picks
+_paravirt_defaults = {"Windows": "hyperv", "Linux": "kvm", "FreeBSD": "kvm"}
+
+_boot_devices = {"Floppy": "floppy", "DVD": "dvd", "HardDisk": "disk", "Network": "net"}
+
+# StorageController type -> (--machinereadable type, ports, devices per port)
+_controller_types = {
+    "AHCI": ("IntelAhci", 30, 1),
+    "PIIX3": ("PIIX3", 2, 2),
+    "PIIX4": ("PIIX4", 2, 2),
+    "ICH6": ("ICH6", 2, 2),
+    "LsiLogic": ("LSILogic", 16, 1),
+    "BusLogic": ("BusLogic", 16, 1),
+    "LsiLogicSas": ("LSILogicSAS", 255, 1),
+    "I82078": ("I82078", 1, 2),
+    "USB": ("USB", 8, 1),
+    # VBoxManage reports NVMe controllers as unknown, see _getStoragePair
+    "NVMe": ("unknown", 255, 1),
+    "VirtioSCSI": ("VirtioSCSI", 256, 1),
+}
+
+# network Adapter attachment element -> (nic<N> value, setting naming the network)
+_attachments = {
+    "NAT": ("nat", "natnet"),
+    "BridgedInterface": ("bridged", "bridgeadapter"),
+    "InternalNetwork": ("intnet", "intnet"),
+    "HostOnlyInterface": ("hostonly", "hostonlyadapter"),
+    "GenericInterface": ("generic", "generic"),
+    "NATNetwork": ("natnetwork", "nat-network"),
+    "HostOnlyNetwork": ("hostonlynetwork", "hostonly-network"),
+    "CloudNetwork": ("cloudnetwork", "cloud-network"),
+}
+
+# network Adapter attachment element -> Attachment of the regular showvminfo
+# output, generic drivers are listed along with their properties
+_attachment_names = {
+    "NAT": "NAT",
+    "BridgedInterface": "Bridged Interface '{}'",
+    "InternalNetwork": "Internal Network '{}'",
+    "HostOnlyInterface": "Host-only Interface '{}'",
+    "NATNetwork": "NAT Network '{}'",
+    "HostOnlyNetwork": "Host-only Network '{}'",
+    "CloudNetwork": "Cloud Network '{}'",
+}
+
+# network Adapter promiscuousModePolicy -> Promisc Policy
+_promisc_policies = {"Deny": "deny", "AllowNetwork": "allow-vms", "AllowAll": "allow-all"}
+
+# NAT engine buffer settings and their NAT attributes
+_nat_buffers = (
+    ("sockSnd", "socksnd"),
+    ("sockRcv", "sockrcv"),
+    ("tcpWndSnd", "tcpsnd"),
+    ("tcpWndRcv", "tcprcv"),
+)
+
+
+def _parseSettings(machine, path):
+    folder = os.path.dirname(path)
+    groups = [group.get("name") for group in machine.findall("Groups/Group")]
+    uuid = _uuid(machine.get("uuid"))
+    hardware = machine.find("Hardware")
+    settings = [
+        ("name", machine.get("name")),
+        ("groups", ",".join(groups) or "/"),
+        ("ostype", machine.get("OSType", "Other")),
+        ("UUID", uuid),
+        ("CfgFile", path),
+        ("SnapFldr", _absolute(folder, machine.get("snapshotFolder", "Snapshots"))),
+        ("LogFldr", os.path.join(folder, "Logs")),
+        ("hardwareuuid", _uuid(hardware.get("uuid", uuid)) if hardware is not None else uuid),
+    ]
+    for key, where, attribute, default, convert in _settings:
+        element = machine.find(where)
+        if type(default) is bool:
+            settings.append((key, convert(_true(element, attribute, default))))
+            continue
+        value = default if element is None else element.get(attribute, default)
+        if value is not None:
+            settings.append((key, convert(value)))
+    nvram = machine.find("Hardware/BIOS/NVRAM")
+    nvram = nvram.get("path") if nvram is not None else None
+    settings.append(
+        ("BIOS NVRAM File", _absolute(folder, nvram or f"{machine.get('name')}.nvram"))
+    )
+    order = {}
+    for element in machine.findall("Hardware/Boot/Order"):
+        order[int(element.get("position"))] = _boot_devices.get(element.get("device"), "none")
+    if not order:
+        order = {1: "floppy", 2: "dvd", 3: "disk"}
+    for position in range(1, 5):
+        settings.append((f"boot{position}", order.get(position, "none")))
+    rtc = machine.find("Hardware/RTC")
+    utc = rtc is not None and rtc.get("localOrUTC") == "UTC"
+    settings.append(("rtcuseutc", _onoff(utc)))
+    if _true(machine, "aborted"):
+        state = "aborted"
+    elif machine.get("stateFile"):
+        state = "saved"
+    else:
+        state = "poweroff"
+    settings.append(("VMState", state))
+    changed = machine.get("lastStateChange")
+    if changed:
+        settings.append(("VMStateChangeTime", changed.rstrip("Z") + ".000000000"))
+    controllers = {
+        controller.get("type")
+        for controller in machine.findall("Hardware/USB/Controllers/Controller")
+    }
+    settings.append(("usb", _onoff("OHCI" in controllers)))
+    settings.append(("ehci", _onoff("EHCI" in controllers)))
+    settings.append(("xhci", _onoff("XHCI" in controllers)))
+    audio = machine.find("Hardware/AudioAdapter")
+    if _true(audio, "enabled"):
+        settings.append(("audio", audio.get("driver", "Null").lower()))
+    else:
+        settings.append(("audio", "none"))
+    settings.append(("audio_out", _onoff(_true(audio, "enabledOut"))))
+    settings.append(("audio_in", _onoff(_true(audio, "enabledIn"))))
+    # 7.0 keeps the recording settings in Recording, older versions in VideoCapture
+    recording = machine.find("Recording")
+    if recording is not None:
+        screens = recording.findall("Screen")
+        options = next(
+            (screen.get("options", "") for screen in screens if screen.get("id") == "0"),
+            "",
+        )
+    else:
+        recording = machine.find("Hardware/VideoCapture")
+        screens = [] if recording is None else [recording]
+        options = "" if recording is None else recording.get("options", "")
+    settings.append(("captureopts", options))
+    settings.append(("recording_enabled", _onoff(_true(recording, "enabled"))))
+    settings.append(("recording_screens", max(len(screens), 1)))
+    return settings
+
+
+_vrde_properties = (
+    "TCP/Ports",
+    "TCP/Address",
+    "VideoChannel/Enabled",
+    "VideoChannel/Quality",
+    "Client/DisableDisplay",
+)
+
+
+def _parseVRDE(machine):
+    display = machine.find("Hardware/RemoteDisplay")
+    if not _true(display, "enabled"):
+        return [("vrde", "off")]
+    properties = {
+        prop.get("name"): prop.get("value")
+        for prop in display.findall("VRDEProperties/Property")
+    }
+    ports = properties.get("TCP/Ports", "3389")
+    return [
+        ("vrde", "on"),
+        ("vrdeport", int(ports) if ports.isdigit() else -1),
+        ("vrdeports", ports),
+        ("vrdeaddress", properties.get("TCP/Address") or "0.0.0.0"),
+        ("vrdeauthtype", display.get("authType", "Null").lower()),
+        ("vrdemulticon", _onoff(_true(display, "allowMultiConnection"))),
+        ("vrdereusecon", _onoff(_true(display, "reuseSingleConnection"))),
+        ("vrdevideochannel", _onoff(properties.get("VideoChannel/Enabled") == "true")),
+    ] + [
+        (f"vrdeproperty[{name}]", properties.get(name, "<not set>"))
+        for name in _vrde_properties
+    ]
+
+
+def _parseStorage(machine):
+    controllers = []
+    # moved below Hardware with the 1.17 settings format
+    elements = machine.findall("Hardware/StorageControllers/StorageController")
+    elements += machine.findall("StorageControllers/StorageController")
+    for element in elements:
+        attachments = {}
+        for device in element.findall("AttachedDevice"):
+            slot = (int(device.get("port", 0)), int(device.get("device", 0)))
+            image = device.find("Image")
+            host = device.find("HostDrive")
+            if image is not None:
+                attachments[slot] = ("image", _uuid(image.get("uuid")))
+            elif host is not None:
+                attachments[slot] = ("host", host.get("src"))
+            else:
+                attachments[slot] = ("empty", None)
+        controllers.append(
+            {
+                "name": element.get("name"),
+                "type": element.get("type"),
+                "ports": int(element.get("PortCount", 1)),
+                "bootable": _true(element, "Bootable", True),
+                "attachments": attachments,
+            }
+        )
+    return controllers
+
+
+def _parseNics(machine):
+    chipset = machine.find("Hardware/Chipset")
+    slots = 36 if chipset is not None and chipset.get("type") == "ICH9" else 8
+    adapters = {
+        int(adapter.get("slot", 0)): adapter
+        for adapter in machine.findall("Hardware/Network/Adapter")
+    }
+    nics = []
+    for slot in range(slots):
+        num = slot + 1
+        adapter = adapters.get(slot)
+        if adapter is None or not _true(adapter, "enabled"):
+            nics.append((f"nic{num}", "none"))
+            continue
+        # the settings of the other attachment types are kept in DisabledModes
+        attachment = next(
+            (child for child in adapter if child.tag in _attachments), None
+        )
+        if attachment is None:
+            kind = "null"
+        else:
+            kind, setting = _attachments[attachment.tag]
+            if attachment.tag == "NAT":
+                network = attachment.get("network") or "nat"
+            elif attachment.tag == "GenericInterface":
+                network = attachment.get("driver", "")
+            else:
+                network = attachment.get("name", "")
+            nics.append((f"{setting}{num}", network))
+        nics += [
+            (f"macaddress{num}", adapter.get("MACAddress", "")),
+            (f"cableconnected{num}", _onoff(_true(adapter, "cable", True))),
+            (f"nic{num}", kind),
+            (f"nictype{num}", adapter.get("type", "Am79C973")),
+            (f"nicspeed{num}", str(int(adapter.get("speed", 0)) // 1000)),
+        ]
+        if kind == "nat":
+            nics.append(("mtu", attachment.get("mtu", "0")))
+            # 0 stands for the NAT engine default of 64 KB
+            for key, attribute in _nat_buffers:
+                nics.append((key, attachment.get(attribute, "0").lstrip("0") or "64"))
+            for rule, forward in enumerate(attachment.findall("Forwarding")):
+                proto = "udp" if forward.get("proto") == "0" else "tcp"
+                nics.append(
+                    (
+                        f"Forwarding({rule})",
+                        ",".join(
+                            (
+                                forward.get("name", ""),
+                                proto,
+                                forward.get("hostip", ""),
+                                forward.get("hostport", ""),
+                                forward.get("guestip", ""),
+                                forward.get("guestport", ""),
+                            )
+                        ),
+                    )
+                )
+        if _true(adapter, "trace"):
+            nics.append((f"nictrace{num}", "on"))
+            nics.append((f"nictracefile{num}", adapter.get("traceFile", "")))
+    return nics
+
+
+def _parseNicInfo(machine):
+    # the NIC lines of the regular showvminfo output, which unlike the
+    # --machinereadable ones include boot priority, promiscuous mode policy,
+    # bandwidth group and generic driver properties
+    chipset = machine.find("Hardware/Chipset")
+    slots = 36 if chipset is not None and chipset.get("type") == "ICH9" else 8
+    adapters = {
+        int(adapter.get("slot", 0)): adapter
+        for adapter in machine.findall("Hardware/Network/Adapter")
+    }
+    lines = []
+    for slot in range(slots):
+        num = slot + 1
+        prefix = f"NIC {num}:".ljust(29)
+        adapter = adapters.get(slot)
+        if adapter is None or not _true(adapter, "enabled"):
+            lines.append(f"{prefix}disabled")
+            continue
+        attachment = next(
+            (child for child in adapter if child.tag in _attachments), None
+        )
+        if attachment is None:
+            name = "none"
+        elif attachment.tag == "GenericInterface":
+            properties = ", ".join(
+                f"{prop.get('name')}='{prop.get('value', '')}'"
+                for prop in attachment.findall("Property")
+            )
+            name = f"Generic '{attachment.get('driver', '')}' {{ {properties} }}"
+        else:
+            name = _attachment_names[attachment.tag].format(attachment.get("name", ""))
+        trace = _onoff(_true(adapter, "trace"))
+        speed = int(adapter.get("speed", 0)) // 1000
+        lines.append(
+            f"{prefix}MAC: {adapter.get('MACAddress', '')}, Attachment: {name}, "
+            f"Cable connected: {_onoff(_true(adapter, 'cable', True))}, "
+            f"Trace: {trace} (file: {adapter.get('traceFile') or 'none'}), "
+            f"Type: {adapter.get('type', 'Am79C973')}, Reported speed: {speed} Mbps, "
+            f"Boot priority: {adapter.get('bootPriority', '0')}, "
+            "Promisc Policy: "
+            f"{_promisc_policies.get(adapter.get('promiscuousModePolicy'), 'deny')}, "
+            f"Bandwidth group: {adapter.get('bandwidthGroup') or 'none'}"
+        )
+        if attachment is not None and attachment.tag == "NAT":
+            snd, rcv, tcp_snd, tcp_rcv = (
+                attachment.get(attribute, "0").lstrip("0") or "64"
+                for key, attribute in _nat_buffers
+            )
+            lines.append(
+                f"NIC {num} Settings:  MTU: {attachment.get('mtu', '0')}, "
+                f"Socket (send: {snd}, receive: {rcv}), "
+                f"TCP Window (send:{tcp_snd}, receive: {tcp_rcv})"
+            )
+    return lines
+
+
+def _parseShares(machine):
+    shares = {}
+    for share in machine.findall("Hardware/SharedFolders/SharedFolder"):
+        mountpoint = share.get("autoMountPoint") or "none"
+        shares[share.get("name")] = {
+            "Path": share.get("hostPath"),
+            "Readonly": "false" if _true(share, "writable", True) else "true",
+            "Mountpoint": mountpoint,
+            "Automount": "true" if _true(share, "autoMount") else "false",
+        }
+    return shares
+
+
+def _parseMachine(path):
+    machine = _load(path).find("Machine")
+    if machine is None:
+        raise XMLConfigError(f"{path} holds no machine")
+    return {
+        "name": machine.get("name"),
+        "uuid": _uuid(machine.get("uuid")),
+        "settings": _parseSettings(machine, path),
+        "vrde": _parseVRDE(machine),
+        "storage": _parseStorage(machine),
+        "nics": _parseNics(machine),
+        "nicinfo": _parseNicInfo(machine),
+        "shares": _parseShares(machine),
+        "media": _parseMedia(machine.find("MediaRegistry"), os.path.dirname(path), {}),
+    }
+
+
+# parts of showVmInfo beyond the general settings
+_sections = ("vrde", "shares", "nics", "storage")
+
+
+def _line(key, value):
+    # numbers and unset properties are the only values VBoxManage doesn't quote
+    if type(value) is int or value == "<not set>":
+        return f"{key}={value}"
+    return f'{key}="{value}"'
+
+
+class XMLConfig:
+    """
+    The VMs and media registered in a VirtualBox settings directory
+    """
+
+    def __init__(self, home=None):
+        self.home = home or findUserHome()
+        self._global = FileCache(_parseGlobal)
+        self._machines = FileCache(_parseMachine)
+        self._capacities = FileCache(readCapacity)
+        # (registry it was built from, {name or UUID: settings file})
+        self._paths = None
+
+    def _registry(self):
+        path = os.path.join(self.home, "VirtualBox.xml")
+        try:
+            return self._global.get(path)
+        except (OSError, ElementTree.ParseError) as e:
+            raise XMLConfigError(f"cannot read {path}: {e}")
+
+    def machines(self):
+        """
+        Returns [(uuid, machine)] in registration order, machine being None
+        for VMs whose settings file can't be read
+        """
+        machines = []
+        for uuid, path in self._registry()["machines"]:
+            try:
+                machines.append((uuid, self._machines.get(path)))
+            except (OSError, ElementTree.ParseError, XMLConfigError):
+                machines.append((uuid, None))
+        return machines
+
+    def _index(self, rebuild=False):
+        # name and UUID -> settings file of every registered VM, rebuilt when
+        # VirtualBox.xml changes (and with it the registry FileCache returns)
+        registry = self._registry()
+        if rebuild or self._paths is None or self._paths[0] is not registry:
+            paths = {}
+            for uuid, path in registry["machines"]:
+                paths[uuid] = path
+                try:
+                    paths[self._machines.get(path)["name"]] = path
+                except (OSError, ElementTree.ParseError, XMLConfigError):
+                    pass
+            self._paths = (registry, paths)
+        return self._paths[1]
+
+    def machine(self, vm):
+        """
+        Returns the machine with the given name or UUID, None if unknown.
+        Only the settings file of that VM is read, the whole index is only
+        rebuilt when a name isn't (or no longer) where it was
+        """
+        for rebuild in (False, True):
+            path = self._index(rebuild).get(vm)
+            if path is None:
+                continue
+            try:
+                machine = self._machines.get(path)
+            except (OSError, ElementTree.ParseError, XMLConfigError):
+                continue
+            # renaming a VM doesn't always touch VirtualBox.xml
+            if vm in (machine["uuid"], machine["name"]):
+                return machine
+        return None
+
+    def listVms(self):
+        """
+        Returns {name: uuid} like list vms
+        """
+        vms = {}
+        for uuid, machine in self.machines():
+            vms["<inaccessible>" if machine is None else machine["name"]] = uuid
+        return vms
+
+    def listGroups(self):
+        """
+        Returns {name: [group]} of the VMs whose settings can be read
+        """
+        groups = {}
+        for uuid, machine in self.machines():
+            if machine is not None:
+                groups[machine["name"]] = dict(machine["settings"])["groups"].split(",")
+        return groups
+
+    def _media(self):
+        media = dict(self._registry()["media"])
+        for uuid, machine in self.machines():
+            if machine is not None:
+                media.update(machine["media"])
+        return media
+
+    def _capacity(self, medium):
+        try:
+            if medium["format"].upper() == "RAW":
+                size = os.path.getsize(medium["location"])
+            else:
+                size = self._capacities.get(medium["location"])
+        except (OSError, struct.error):
+            return False, 0
+        return True, size
+
+    def listMedia(self):
+        """
+        Returns {uuid: record} with the records of list hdds, dvds and floppies
+        """
+        records = {}
+        for uuid, medium in self._media().items():
+            record = {"Device": medium["Device"]}
+            if medium["parent"]:
+                record["Parent UUID"] = medium["parent"]
+            accessible, size = self._capacity(medium)
+            record["State"] = "created" if accessible else "inaccessible"
+            if medium["Device"] == "dvddrive":
+                record["Type"] = medium["type"].lower()
+            else:
+                base = "differencing" if medium["parent"] else "base"
+                record["Type"] = f"{medium['type'].lower()} ({base})"
+            record["Location"] = medium["location"]
+            record["Format"] = medium["format"]
+            if size is not None:
+                record["Capacity"] = f"{size >> 20} MBytes"
+            record["Encryption"] = "enabled" if medium["encrypted"] else "disabled"
+            records[uuid] = record
+        return records
+
+    def showVmInfo(self, machine, ostypes=None, sections=_sections):
+        """
+        Returns the showvminfo --machinereadable lines of a machine, ostypes
+        being the list ostypes records by ID, sections the parts to include
+        """
+        lines = []
+        family = None
+        for key, value in machine["settings"]:
+            if key == "ostype" and ostypes and value in ostypes:
+                family = ostypes[value].get("Family ID")
+                value = ostypes[value].get("Description", value)
+            lines.append(_line(key, value))
+            if key == "paravirtprovider":
+                if value == "default":
+                    value = _paravirt_defaults.get(family, "none")
+                elif value == "legacy":
+                    value = "minimal" if family == "MacOS" else "none"
+                lines.append(_line("effparavirtprovider", value))
+        if "vrde" in sections:
+            lines += [_line(key, value) for key, value in machine["vrde"]]
+        media = None
+        # the storage lines need the whole medium registry, skip them if unwanted
+        storage = machine["storage"] if "storage" in sections else []
+        for num, controller in enumerate(storage):
+            kind, max_ports, devices = _controller_types.get(
+                controller["type"], (controller["type"], controller["ports"], 1)
+            )
+            instance = [ctl["type"] for ctl in storage[:num]].count(
+                controller["type"]
+            )
+            lines += [
+                _line(f"storagecontrollername{num}", controller["name"]),
+                _line(f"storagecontrollertype{num}", kind),
+                _line(f"storagecontrollerinstance{num}", str(instance)),
+                _line(f"storagecontrollermaxportcount{num}", str(max_ports)),
+                _line(f"storagecontrollerportcount{num}", str(controller["ports"])),
+                _line(f"storagecontrollerbootable{num}", _onoff(controller["bootable"])),
+            ]
+        for controller in storage:
+            name = controller["name"]
+            devices = _controller_types.get(controller["type"], (None, None, 1))[2]
+            for port in range(controller["ports"]):
+                for device in range(devices):
+                    kind, value = controller["attachments"].get(
+                        (port, device), ("none", None)
+                    )
+                    # attachment keys are the only quoted ones
+                    slot = f'"{name}-{port}-{device}"'
+                    if kind == "image":
+                        if media is None:
+                            media = self._media()
+                        location = media.get(value, {}).get("location", "")
+                        lines.append(_line(slot, location))
+                        lines.append(_line(f'"{name}-ImageUUID-{port}-{device}"', value))
+                    elif kind == "host":
+                        lines.append(_line(slot, f"host:{value}"))
+                    elif kind == "empty":
+                        lines.append(_line(slot, "emptydrive"))
+                    else:
+                        lines.append(_line(slot, "none"))
+        if "nics" in sections:
+            lines += [_line(key, value) for key, value in machine["nics"]]
+        shares = machine["shares"] if "shares" in sections else {}
+        for num, (share, details) in enumerate(shares.items(), 1):
+            lines.append(_line(f"SharedFolderNameMachineMapping{num}", share))
+            lines.append(_line(f"SharedFolderPathMachineMapping{num}", details["Path"]))
+        return lines
+
+    def stats(self):
+        return {
+            "home": self.home,
+            "global": self._global.stats(),
+            "machines": self._machines.stats(),
+            "capacities": self._capacities.stats(),
+        }